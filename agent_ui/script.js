@@ -1,3 +1,7 @@
+// 'sync'    -> POST /verify, decision comes back in the response
+// 'watcher' -> POST /upload, watcher.py verifies, result is pushed over /events (SSE)
+const VERIFY_MODE = 'sync';
+
 document.addEventListener('DOMContentLoaded', () => {
     // 🔒 AUTH CHECK
     const currentUserId = sessionStorage.getItem('voice_agent_id');
@@ -48,6 +52,8 @@ document.addEventListener('DOMContentLoaded', () => {
     // State
     let callTimerInterval;
     let verificationTimeout;
+    // One id per answered call; the server flags a clip reused across calls as a replay
+    let callId = null;
 
     // Simulation: Incoming Call
     simulateBtn.addEventListener('click', () => {
@@ -67,6 +73,8 @@ document.addEventListener('DOMContentLoaded', () => {
         infoPlaceholder.classList.add('hidden');
         customerDetails.classList.remove('hidden');
 
+        callId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `call-${Date.now()}`;
+
         // Start call timer
         startCallTimer();
 
@@ -241,24 +249,33 @@ document.addEventListener('DOMContentLoaded', () => {
             console.warn("No User ID found in session");
         }
 
-        fetch('http://localhost:5000/upload', {
+        const endpoint = VERIFY_MODE === 'sync' ? 'verify' : 'upload';
+
+        // Subscribe before uploading so the decision is shown the moment it is made
+        const requestId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+        formData.append("request_id", requestId);
+        if (callId) formData.append("call_id", callId);
+        const events = VERIFY_MODE === 'sync' ? null : subscribeResult(requestId);
+
+        fetch(`http://localhost:5000/${endpoint}`, {
             method: 'POST',
             body: formData
         })
             .then(response => {
-                if (response.ok) {
-                    statusText.textContent = "✅ Audio sent for verification";
-                    verificationResult.innerHTML = '<i class="fa-solid fa-clock"></i> Waiting for analysis...';
-                    verificationResult.className = "verification-result";
-                    verificationResult.classList.remove('hidden');
-
-                    // Poll for result
-                    pollStatus();
-                } else {
+                if (!response.ok) {
                     throw new Error("Upload failed");
                 }
+                statusText.textContent = "✅ Audio sent for verification";
+                verificationResult.innerHTML = '<i class="fa-solid fa-clock"></i> Waiting for analysis...';
+                verificationResult.className = "verification-result";
+                verificationResult.classList.remove('hidden');
+
+                if (VERIFY_MODE === 'sync') {
+                    return response.json().then(showResult);
+                }
             })
             .catch(error => {
+                if (events) events.close();
                 console.error("Upload error:", error);
                 statusText.textContent = "❌ Upload Failed";
                 verificationResult.innerHTML = '<i class="fa-solid fa-triangle-exclamation"></i> Server Error';
@@ -267,44 +284,62 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     }
 
-    function pollStatus() {
-        let attempts = 0;
-        const maxAttempts = 20; // 20 seconds timeout
-
-        const interval = setInterval(() => {
-            attempts++;
-            if (attempts > maxAttempts) {
-                clearInterval(interval);
-                statusText.textContent = "⚠️ Verification Timeout";
-                return;
-            }
-
-            fetch('http://localhost:5000/check_status')
-                .then(res => res.json())
-                .then(data => {
-                    if (data.status === 'verified') {
-                        clearInterval(interval);
-                        statusText.textContent = "Verification Complete";
-                        verificationResult.innerHTML = `<i class="fa-solid fa-check-circle"></i> Identity Verified (${Math.round(data.similarity * 100)}%)`;
-                        verificationResult.className = "verification-result success";
-                        verificationBadge.textContent = "Verified";
-                        verificationBadge.className = "badge verified";
-                    } else if (data.status === 'failed') {
-                        clearInterval(interval);
-                        statusText.textContent = "Verification Failed";
-                        verificationResult.innerHTML = `<i class="fa-solid fa-triangle-exclamation"></i> Identity Mismatch (${Math.round(data.similarity * 100)}%)`;
-                        verificationResult.className = "verification-result error";
-                        verificationBadge.textContent = "Failed";
-                        verificationBadge.className = "badge failed";
-
-                        // SILENT AUTO HANGUP
-                        setTimeout(() => {
-                            console.log("Auto-terminating call due to verification failure");
-                            hangupBtn.click();
-                        }, 2000);
-                    }
-                })
-                .catch(err => console.error("Polling error:", err));
-        }, 1000);
+    // Renders a verification decision; returns true once a final result was shown
+    function showResult(data) {
+        if (data.status === 'verified') {
+            statusText.textContent = "Verification Complete";
+            verificationResult.innerHTML = `<i class="fa-solid fa-check-circle"></i> Identity Verified (${Math.round(data.similarity * 100)}%)`;
+            verificationResult.className = "verification-result success";
+            verificationBadge.textContent = "Verified";
+            verificationBadge.className = "badge verified";
+            return true;
+        }
+        if (!data.status || data.status === 'waiting') {
+            return false;
+        }
+
+        const reasons = {
+            spoof: 'Spoofed Voice Detected',
+            replay: 'Replayed Recording Detected',
+            not_enrolled: 'User Not Enrolled',
+            no_speech: 'No Speech Detected'
+        };
+        const reason = reasons[data.status] || `Identity Mismatch (${Math.round((data.similarity || 0) * 100)}%)`;
+
+        statusText.textContent = "Verification Failed";
+        verificationResult.innerHTML = `<i class="fa-solid fa-triangle-exclamation"></i> ${reason}`;
+        verificationResult.className = "verification-result error";
+        verificationBadge.textContent = "Failed";
+        verificationBadge.className = "badge failed";
+
+        // SILENT AUTO HANGUP
+        setTimeout(() => {
+            console.log("Auto-terminating call due to verification failure");
+            hangupBtn.click();
+        }, 2000);
+        return true;
+    }
+
+    function subscribeResult(requestId) {
+        const source = new EventSource(`http://localhost:5000/events?request_id=${encodeURIComponent(requestId)}&timeout=20`);
+
+        // EventSource reconnects by itself after a dropped connection; the server
+        // keeps recent results, so a reconnect still receives the decision
+        const giveUp = setTimeout(() => {
+            source.close();
+            statusText.textContent = "⚠️ Verification Timeout";
+        }, 25000);
+
+        source.addEventListener('result', (e) => {
+            clearTimeout(giveUp);
+            source.close();
+            showResult(JSON.parse(e.data));
+        });
+        source.addEventListener('timeout', () => {
+            clearTimeout(giveUp);
+            source.close();
+            statusText.textContent = "⚠️ Verification Timeout";
+        });
+        return source;
     }
 });
@@ -1,96 +1,157 @@
 # antispoof.py
+import os
+import time
+
 import numpy as np
-import librosa
+from features import FeatureContext
 
-def energy_spoof_check(audio):
+def energy_spoof_check(audio, ctx=None):
     """Checks if the audio energy is too consistent (low variance), typical of recordings."""
-    energy = np.square(audio)
-    return np.std(energy) < 0.0005
+    ctx = ctx or FeatureContext(audio)
+    return ctx.energy_std < 0.0005
 
-def silence_spoof_check(audio, sr):
+def silence_spoof_check(audio, sr, ctx=None):
     """Checks if the audio is too continuous without natural pauses."""
-    intervals = librosa.effects.split(audio, top_db=25)
     if len(audio) == 0: return False
-    voiced_len = sum(end - start for start, end in intervals)
-    ratio = voiced_len / len(audio)
-    return ratio > 0.98
+    ctx = ctx or FeatureContext(audio, sr)
+    return ctx.voiced_ratio(top_db=25) > 0.98
 
-def pitch_spoof_check(audio, sr):
+def pitch_spoof_check(audio, sr, ctx=None):
     """Checks if the pitch is too monotonic (low variance)."""
-    pitches, _ = librosa.piptrack(y=audio, sr=sr)
-    pitch_vals = pitches[pitches > 0]
+    ctx = ctx or FeatureContext(audio, sr)
+    pitch_vals = ctx.pitch_values
     if len(pitch_vals) == 0:
         return True
     return np.var(pitch_vals) < 15
 
-def spectral_rolloff_check(audio, sr):
+def spectral_rolloff_check(audio, sr, ctx=None):
     """Replay devices (speakers) often lose high frequencies above 5-8kHz."""
-    rolloff = librosa.feature.spectral_rolloff(y=audio, sr=sr, roll_percent=0.85)[0]
+    ctx = ctx or FeatureContext(audio, sr)
     # If the 85% energy point is consistently low (< 3kHz), it's likely a replay
-    return np.mean(rolloff) < 3000
+    return ctx.rolloff_mean < 3000
 
-def spectral_centroid_check(audio, sr):
+def spectral_centroid_check(audio, sr, ctx=None):
     """AI voices often have unnatural spectral distributions."""
-    centroid = librosa.feature.spectral_centroid(y=audio, sr=sr)[0]
+    ctx = ctx or FeatureContext(audio, sr)
     # Real speech has higher spectral variance
-    return np.var(centroid) < 100000
+    return ctx.centroid_var < 100000
 
-def mfcc_variance_check(audio, sr):
+def mfcc_variance_check(audio, sr, ctx=None):
     """AI voices often have extremely smooth Feature transitions."""
-    mfccs = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=13)
-    # Calculate the variance of the delta (change) in MFCCs
-    delta_mfcc = librosa.feature.delta(mfccs)
-    return np.mean(np.var(delta_mfcc, axis=1)) < 2.0
+    ctx = ctx or FeatureContext(audio, sr)
+    # Variance of the delta (change) in MFCCs
+    return ctx.mfcc_delta_var < 2.0
+
+SPOOF_THRESHOLD = 4
+
+# =============================
+# CASCADE
+# =============================
+# name -> (weight, value_key, evaluate(ctx) -> (value, triggered)).
+# Each check adds its weight to the score when triggered; >= SPOOF_THRESHOLD is a spoof.
+def _energy(ctx):
+    value = ctx.energy_std
+    return value, value < 0.0005
+
+def _silence(ctx):
+    value = ctx.voiced_ratio(top_db=25)
+    return value, value > 0.98
+
+def _pitch(ctx):
+    pitch_vals = ctx.pitch_values
+    value = np.var(pitch_vals) if len(pitch_vals) > 0 else 0
+    return value, len(pitch_vals) > 0 and value < 15
+
+def _rolloff(ctx):
+    value = ctx.rolloff_mean
+    return value, value < 3000
+
+def _centroid(ctx):
+    value = ctx.centroid_var
+    return value, value < 100000
+
+def _mfcc(ctx):
+    value = ctx.mfcc_delta_var
+    return value, value < 2.0
+
+CHECKS = {
+    "energy": (1, "energy_var", _energy),
+    "silence": (1, "silence_ratio", _silence),
+    "pitch": (1, "pitch_var", _pitch),
+    "rolloff": (2, "rolloff", _rolloff),
+    "centroid": (2, "centroid_var", _centroid),
+    "mfcc_var": (3, "mfcc_var", _mfcc),
+}
+
+# Cheapest first: frame energies, then the shared STFT features, then MFCCs; piptrack last
+DEFAULT_ORDER = ("energy", "silence", "rolloff", "centroid", "mfcc_var", "pitch")
 
-def anti_spoof(audio, sr):
+def _order_from_env():
+    names = [n.strip() for n in os.getenv("ANTI_SPOOF_ORDER", "").split(",") if n.strip()]
+    unknown = [n for n in names if n not in CHECKS]
+    if unknown:
+        raise ValueError(f"Unknown anti-spoof checks in ANTI_SPOOF_ORDER: {unknown}")
+    # Checks left out of the configured order still run, after the listed ones
+    return tuple(names) + tuple(n for n in DEFAULT_ORDER if n not in names)
+
+CHECK_ORDER = _order_from_env()
+# cascade: stop once the decision is certain; full: always evaluate every check
+ANTI_SPOOF_MODE = os.getenv("ANTI_SPOOF_MODE", "cascade")
+
+def anti_spoof(audio, sr, ctx=None):
     """
     Enhanced anti-spoofing using a weighted scoring system.
     Returns True if the audio is likely spoofed (replay or AI).
+    Pass a FeatureContext for the same audio to reuse its STFT and frame energies.
+    """
+    return anti_spoof_report(audio, sr, ctx=ctx)["spoofed"]
+
+def anti_spoof_report(audio, sr, ctx=None, order=None, mode=None):
+    """
+    Same decision as scoring every check, returning the score, triggered checks,
+    the values that were computed and per-check timings. In cascade mode checks
+    run in `order` and stop once the remaining weights can no longer change the outcome.
     """
+    order = order or CHECK_ORDER
+    mode = mode or ANTI_SPOOF_MODE
+    ctx = ctx or FeatureContext(audio, sr)
+
     score = 0
+    remaining = sum(CHECKS[name][0] for name in order)
     details = []
-    
-    # Calculate values
-    energy_var = np.std(np.square(audio))
-    
-    intervals = librosa.effects.split(audio, top_db=25)
-    voiced_len = sum(end - start for start, end in intervals)
-    silence_ratio = voiced_len / len(audio) if len(audio) > 0 else 0
-    
-    pitches, _ = librosa.piptrack(y=audio, sr=sr)
-    pitch_vals = pitches[pitches > 0]
-    pitch_var = np.var(pitch_vals) if len(pitch_vals) > 0 else 0
-    
-    rolloff = np.mean(librosa.feature.spectral_rolloff(y=audio, sr=sr, roll_percent=0.85)[0])
-    centroid_var = np.var(librosa.feature.spectral_centroid(y=audio, sr=sr)[0])
-    
-    mfccs = librosa.feature.mfcc(y=audio, sr=sr, n_mfcc=13)
-    delta_mfcc = librosa.feature.delta(mfccs)
-    mfcc_var = np.mean(np.var(delta_mfcc, axis=1))
+    values = {}
+    timings = {}
+    skipped = []
+
+    for i, name in enumerate(order):
+        if mode == "cascade" and (score >= SPOOF_THRESHOLD or score + remaining < SPOOF_THRESHOLD):
+            skipped = list(order[i:])
+            break
+
+        weight, key, evaluate = CHECKS[name]
+        started = time.perf_counter()
+        value, triggered = evaluate(ctx)
+        timings[name] = round((time.perf_counter() - started) * 1000, 3)
+
+        values[key] = float(value)
+        remaining -= weight
+        if triggered:
+            score += weight
+            details.append(f"{name}(+{weight})")
 
     # Log values for tuning
-    print(f"[DEBUG] Anti-spoof values: EnergyVar={energy_var:.6f}, SilenceRatio={silence_ratio:.2f}, PitchVar={pitch_var:.2f}, Rolloff={rolloff:.0f}, CentroidVar={centroid_var:.0f}, MFCCVar={mfcc_var:.4f}")
-
-    # Checks
-    if energy_var < 0.0005: 
-        score += 1
-        details.append("energy(+1)")
-    if silence_ratio > 0.98: 
-        score += 1
-        details.append("silence(+1)")
-    if pitch_var < 15 and len(pitch_vals) > 0: 
-        score += 1
-        details.append("pitch(+1)")
-    if rolloff < 3000: 
-        score += 2
-        details.append("rolloff(+2)")
-    if centroid_var < 100000: 
-        score += 2
-        details.append("centroid(+2)")
-    if mfcc_var < 2.0: 
-        score += 3
-        details.append("mfcc_var(+3)")
-    
-    # Threshold for detection
-    print(f"[INFO] Anti-spoofing analysis score: {score} | Checks triggered: {', '.join(details) if details else 'none'}")
-    return score >= 4
+    print(f"[DEBUG] Anti-spoof values: {', '.join(f'{k}={v:.4f}' for k, v in values.items())}")
+    print(
+        f"[INFO] Anti-spoofing analysis score: {score} | Checks triggered: {', '.join(details) if details else 'none'}"
+        + (f" | Skipped: {', '.join(skipped)}" if skipped else "")
+    )
+    return {
+        "spoofed": score >= SPOOF_THRESHOLD,
+        "score": score,
+        "threshold": SPOOF_THRESHOLD,
+        "checks": details,
+        "values": values,
+        "skipped": skipped,
+        "timings_ms": timings,
+        "mode": mode,
+    }
@@ -0,0 +1,122 @@
+# audio_io.py
+import io
+import os
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+import soundfile as sf
+
+from lazy_imports import lazy_import
+librosa = lazy_import("librosa")
+scipy_signal = lazy_import("scipy.signal")
+
+TARGET_SR = 16000
+
+
+class AudioDecodeError(ValueError):
+    """Input could not be decoded or is unusable (empty, too short)."""
+
+
+def _as_seekable(source):
+    """Paths pass through; bytes and non-seekable streams become BytesIO."""
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek") and (not hasattr(source, "seekable") or source.seekable()):
+        return source
+    return io.BytesIO(source.read())
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def probe(source):
+    """Reads only the header. Returns soundfile's info object, or None if libsndfile cannot parse it."""
+    source = _as_seekable(source)
+    try:
+        return sf.info(source)
+    except (RuntimeError, TypeError):
+        return None
+    finally:
+        _rewind(source)
+
+
+@lru_cache(maxsize=32)
+def _resample_filter(up, down):
+    # Same low-pass design scipy.signal.resample_poly uses by default, computed once per ratio
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return scipy_signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+
+
+def resample(audio, orig_sr, target_sr=TARGET_SR):
+    """Polyphase resampling with a cached anti-aliasing filter."""
+    if orig_sr == target_sr:
+        return audio
+    g = gcd(int(orig_sr), int(target_sr))
+    up, down = int(target_sr) // g, int(orig_sr) // g
+    out = scipy_signal.resample_poly(audio, up, down, axis=-1, window=_resample_filter(up, down).copy())
+    return out.astype(np.float32, copy=False)
+
+
+def to_mono(audio):
+    """Accepts [samples], [samples, channels] (soundfile layout)."""
+    if audio.ndim == 1:
+        return audio
+    if audio.shape[1] == 1:
+        return audio[:, 0]
+    return audio.mean(axis=1)
+
+
+def load_audio(source, target_sr=TARGET_SR, sr=None, min_duration=None):
+    """
+    Decodes a path, bytes, file-like object or NumPy array to mono float32 at target_sr.
+
+    The header is read first: empty or too-short inputs are rejected before
+    decoding, and 16 kHz mono input is returned without resampling. Formats
+    libsndfile cannot parse fall back to librosa.load.
+    Returns (audio, target_sr); raises AudioDecodeError.
+    """
+    if isinstance(source, np.ndarray):
+        audio = source.astype(np.float32, copy=False)
+        if audio.ndim > 1:
+            # librosa layout is [channels, samples]
+            audio = audio.mean(axis=0)
+        if len(audio) == 0:
+            raise AudioDecodeError("Empty audio")
+        if min_duration and len(audio) / (sr or target_sr) < min_duration:
+            raise AudioDecodeError(f"Audio too short ({len(audio) / (sr or target_sr):.2f}s < {min_duration}s)")
+        return resample(audio, sr or target_sr, target_sr), target_sr
+
+    source = _as_seekable(source)
+    info = probe(source)
+
+    if info is None:
+        # e.g. MP3 on older libsndfile
+        try:
+            audio, _ = librosa.load(source, sr=target_sr, mono=True)
+        except Exception as e:
+            raise AudioDecodeError(f"Could not decode audio: {e}") from e
+        if len(audio) == 0:
+            raise AudioDecodeError("Empty audio")
+        if min_duration and len(audio) / target_sr < min_duration:
+            raise AudioDecodeError(f"Audio too short ({len(audio) / target_sr:.2f}s < {min_duration}s)")
+        return audio, target_sr
+
+    if info.frames <= 0 or info.samplerate <= 0:
+        raise AudioDecodeError("Empty audio")
+    duration = info.frames / info.samplerate
+    if min_duration and duration < min_duration:
+        raise AudioDecodeError(f"Audio too short ({duration:.2f}s < {min_duration}s)")
+
+    try:
+        audio, file_sr = sf.read(source, dtype="float32", always_2d=True)
+    except RuntimeError as e:
+        raise AudioDecodeError(f"Could not decode audio: {e}") from e
+
+    audio = to_mono(audio)
+    return resample(audio, file_sr, target_sr), target_sr
@@ -0,0 +1,175 @@
+# batch_inference.py
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+
+import numpy as np
+import torch
+
+
+def encode_signals(classifier, signals):
+    """
+    Embeds a list of 1-D float32 signals in one padded encode_batch call.
+    Returns an [N, D] array of L2-normalized embeddings.
+    """
+    lengths = [len(x) for x in signals]
+    max_len = max(lengths)
+
+    wavs = torch.zeros(len(signals), max_len)
+    for i, x in enumerate(signals):
+        wavs[i, : lengths[i]] = torch.from_numpy(x)
+    wav_lens = torch.tensor([n / max_len for n in lengths])
+
+    with torch.no_grad():
+        embeddings = classifier.encode_batch(wavs, wav_lens)
+
+    embeddings = embeddings.reshape(len(signals), -1).cpu().numpy()
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class _EmbeddingRequest:
+    __slots__ = ("signal", "done", "embedding", "error")
+
+    def __init__(self, signal):
+        self.signal = signal
+        self.done = threading.Event()
+        self.embedding = None
+        self.error = None
+
+
+class BatchedEmbedder:
+    """
+    Micro-batching front end for the ECAPA classifier.
+    Concurrent callers of embed() are collected for up to max_wait_ms, padded into
+    one [B, T] batch with relative lengths and sent through encode_batch once.
+    """
+
+    def __init__(self, classifier, max_batch_size=8, max_wait_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.classifier = classifier
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        # Batch fill stats
+        self.batch_count = 0
+        self.request_count = 0
+        self.recent_fills = deque(maxlen=1000)
+        _instances.add(self)
+
+    @classmethod
+    def from_env(cls, classifier):
+        return cls(
+            classifier,
+            max_batch_size=int(os.getenv("ECAPA_MAX_BATCH", "8")),
+            max_wait_ms=float(os.getenv("ECAPA_MAX_WAIT_MS", "5")),
+        )
+
+    def embed(self, audio):
+        """Returns the L2-normalized embedding of a mono 16 kHz signal."""
+        signal = np.ascontiguousarray(audio, dtype=np.float32).reshape(-1)
+        if signal.size == 0:
+            raise ValueError("Cannot embed an empty signal")
+
+        request = _EmbeddingRequest(signal)
+        self._ensure_worker()
+        self._queue.put(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.embedding
+
+    def embed_many(self, signals):
+        """Embeds many signals directly (offline jobs), max_batch_size per encode_batch call."""
+        signals = [np.ascontiguousarray(x, dtype=np.float32).reshape(-1) for x in signals]
+        if not signals:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # Batch similar lengths together to keep padding small
+        order = np.argsort([len(x) for x in signals])
+        out = [None] * len(signals)
+        for i in range(0, len(order), self.max_batch_size):
+            idx = order[i : i + self.max_batch_size]
+            for j, emb in zip(idx, encode_signals(self.classifier, [signals[k] for k in idx])):
+                out[j] = emb
+        return np.stack(out)
+
+    def stats(self):
+        fills = list(self.recent_fills)
+        return {
+            "batches": self.batch_count,
+            "requests": self.request_count,
+            "max_batch_size": self.max_batch_size,
+            "mean_fill": float(np.mean(fills)) if fills else 0.0,
+            "last_fill": fills[-1] if fills else 0.0,
+        }
+
+    def _reset_after_fork(self):
+        # The batcher thread does not exist in a forked child, and the queue/lock
+        # may have been copied mid-use; start clean and let embed() respawn it
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="ecapa-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._process(batch)
+
+    def _process(self, batch):
+        try:
+            embeddings = encode_signals(self.classifier, [r.signal for r in batch])
+            for r, emb in zip(batch, embeddings):
+                r.embedding = emb
+        except Exception as e:
+            for r in batch:
+                r.error = e
+        finally:
+            self.batch_count += 1
+            self.request_count += len(batch)
+            self.recent_fills.append(len(batch) / self.max_batch_size)
+            for r in batch:
+                r.done.set()
+
+
+_instances = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for embedder in list(_instances):
+        embedder._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,196 @@
+# benchmark.py
+"""
+Stage-level benchmark of the verification and enrollment pipelines.
+
+Runs on synthetic speech-like audio against the in-memory MongoDB/GridFS
+stand-ins, so no database or recordings are needed:
+
+    python benchmark.py --durations 2 5 10 --rates 8000 16000 44100 --json bench.json
+    python benchmark.py --compare bench.json      # compare a new run against a saved one
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+os.environ.setdefault("EMBEDDING_CACHE_WATCH", "0")
+
+from antispoof import anti_spoof_report
+from features import FeatureContext
+from memory_store import MemoryCollection, MemoryGridFS
+
+
+# =============================
+# SYNTHETIC AUDIO
+# =============================
+def synthetic_speech(duration, sr, seed=0):
+    """Voiced harmonics with a wandering pitch, syllable-rate envelope, pauses and noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sr)) / sr
+
+    f0 = 120 + 25 * np.sin(2 * np.pi * 0.7 * t) + 10 * rng.standard_normal() * np.sin(2 * np.pi * 3.1 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12) if k * 260 < sr / 2)
+
+    # ~4 syllables per second, with a pause every couple of seconds
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    envelope *= (np.sin(2 * np.pi * 0.4 * t) > -0.6)
+
+    audio = 0.3 * voiced * envelope + 0.005 * rng.standard_normal(len(t))
+    return (audio / np.max(np.abs(audio)) * 0.8).astype(np.float32)
+
+
+def wav_bytes(audio, sr):
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sr, subtype="PCM_16", format="WAV")
+    return buffer.getvalue()
+
+
+# =============================
+# MEASUREMENT
+# =============================
+def peak_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # KB on Linux, bytes on macOS
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except Exception:
+            return None
+
+
+def time_stage(fn, iterations, warmup):
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            fn()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    samples_ms = np.array(samples) * 1000
+    return {
+        "iterations": iterations,
+        "mean_ms": float(samples_ms.mean()),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+        "throughput_per_s": float(iterations / (samples_ms.sum() / 1000)),
+    }
+
+
+def bench_case(verifier, duration, sr, iterations, warmup):
+    user_id = f"bench_{duration}s_{sr}"
+    audio = synthetic_speech(duration, sr)
+    data = wav_bytes(audio, sr)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        verifier.enroll_user(data, user_id)
+        loaded, _ = verifier._load_audio(data)
+        speech = FeatureContext(loaded, verifier.SAMPLE_RATE).speech(top_db=30)
+        clean = verifier._reduce_noise(speech)
+
+    def lookup_cold():
+        verifier.embedding_cache.invalidate(user_id)
+        verifier._get_enrolled_embedding(user_id)
+
+    stages = {
+        "load": lambda: verifier._load_audio(data),
+        "split": lambda: FeatureContext(loaded, verifier.SAMPLE_RATE).speech(top_db=30),
+        "reduce_noise": lambda: verifier._reduce_noise(speech),
+        "anti_spoof": lambda: anti_spoof_report(clean, verifier.SAMPLE_RATE),
+        "anti_spoof_full": lambda: anti_spoof_report(clean, verifier.SAMPLE_RATE, mode="full"),
+        "encode_batch": lambda: verifier.embedder.embed(clean),
+        "lookup_cold": lookup_cold,
+        "lookup_warm": lambda: verifier._get_enrolled_embedding(user_id),
+        # Clip cache cleared so every iteration runs the full pipeline
+        "verify": lambda: (verifier.clip_cache.clear(), verifier.verify(data, user_id)),
+        "enroll": lambda: (verifier.clip_cache.clear(), verifier.enroll_user(data, user_id)),
+    }
+
+    results = {}
+    for name, fn in stages.items():
+        results[name] = time_stage(fn, iterations, warmup)
+    return results
+
+
+def print_table(run):
+    print(f"\n{'case':<14}{'stage':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}")
+    for case, stages in run["cases"].items():
+        for stage, r in stages.items():
+            print(f"{case:<14}{stage:<14}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['throughput_per_s']:>10.1f}")
+    print(f"\nPeak RSS: {run['peak_rss_mb']:.0f} MB" if run["peak_rss_mb"] else "\nPeak RSS: n/a")
+
+
+def print_comparison(run, baseline):
+    print(f"\n{'case':<14}{'stage':<14}{'base p50':>10}{'new p50':>10}{'change':>10}")
+    for case, stages in run["cases"].items():
+        for stage, r in stages.items():
+            base = baseline.get("cases", {}).get(case, {}).get(stage)
+            if not base:
+                continue
+            change = (r["p50_ms"] - base["p50_ms"]) / base["p50_ms"] * 100 if base["p50_ms"] else 0.0
+            print(f"{case:<14}{stage:<14}{base['p50_ms']:>10.2f}{r['p50_ms']:>10.2f}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice pipeline benchmark")
+    parser.add_argument("--durations", type=float, nargs="+", default=[2, 5, 10], help="Clip lengths in seconds")
+    parser.add_argument("--rates", type=int, nargs="+", default=[8000, 16000, 44100], help="Input sample rates")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file from an earlier run")
+    args = parser.parse_args()
+
+    os.makedirs("data", exist_ok=True)
+
+    from voice_verification_system import VoiceVerifier
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        verifier = VoiceVerifier(collection=MemoryCollection(), fs=MemoryGridFS())
+    model_load_s = time.perf_counter() - started
+
+    run = {
+        "timestamp": time.time(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "model_load_s": model_load_s,
+        "cases": {},
+    }
+    for sr in args.rates:
+        for duration in args.durations:
+            case = f"{duration:g}s@{sr}"
+            print(f"[INFO] Benchmarking {case}...")
+            run["cases"][case] = bench_case(verifier, duration, sr, args.iterations, args.warmup)
+
+    run["peak_rss_mb"] = peak_rss_mb()
+    run["batcher"] = verifier.embedder.stats()
+    run["embedding_cache"] = verifier.embedding_cache.stats()
+
+    print_table(run)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(run, json.load(f))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"[SUCCESS] Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# bulk_enroll.py
+"""
+Non-interactive bulk enrollment.
+
+    python bulk_enroll.py --dir recordings/          # recordings/<user_id>/*.wav or <user_id>_<take>.wav
+    python bulk_enroll.py --manifest agents.csv      # CSV with columns: path,user_id
+
+Audio is decoded and cleaned in a process pool, embedded in batches through
+the ECAPA model and written with bulk_write. Enrolled and failed files are
+appended to a state file; re-running the same command skips the enrolled ones
+and retries the failures. Each file's content hash is stored on the profile
+(sample_ids), so a chunk written just before a crash is not counted twice.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import soundfile as sf
+from dotenv import load_dotenv
+from gridfs.errors import FileExists
+
+from audio_io import AudioDecodeError, load_audio
+from features import FeatureContext
+from profile_store import add_samples_bulk, applied_sample_ids
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg")
+TARGET_SR = 16000
+
+
+# =============================
+# INPUT DISCOVERY
+# =============================
+def files_from_dir(root):
+    """
+    recordings/<user_id>/*.wav, or recordings/<user_id>_<take>.wav at the top level.
+    Only the last underscore separates the take, so user ids may contain underscores.
+    """
+    jobs = []
+    for entry in sorted(os.listdir(root)):
+        path = os.path.join(root, entry)
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    jobs.append((os.path.join(path, name), entry))
+        elif entry.lower().endswith(AUDIO_EXTENSIONS):
+            jobs.append((path, entry.rsplit("_", 1)[0] if "_" in entry else os.path.splitext(entry)[0]))
+    return jobs
+
+
+def files_from_manifest(manifest):
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, newline="") as f:
+        return [
+            (row["path"] if os.path.isabs(row["path"]) else os.path.join(base, row["path"]), row["user_id"].strip())
+            for row in csv.DictReader(f)
+            if row.get("path") and row.get("user_id")
+        ]
+
+
+# =============================
+# WORKER (decode + clean)
+# =============================
+def prepare(job):
+    """Runs in a worker process. Returns (path, user_id, cleaned_audio or None, error or None)."""
+    path, user_id = job
+    try:
+        import noisereduce as nr
+
+        audio, _ = load_audio(path, TARGET_SR)
+        speech = FeatureContext(audio, TARGET_SR).speech(top_db=30)
+        if len(speech) == 0:
+            return path, user_id, None, "No speech detected"
+        try:
+            cleaned = nr.reduce_noise(y=speech, sr=TARGET_SR, prop_decrease=0.7)
+        except Exception:
+            cleaned = speech
+        return path, user_id, np.asarray(cleaned, dtype=np.float32), None
+    except AudioDecodeError as e:
+        return path, user_id, None, str(e)
+    except Exception as e:
+        return path, user_id, None, f"{type(e).__name__}: {e}"
+
+
+# =============================
+# RESUME STATE
+# =============================
+def load_state(state_path):
+    """Returns (enrolled paths, paths whose last recorded attempt failed)."""
+    status = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    status[record["path"]] = record.get("status", "enrolled")
+                except (ValueError, KeyError):
+                    continue
+    done = {path for path, s in status.items() if s == "enrolled"}
+    return done, set(status) - done
+
+
+def append_state(state_path, records):
+    with open(state_path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+# =============================
+# WRITE
+# =============================
+def encode_wav(audio):
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, TARGET_SR, subtype="PCM_16", format="WAV")
+    buffer.seek(0)
+    return buffer
+
+
+def sample_id(path):
+    """Content hash of a recording; the same file always maps to the same sample."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_chunk(collection, fs, samples):
+    """
+    samples: list of (path, user_id, cleaned_audio, embedding).
+    Stores the cleaned audio in GridFS and adds each user's new embeddings to
+    the profile's running sum with the same atomic update as enroll_user.
+
+    Safe to repeat after a crash: samples already on the profile are dropped,
+    GridFS files get a deterministic _id, and the update itself is filtered on
+    sample_ids. Returns the number of samples added.
+    """
+    samples = [(path, user_id, audio, embedding, sample_id(path)) for path, user_id, audio, embedding in samples]
+    applied = applied_sample_ids(collection, {user_id for _, user_id, _, _, _ in samples})
+
+    by_user = {}
+    for path, user_id, audio, embedding, sid in samples:
+        if sid in applied.get(user_id, ()):
+            continue
+        entry = by_user.setdefault(user_id, {"embeddings": [], "ids": [], "file_id": None})
+        if sid in entry["ids"]:
+            continue
+        file_id = f"enrollment:{user_id}:{sid}"
+        if not fs.exists(file_id):
+            try:
+                fs.put(
+                    encode_wav(audio),
+                    _id=file_id,
+                    filename=f"{user_id}_enrollment.wav",
+                    contentType="audio/wav",
+                    metadata={"user_id": user_id, "type": "enrollment_voice", "source": os.path.basename(path), "timestamp": time.time()},
+                )
+            except FileExists:
+                pass
+        entry["embeddings"].append(embedding)
+        entry["ids"].append(sid)
+        entry["file_id"] = file_id
+
+    skipped = len(samples) - sum(len(e["ids"]) for e in by_user.values())
+    if skipped:
+        print(f"[INFO] {skipped} file(s) in this chunk were already on their profiles; skipped")
+    if not by_user:
+        return 0
+
+    add_samples_bulk(
+        collection,
+        {
+            user_id: (
+                np.stack(entry["embeddings"]).astype(np.float64).sum(axis=0),
+                len(entry["embeddings"]),
+                {"voice_file_id": entry["file_id"]},
+            )
+            for user_id, entry in by_user.items()
+        },
+        sample_ids={user_id: entry["ids"] for user_id, entry in by_user.items()},
+    )
+    return len(samples) - skipped
+
+
+# =============================
+# MAIN
+# =============================
+def run(jobs, collection, fs, embedder, workers, chunk_size, state_path):
+    done, retry = load_state(state_path)
+    pending = [j for j in jobs if os.path.abspath(j[0]) not in done]
+    retrying = sum(1 for j in pending if os.path.abspath(j[0]) in retry)
+    print(f"[INFO] {len(jobs)} files, {len(jobs) - len(pending)} already done, {len(pending)} to enroll ({retrying} retried after failing)")
+
+    started = time.perf_counter()
+    enrolled = failed = 0
+
+    chunks = [pending[i : i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Workers decode the next chunk while this one is embedded and written
+        futures = [pool.submit(prepare, job) for job in chunks[0]] if chunks else []
+        for n in range(len(chunks)):
+            prepared = [f.result() for f in futures]
+            futures = [pool.submit(prepare, job) for job in chunks[n + 1]] if n + 1 < len(chunks) else []
+
+            ok = [(p, u, a) for p, u, a, err in prepared if err is None]
+            records = []
+            for p, u, _, err in prepared:
+                if err is not None:
+                    failed += 1
+                    print(f"[WARNING] Skipped {p}: {err}")
+                    records.append({"path": os.path.abspath(p), "user_id": u, "status": "failed", "error": err})
+
+            if ok:
+                embeddings = embedder.embed_many([a for _, _, a in ok])
+                write_chunk(collection, fs, [(p, u, a, e) for (p, u, a), e in zip(ok, embeddings)])
+                enrolled += len(ok)
+                records.extend({"path": os.path.abspath(p), "user_id": u, "status": "enrolled"} for p, u, _ in ok)
+
+            append_state(state_path, records)
+
+            elapsed = time.perf_counter() - started
+            processed = enrolled + failed
+            print(f"[INFO] {processed}/{len(pending)} files | {processed / elapsed:.1f} files/s")
+
+    elapsed = time.perf_counter() - started
+    rate = (enrolled + failed) / elapsed if elapsed > 0 else 0.0
+    print(f"[SUCCESS] Enrolled {enrolled} files, {failed} failed in {elapsed:.1f}s ({rate:.1f} files/s)")
+    return enrolled, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk voice enrollment")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Directory of recordings")
+    source.add_argument("--manifest", help="CSV with path,user_id columns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode/clean processes")
+    parser.add_argument("--batch-size", type=int, default=16, help="Files per ECAPA batch")
+    parser.add_argument("--chunk-size", type=int, default=128, help="Files per write/checkpoint")
+    parser.add_argument("--state", default="bulk_enroll_state.jsonl", help="Resume state file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    jobs = files_from_dir(args.dir) if args.dir else files_from_manifest(args.manifest)
+
+    import db
+    from batch_inference import BatchedEmbedder
+    from model_loader import load_encoder
+
+    print("[INFO] Loading ECAPA-TDNN model...")
+    embedder = BatchedEmbedder(load_encoder(), max_batch_size=args.batch_size)
+
+    db.ensure_indexes()
+    run(jobs, db.get_collection(), db.get_gridfs(), embedder, args.workers, args.chunk_size, args.state)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+# calibrate.py
+"""
+Offline threshold calibration on a labeled corpus.
+
+    python calibrate.py --dir calls/                     # calls/<speaker>/*.wav or <speaker>_*.wav
+    python calibrate.py --manifest calls.csv --far 0.01 0.001 --det det.csv --json calibration.json
+
+Every file goes through the same decode / silence removal / noise reduction
+as verification (bulk_enroll.prepare, in a process pool) and is embedded in
+ECAPA batches. Embeddings are cached in an .npz keyed by path, size and mtime,
+so re-runs only embed new or changed files.
+
+All utterance pairs are trials (same speaker = target, otherwise impostor).
+Scores are computed as one matrix product per row block and accumulated
+into fine fixed-width histograms, so millions of trials need no per-pair
+work and memory stays bounded. From these it reports EER, minDCF and a DET
+curve, plus the threshold that meets each false-accept target, for raw
+cosine (VERIFY_THRESHOLD) and AS-norm (ASNORM_THRESHOLD) scoring.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+from dotenv import load_dotenv
+
+from bulk_enroll import files_from_dir, files_from_manifest, prepare
+
+# Histogram ranges; scores outside are counted in the edge bins
+SCORE_RANGES = {
+    "raw": (-1.0, 1.0, 20000),  # 1e-4 resolution
+    "asnorm": (-30.0, 70.0, 20000),  # 5e-3 resolution
+}
+ENV_VARS = {"raw": "VERIFY_THRESHOLD", "asnorm": "ASNORM_THRESHOLD"}
+
+
+# =============================
+# EMBEDDINGS (cached on disk)
+# =============================
+def _file_key(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def load_cache(cache_path, model_tag):
+    if not os.path.exists(cache_path):
+        return {}
+    data = np.load(cache_path, allow_pickle=False)
+    if str(data["model"]) != model_tag:
+        print(f"[WARNING] {cache_path} was built with {data['model']}, not {model_tag}; re-embedding")
+        return {}
+    return dict(zip(data["keys"].tolist(), data["embeddings"]))
+
+
+def save_cache(cache_path, model_tag, cached):
+    keys = sorted(cached)
+    embeddings = np.stack([cached[k] for k in keys]) if keys else np.zeros((0, 192), dtype=np.float32)
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, model=np.array(model_tag), keys=np.array(keys), embeddings=embeddings.astype(np.float32))
+    os.replace(tmp_path, cache_path)
+
+
+def embed_corpus(jobs, cache_path, workers, batch_size):
+    """Returns (embeddings [N, D], speaker labels [N]) for the files that had speech."""
+    from batch_inference import BatchedEmbedder
+    from model_loader import apply_inference_mode, configure_threads, load_encoder
+
+    def load_model(requested):
+        configure_threads()
+        print("[INFO] Loading ECAPA-TDNN model...")
+        encoder, effective, _ = apply_inference_mode(load_encoder(), requested)
+        return encoder, effective
+
+    keys = [_file_key(path) for path, _ in jobs]
+    # Calibrate the model the verifier will actually run. int8 can fall back to
+    # fp32, so the cache tag is the effective mode, known only after loading
+    mode = os.getenv("ECAPA_INFERENCE_MODE", "fp32")
+    encoder = None
+    if mode != "fp32":
+        encoder, mode = load_model(mode)
+    cached = load_cache(cache_path, mode)
+    missing = [(job, key) for job, key in zip(jobs, keys) if key not in cached]
+    print(f"[INFO] {len(jobs)} files, {len(jobs) - len(missing)} embeddings cached, {len(missing)} to embed")
+
+    if missing:
+        if encoder is None:
+            encoder, mode = load_model(mode)
+        embedder = BatchedEmbedder(encoder, max_batch_size=batch_size)
+
+        started = time.perf_counter()
+        chunks = [missing[i : i + batch_size * 8] for i in range(0, len(missing), batch_size * 8)]
+        failed = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Workers clean the next chunk while this one is embedded
+            futures = [pool.submit(prepare, job) for job, _ in chunks[0]]
+            for n, chunk in enumerate(chunks):
+                prepared = [f.result() for f in futures]
+                futures = [pool.submit(prepare, job) for job, _ in chunks[n + 1]] if n + 1 < len(chunks) else []
+
+                ok = [(key, audio) for (_, key), (path, _, audio, err) in zip(chunk, prepared) if err is None]
+                for path, _, _, err in prepared:
+                    if err is not None:
+                        failed += 1
+                        print(f"[WARNING] Skipped {path}: {err}")
+                if ok:
+                    for (key, _), embedding in zip(ok, embedder.embed_many([a for _, a in ok])):
+                        cached[key] = np.asarray(embedding, dtype=np.float32)
+                save_cache(cache_path, mode, cached)
+
+                done = sum(len(c) for c in chunks[: n + 1])
+                print(f"[INFO] {done}/{len(missing)} files | {done / (time.perf_counter() - started):.1f} files/s")
+        print(f"[SUCCESS] Embedded {len(missing) - failed} files ({failed} skipped) -> {cache_path}")
+
+    rows = [(cached[key], speaker) for key, (_, speaker) in zip(keys, jobs) if key in cached]
+    if not rows:
+        return np.zeros((0, 0), dtype=np.float32), np.array([])
+    embeddings = np.stack([r[0] for r in rows]).astype(np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings, np.array([r[1] for r in rows])
+
+
+# =============================
+# SCORING
+# =============================
+def _moments_excluding(top_sum, top_sq, top_min, excluded, k):
+    """
+    Mean/std of the top-k cohort scores with one cohort entry removed, from the
+    sum, sum of squares and minimum of the top-(k+1). excluded is that entry's
+    score: if it is among the top-(k+1) it drops out, else the (k+1)-th does.
+    """
+    removed = np.where(excluded >= top_min, excluded, top_min)
+    mean = (top_sum - removed) / k
+    var = (top_sq - removed * removed) / k - mean * mean
+    return mean, np.sqrt(np.maximum(var, 0.0))
+
+
+def asnorm_stats(embeddings, labels, top_k, block_size):
+    """
+    AS-norm cohort statistics against speaker-mean prints (like enrolled
+    profiles). CohortScorer excludes the claimed user from both the enrolled
+    and the probe cohort, so per utterance this keeps the top-(k+1) summary
+    from which score_histograms removes whichever speaker a trial claims.
+    """
+    speakers, codes = np.unique(labels, return_inverse=True)
+    means = np.zeros((len(speakers), embeddings.shape[1]), dtype=np.float32)
+    np.add.at(means, codes, embeddings)
+    means /= np.maximum(np.linalg.norm(means, axis=1, keepdims=True), 1e-12)
+
+    k = min(top_k, len(speakers) - 1)
+    top = np.zeros((len(embeddings), 3), dtype=np.float32)  # sum, sum of squares, min of the top-(k+1)
+    for start in range(0, len(embeddings), block_size):
+        block = embeddings[start : start + block_size] @ means.T
+        best = np.partition(block, -(k + 1), axis=1)[:, -(k + 1) :]
+        top[start : start + len(block)] = np.stack([best.sum(axis=1), (best * best).sum(axis=1), best.min(axis=1)], axis=1)
+
+    # Enrollment side: the claimed speaker is the utterance's own
+    own = np.einsum("ij,ij->i", embeddings, means[codes])
+    mu, sd = _moments_excluding(top[:, 0], top[:, 1], top[:, 2], own, k)
+    return {"means": means, "k": k, "top": top, "enroll": np.stack([mu, np.maximum(sd, 1e-6)], axis=1).astype(np.float32)}
+
+
+def score_histograms(embeddings, labels, block_size, stats=None):
+    """
+    Target / impostor score histograms over all pairs i < j, with i as the
+    enrollment and j as the probe. With stats, scores are AS-norm normalized
+    the way CohortScorer does it: i's speaker is left out of both cohorts.
+    Returns {kind: (target_counts, impostor_counts)}.
+    """
+    n = len(embeddings)
+    _, codes = np.unique(labels, return_inverse=True)
+    kinds = ["raw"] + (["asnorm"] if stats is not None else [])
+    hist = {kind: (np.zeros(SCORE_RANGES[kind][2], np.int64), np.zeros(SCORE_RANGES[kind][2], np.int64)) for kind in kinds}
+
+    for start in range(0, n - 1, block_size):
+        stop = min(start + block_size, n)
+        # Only columns right of the diagonal: each pair once, no self-trials
+        scores = embeddings[start:stop] @ embeddings[start + 1 :].T
+        cols = np.arange(start + 1, n)
+        upper = cols[None, :] > np.arange(start, stop)[:, None]
+        target = (codes[start:stop, None] == codes[None, start + 1 :])[upper]
+
+        for kind in kinds:
+            values = scores
+            if kind == "asnorm":
+                mu_e, sd_e = stats["enroll"][start:stop, :1], stats["enroll"][start:stop, 1:]
+                # Each probe's score against the claimed (row) speaker, removed from its cohort
+                claimed = stats["means"][codes[start:stop]] @ embeddings[start + 1 :].T
+                top = stats["top"][start + 1 :]
+                mu_p, sd_p = _moments_excluding(top[None, :, 0], top[None, :, 1], top[None, :, 2], claimed, stats["k"])
+                values = 0.5 * ((scores - mu_e) / sd_e + (scores - mu_p) / np.maximum(sd_p, 1e-6))
+            lo, hi, bins = SCORE_RANGES[kind]
+            idx = np.clip(((values[upper] - lo) * (bins / (hi - lo))).astype(np.int64), 0, bins - 1)
+            hist[kind][0][:] += np.bincount(idx[target], minlength=bins)
+            hist[kind][1][:] += np.bincount(idx[~target], minlength=bins)
+    return hist
+
+
+# =============================
+# METRICS
+# =============================
+def error_curves(target_counts, impostor_counts, kind):
+    """FAR/FRR when accepting scores >= each bin's lower edge."""
+    lo, hi, bins = SCORE_RANGES[kind]
+    thresholds = lo + np.arange(bins) * (hi - lo) / bins
+    frr = np.concatenate([[0], np.cumsum(target_counts)[:-1]]) / max(target_counts.sum(), 1)
+    far = np.cumsum(impostor_counts[::-1])[::-1] / max(impostor_counts.sum(), 1)
+    return thresholds, far, frr
+
+
+def metrics(target_counts, impostor_counts, kind, far_targets, p_target, c_miss, c_fa):
+    thresholds, far, frr = error_curves(target_counts, impostor_counts, kind)
+
+    i = int(np.argmin(np.abs(far - frr)))
+    dcf = c_miss * p_target * frr + c_fa * (1 - p_target) * far
+    dcf /= min(c_miss * p_target, c_fa * (1 - p_target))
+    j = int(np.argmin(dcf))
+
+    operating_points = []
+    for target in far_targets:
+        # Lowest threshold whose FAR meets the target (FAR falls as the threshold rises)
+        ok = np.nonzero(far <= target)[0]
+        if len(ok) == 0:
+            continue
+        k = int(ok[0])
+        operating_points.append({"far_target": target, "threshold": float(thresholds[k]), "far": float(far[k]), "frr": float(frr[k])})
+
+    return {
+        "target_trials": int(target_counts.sum()),
+        "impostor_trials": int(impostor_counts.sum()),
+        "eer": float((far[i] + frr[i]) / 2),
+        "eer_threshold": float(thresholds[i]),
+        "min_dcf": float(dcf[j]),
+        "min_dcf_threshold": float(thresholds[j]),
+        "operating_points": operating_points,
+    }
+
+
+def det_points(target_counts, impostor_counts, kind):
+    """DET curve: (threshold, far, frr, probit(far), probit(frr)) at each point where either rate changes."""
+    thresholds, far, frr = error_curves(target_counts, impostor_counts, kind)
+    change = np.nonzero((np.diff(far) != 0) | (np.diff(frr) != 0))[0] + 1
+    keep = np.concatenate([[0], change])
+    probit = NormalDist().inv_cdf
+    clip = lambda p: min(max(p, 1e-6), 1 - 1e-6)
+    return [(float(thresholds[k]), float(far[k]), float(frr[k]), probit(clip(far[k])), probit(clip(frr[k]))) for k in keep]
+
+
+def print_report(kind, report):
+    print(f"\n[INFO] {kind} scores ({report['target_trials']:,} target / {report['impostor_trials']:,} impostor trials)")
+    print(f"  EER     {report['eer'] * 100:6.2f}%   at threshold {report['eer_threshold']:.4f}")
+    print(f"  minDCF  {report['min_dcf']:6.4f}    at threshold {report['min_dcf_threshold']:.4f}")
+    for point in report["operating_points"]:
+        print(
+            f"  FAR <= {point['far_target']:<7g} {ENV_VARS[kind]}={point['threshold']:.4f} "
+            f"(FAR {point['far'] * 100:.3f}%, FRR {point['frr'] * 100:.2f}%)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate verification thresholds on a labeled corpus")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Directory of recordings (<speaker>/*.wav or <speaker>_*.wav)")
+    source.add_argument("--manifest", help="CSV with path,user_id columns")
+    parser.add_argument("--cache", default="calibration_embeddings.npz", help="Embedding cache file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode/clean processes")
+    parser.add_argument("--batch-size", type=int, default=16, help="Files per ECAPA batch")
+    parser.add_argument("--block-size", type=int, default=1024, help="Rows per score-matrix block")
+    parser.add_argument("--far", type=float, nargs="+", default=[0.01, 0.001, 0.0001], help="False-accept targets")
+    parser.add_argument("--p-target", type=float, default=0.01, help="minDCF target prior")
+    parser.add_argument("--c-miss", type=float, default=1.0)
+    parser.add_argument("--c-fa", type=float, default=1.0)
+    parser.add_argument("--top-k", type=int, default=int(os.getenv("COHORT_TOP_K", "200")), help="AS-norm cohort size")
+    parser.add_argument("--det", help="Write DET points (CSV) to this path; one file per score kind")
+    parser.add_argument("--json", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    jobs = files_from_dir(args.dir) if args.dir else files_from_manifest(args.manifest)
+    embeddings, labels = embed_corpus(jobs, args.cache, args.workers, args.batch_size)
+    speakers = len(set(labels.tolist()))
+    if speakers < 2:
+        raise SystemExit("[ERROR] Need utterances from at least 2 speakers")
+
+    started = time.perf_counter()
+    stats = asnorm_stats(embeddings, labels, args.top_k, args.block_size) if speakers > 2 else None
+    hist = score_histograms(embeddings, labels, args.block_size, stats)
+    pairs = len(embeddings) * (len(embeddings) - 1) // 2
+    print(f"[SUCCESS] Scored {pairs:,} trials ({len(embeddings)} utterances, {speakers} speakers) in {time.perf_counter() - started:.1f}s")
+
+    results = {}
+    for kind, (target_counts, impostor_counts) in hist.items():
+        if target_counts.sum() == 0:
+            print("[WARNING] No target trials; every speaker needs at least 2 utterances")
+            break
+        results[kind] = metrics(target_counts, impostor_counts, kind, args.far, args.p_target, args.c_miss, args.c_fa)
+        print_report(kind, results[kind])
+
+        if args.det:
+            root, ext = os.path.splitext(args.det)
+            path = f"{root}_{kind}{ext or '.csv'}"
+            with open(path, "w") as f:
+                f.write("threshold,far,frr,far_probit,frr_probit\n")
+                for point in det_points(target_counts, impostor_counts, kind):
+                    f.write(",".join(f"{v:.6g}" for v in point) + "\n")
+            print(f"[SUCCESS] DET curve written to {path}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"utterances": len(embeddings), "speakers": speakers, "results": results}, f, indent=2)
+        print(f"[SUCCESS] Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# cohort.py
+"""
+Adaptive score normalization (AS-norm) against an impostor cohort.
+
+The cohort is every enrolled voice print, held as one float32 matrix. For each
+enrolled user the mean/std of their top-k cohort scores is computed once and
+kept up to date as prints change, so a verification only needs one
+matrix-vector product for the probe:
+
+    s_norm = 0.5 * ((s - mu_enroll) / sd_enroll + (s - mu_probe) / sd_probe)
+
+The claimed user's own print is always excluded from both cohort sides.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from profile_store import read_embedding
+
+
+class CohortScorer:
+    def __init__(self, top_k=200, min_size=50, threshold=3.0, refresh_s=600.0, block_size=1024):
+        self.top_k = int(top_k)
+        self.min_size = int(min_size)
+        self.threshold = float(threshold)
+        self.refresh_s = float(refresh_s)
+        self.block_size = int(block_size)
+
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._ids = []
+        self._rows = {}
+        self._topk_idx = np.zeros((0, 0), dtype=np.int64)
+        self._topk_scores = np.zeros((0, 0), dtype=np.float32)
+        self._stats = np.zeros((0, 2), dtype=np.float32)
+        self._built_at = 0.0
+        self._refreshing = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            top_k=int(os.getenv("COHORT_TOP_K", "200")),
+            min_size=int(os.getenv("COHORT_MIN_SIZE", "50")),
+            threshold=float(os.getenv("ASNORM_THRESHOLD", "3.0")),
+            refresh_s=float(os.getenv("COHORT_REFRESH_SECONDS", "600")),
+        )
+
+    @property
+    def size(self):
+        return len(self._ids)
+
+    @property
+    def ready(self):
+        """Normalization needs enough impostors for the statistics to mean anything."""
+        return self.size >= self.min_size
+
+    # =============================
+    # BUILD
+    # =============================
+    def build(self, collection):
+        """Loads every enrolled print and computes all top-k cohort statistics."""
+        started = time.perf_counter()
+        ids, vectors = [], []
+        for doc in collection.find(
+            {"embedding": {"$exists": True}},
+            {"user_id": 1, "embedding": 1, "embedding_count": 1, "sample_count": 1},
+        ):
+            embedding = read_embedding(collection, doc)
+            if embedding is None:
+                continue
+            ids.append(doc["user_id"])
+            vectors.append(embedding / np.linalg.norm(embedding))
+
+        dim = len(vectors[0]) if vectors else 0
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), dim)
+        topk_idx, topk_scores = self._topk_all(matrix)
+
+        with self._lock:
+            self._matrix = matrix
+            self._ids = ids
+            self._rows = {user_id: i for i, user_id in enumerate(ids)}
+            self._topk_idx = topk_idx
+            self._topk_scores = topk_scores
+            self._stats = self._moments(topk_scores)
+            self._built_at = time.monotonic()
+        print(f"[INFO] Cohort built: {len(ids)} prints, top-{self.top_k} in {time.perf_counter() - started:.2f}s")
+
+    def refresh_if_stale(self, collection):
+        """Rebuilds in the background when older than refresh_s (picks up other processes' enrollments)."""
+        if self.refresh_s <= 0 or self._refreshing or time.monotonic() - self._built_at < self.refresh_s:
+            return
+        self._refreshing = True
+
+        def run():
+            try:
+                self.build(collection)
+            except Exception as e:
+                print(f"[WARNING] Cohort refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="cohort-refresh", daemon=True).start()
+
+    def _topk_all(self, matrix):
+        """Top-k cohort scores for every row, computed in row blocks to bound memory."""
+        n = len(matrix)
+        k = min(self.top_k, max(n - 1, 0))
+        idx = np.zeros((n, k), dtype=np.int64)
+        scores = np.zeros((n, k), dtype=np.float32)
+        if k == 0:
+            return idx, scores
+        for start in range(0, n, self.block_size):
+            block = matrix[start : start + self.block_size] @ matrix.T
+            rows = np.arange(len(block))
+            block[rows, start + rows] = -np.inf
+            part = np.argpartition(block, -k, axis=1)[:, -k:]
+            idx[start : start + len(block)] = part
+            scores[start : start + len(block)] = np.take_along_axis(block, part, axis=1)
+        return idx, scores
+
+    @staticmethod
+    def _moments(scores):
+        if scores.shape[1] == 0:
+            return np.zeros((len(scores), 2), dtype=np.float32)
+        return np.stack([scores.mean(axis=1), np.maximum(scores.std(axis=1), 1e-6)], axis=1).astype(np.float32)
+
+    # =============================
+    # INCREMENTAL UPDATE
+    # =============================
+    def update(self, user_id, embedding):
+        """
+        Adds or replaces user_id's print. Costs one matrix-vector product plus
+        a re-scan only for the few users whose top-k contained the old print.
+        """
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        embedding = embedding / np.linalg.norm(embedding)
+
+        with self._lock:
+            if self._matrix.shape[1] not in (0, len(embedding)):
+                raise ValueError(f"Embedding dim {len(embedding)} does not match cohort dim {self._matrix.shape[1]}")
+
+            row = self._rows.get(user_id)
+            if row is None:
+                row = len(self._ids)
+                self._ids.append(user_id)
+                self._rows[user_id] = row
+                self._matrix = np.vstack([self._matrix.reshape(row, len(embedding)), embedding[None, :]])
+            else:
+                self._matrix[row] = embedding
+
+            k = min(self.top_k, len(self._ids) - 1)
+            if k == 0:
+                # First print: nobody to compare against yet
+                n = len(self._ids)
+                self._topk_idx = np.zeros((n, 0), dtype=np.int64)
+                self._topk_scores = np.zeros((n, 0), dtype=np.float32)
+                self._stats = self._moments(self._topk_scores)
+                return
+            if k != self._topk_idx.shape[1]:
+                # Cohort still smaller than top_k: cheap to recompute exactly
+                self._topk_idx, self._topk_scores = self._topk_all(self._matrix)
+                self._stats = self._moments(self._topk_scores)
+                return
+            if row >= len(self._topk_idx):
+                self._topk_idx = np.vstack([self._topk_idx, np.zeros((1, k), dtype=np.int64)])
+                self._topk_scores = np.vstack([self._topk_scores, np.zeros((1, k), dtype=np.float32)])
+                self._stats = np.vstack([self._stats, np.zeros((1, 2), dtype=np.float32)])
+
+            scores = self._matrix @ embedding
+            scores[row] = -np.inf
+
+            # This user's own cohort statistics
+            part = np.argpartition(scores, -k)[-k:]
+            self._topk_idx[row] = part
+            self._topk_scores[row] = scores[part]
+
+            # Other users: the changed print either was in their top-k (rescore or rescan)
+            # or may now displace their weakest entry
+            others = np.arange(len(self._ids)) != row
+            holds = (self._topk_idx == row).any(axis=1) & others
+            worst = self._topk_scores.argmin(axis=1)
+            enters = ~holds & others & (scores > self._topk_scores[np.arange(len(scores)), worst])
+
+            for j in np.nonzero(enters)[0]:
+                self._topk_idx[j, worst[j]] = row
+                self._topk_scores[j, worst[j]] = scores[j]
+            if holds.any():
+                rescan = np.nonzero(holds)[0]
+                block = self._matrix[rescan] @ self._matrix.T
+                block[np.arange(len(rescan)), rescan] = -np.inf
+                part = np.argpartition(block, -k, axis=1)[:, -k:]
+                self._topk_idx[rescan] = part
+                self._topk_scores[rescan] = np.take_along_axis(block, part, axis=1)
+
+            changed = enters | holds
+            changed[row] = True
+            self._stats[changed] = self._moments(self._topk_scores[changed])
+
+    # =============================
+    # SCORING
+    # =============================
+    def normalize(self, user_id, enrolled, probe, raw_score):
+        """Returns the AS-norm score for raw_score = dot(enrolled, probe)."""
+        with self._lock:
+            matrix = self._matrix
+            row = self._rows.get(user_id)
+            k = min(self.top_k, len(self._ids) - (row is not None))
+
+            probe_scores = matrix @ np.asarray(probe, dtype=np.float32)
+            if row is not None:
+                probe_scores[row] = -np.inf
+                mu_e, sd_e = self._stats[row]
+            else:
+                # Enrolled elsewhere since the last build: compute on the fly
+                enrolled_scores = np.partition(matrix @ np.asarray(enrolled, dtype=np.float32), -k)[-k:]
+                mu_e, sd_e = enrolled_scores.mean(), max(enrolled_scores.std(), 1e-6)
+
+        top = np.partition(probe_scores, -k)[-k:]
+        mu_p, sd_p = top.mean(), max(top.std(), 1e-6)
+        return float(0.5 * ((raw_score - mu_e) / sd_e + (raw_score - mu_p) / sd_p))
+
+
+def self_check(dim=192, users=8, top_k=3):
+    """
+    Grows a cohort one print at a time from empty (the first AS-norm
+    enrollments) and checks the incremental top-k against a full recompute.
+    """
+    rng = np.random.default_rng(0)
+    scorer = CohortScorer(top_k=top_k, min_size=2)
+    for n in range(users):
+        scorer.update(f"user{n}", rng.standard_normal(dim))
+        assert scorer.size == n + 1
+        assert scorer._topk_idx.shape == (n + 1, min(top_k, n))
+    scorer.update("user0", rng.standard_normal(dim))
+
+    _, exact = scorer._topk_all(scorer._matrix)
+    assert np.allclose(np.sort(exact, axis=1), np.sort(scorer._topk_scores, axis=1))
+    probe = rng.standard_normal(dim).astype(np.float32)
+    probe /= np.linalg.norm(probe)
+    assert np.isfinite(scorer.normalize("user1", scorer._matrix[1], probe, float(scorer._matrix[1] @ probe)))
+    print(f"[SUCCESS] Cohort self-check passed ({users} users, top-{top_k})")
+
+
+if __name__ == "__main__":
+    self_check()
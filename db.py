@@ -0,0 +1,171 @@
+# db.py
+"""
+Shared MongoDB access for every entry point (server, watcher workers,
+enroll.py, bulk tools and VoiceVerifier).
+
+One pooled MongoClient per process, created on first use from MONGO_URI with
+the pool/timeout settings below. ensure_indexes() runs once per process.
+Reads use the projections defined here so hot paths never pull the full
+profile document, and user_exists() answers from a short-TTL cache.
+
+MONGO_URI=memory:// swaps in the process-local stand-ins from memory_store
+(for load tests and demos; nothing is persisted or shared between processes).
+"""
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from embedding_cache import LRUTTLCache
+
+DB_NAME = "voice_authentication"
+COLLECTION_NAME = "voice_prints"
+
+# Fields needed to score a verification (see profile_store.read_embedding)
+PROFILE_PROJECTION = {"embedding": 1, "embedding_count": 1, "sample_count": 1}
+EXISTS_PROJECTION = {"_id": 1}
+
+MEMORY_URI = "memory://"
+
+_client = None
+_memory = None
+_memory_mode = None
+_indexed = False
+_lock = threading.Lock()
+
+# Known users stay cached longer than unknown ones, so a new enrollment
+# elsewhere is visible to /login within USER_MISSING_TTL seconds
+_known_users = LRUTTLCache(max_size=10000, ttl=float(os.getenv("USER_EXISTS_TTL", "300")))
+_missing_users = LRUTTLCache(max_size=10000, ttl=float(os.getenv("USER_MISSING_TTL", "5")))
+
+
+def client_options():
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_MS", "60000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000")),
+        "retryWrites": True,
+        "appname": "voiceprint",
+    }
+
+
+def is_memory():
+    global _memory_mode
+    if _memory_mode is None:
+        load_dotenv()
+        _memory_mode = os.getenv("MONGO_URI", "").startswith(MEMORY_URI)
+    return _memory_mode
+
+
+def _memory_store():
+    global _memory
+    if _memory is None:
+        with _lock:
+            if _memory is None:
+                from memory_store import MemoryCollection, MemoryGridFS
+
+                print("[WARNING] MONGO_URI=memory:// - using the in-memory store, nothing is persisted")
+                _memory = {COLLECTION_NAME: MemoryCollection(), "fs": MemoryGridFS()}
+    return _memory
+
+
+def get_client():
+    """The pooled MongoClient (None with MONGO_URI=memory://)."""
+    global _client
+    if is_memory():
+        return None
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from pymongo import MongoClient
+
+                load_dotenv()
+                mongo_uri = os.getenv("MONGO_URI")
+                if not mongo_uri:
+                    raise RuntimeError("[ERROR] MONGO_URI missing")
+                _client = MongoClient(mongo_uri, **client_options())
+    return _client
+
+
+def reset_client(close=False):
+    """
+    Drops the process's client (e.g. in a forked child, where the parent's sockets
+    must not be reused). close=True also shuts its pool and monitor threads down.
+    """
+    global _client, _indexed
+    with _lock:
+        client, _client = _client, None
+        _indexed = False
+    if close and client is not None:
+        client.close()
+    _known_users.clear()
+    _missing_users.clear()
+
+
+def _after_fork_in_child():
+    global _lock
+    # The parent's lock may have been held by another thread at fork time
+    _lock = threading.Lock()
+    reset_client()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_db():
+    if is_memory():
+        return _memory_store()
+    return get_client()[DB_NAME]
+
+
+def get_collection():
+    return get_db()[COLLECTION_NAME]
+
+
+def get_gridfs():
+    if is_memory():
+        return _memory_store()["fs"]
+    import gridfs
+
+    return gridfs.GridFS(get_db())
+
+
+def ensure_indexes(collection=None):
+    """Creates the unique user_id index once per process."""
+    global _indexed
+    if _indexed and collection is None:
+        return
+    from profile_store import ensure_indexes as ensure_profile_indexes
+
+    ensure_profile_indexes(collection if collection is not None else get_collection())
+    if collection is None:
+        _indexed = True
+
+
+def find_profile(user_id, collection=None):
+    """Profile fields needed for scoring, or None."""
+    collection = collection if collection is not None else get_collection()
+    return collection.find_one({"user_id": user_id}, PROFILE_PROJECTION)
+
+
+def user_exists(user_id, collection=None):
+    """Index-only existence check behind a short-TTL cache."""
+    if _known_users.get(user_id):
+        return True
+    if _missing_users.get(user_id):
+        return False
+
+    collection = collection if collection is not None else get_collection()
+    exists = collection.find_one({"user_id": user_id}, EXISTS_PROJECTION) is not None
+    (_known_users if exists else _missing_users).put(user_id, True)
+    return exists
+
+
+def forget_user(user_id):
+    """Call after enrolling or deleting user_id in this process."""
+    _known_users.invalidate(user_id)
+    _missing_users.invalidate(user_id)
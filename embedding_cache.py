@@ -0,0 +1,296 @@
+# embedding_cache.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_store import decode_embedding
+
+
+class LRUTTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if self.ttl > 0 and expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """Like get(), but leaves the LRU order and hit/miss counters alone."""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or (self.ttl > 0 and entry[1] <= time.monotonic()):
+            return None
+        return entry[0]
+
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class EmbeddingCache:
+    """
+    Enrolled voice prints keyed by user_id, stored normalized as float32.
+    Entries are dropped on local enrollment writes and, when watch() is running,
+    on writes from other processes seen through a MongoDB change stream.
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self._cache = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self._doc_ids = {}
+        # Bumped by invalidate()/clear(); a fill whose read started before the bump is dropped
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._watch_thread = None
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("EMBEDDING_CACHE_TTL", "300")),
+        )
+
+    def get(self, user_id):
+        return self._cache.get(user_id)
+
+    def generation(self, user_id):
+        """Take before reading user_id from MongoDB and pass to put()."""
+        with self._lock:
+            return self._epoch, self._generations.get(user_id, 0)
+
+    def put(self, user_id, embedding, doc_id=None, generation=None):
+        """
+        Caches and returns the normalized print. With generation, the print is
+        only cached if user_id was not invalidated since generation() was taken,
+        so a read that raced an enrollment cannot reinstate the old print.
+        """
+        embedding = decode_embedding(embedding)
+        embedding = (embedding / np.linalg.norm(embedding)).astype(np.float32, copy=False)
+        embedding.setflags(write=False)
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(user_id, 0)):
+                return embedding
+            self._cache.put(user_id, embedding)
+            if doc_id is not None:
+                self._doc_ids[doc_id] = user_id
+        return embedding
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._cache.invalidate(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+            self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+    def watch(self, collection):
+        """Starts a background change stream that invalidates entries written elsewhere."""
+        if self._watch_thread is not None and self._watch_thread.is_alive():
+            return
+        self._stop.clear()
+        self._watch_thread = threading.Thread(
+            target=self._watch_loop, args=(collection,), name="embedding-cache-watch", daemon=True
+        )
+        self._watch_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch_loop(self, collection):
+        try:
+            with collection.watch(
+                [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}],
+                full_document="updateLookup",
+            ) as stream:
+                while not self._stop.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        time.sleep(0.2)
+                        continue
+                    self._on_change(change)
+        except Exception as e:
+            # Standalone servers do not support change streams; fall back to TTL only
+            print(f"[WARNING] Embedding cache change stream stopped: {e}. Relying on TTL expiry.")
+
+    def _on_change(self, change):
+        full_doc = change.get("fullDocument") or {}
+        doc_id = (change.get("documentKey") or {}).get("_id")
+
+        user_id = full_doc.get("user_id") or self._doc_ids.get(doc_id)
+        if user_id is not None:
+            self.invalidate(user_id)
+        elif change.get("operationType") == "delete":
+            # Unknown document removed; cannot tell which user it was
+            self.clear()
+
+
+def _read_only(array):
+    if array is None:
+        return None
+    array = np.asarray(array, dtype=np.float32)
+    array.setflags(write=False)
+    return array
+
+
+class ClipCache:
+    """
+    Pipeline results keyed by a hash of the decoded 16 kHz PCM: the embedding,
+    denoised speech, anti-spoof report and terminal status (no_speech / spoof)
+    of a clip. Retried uploads and duplicate watcher events reuse them instead
+    of running denoise, anti-spoof and ECAPA again. The first call_id that
+    submitted a clip is remembered, so the same audio arriving for a different
+    call is a replay.
+
+    claim() and claim_enrollment() record a call or an enrollment under the
+    cache lock before any work is done, so concurrent requests for the same
+    clip cannot both pass the replay / duplicate-sample checks.
+    """
+
+    def __init__(self, max_size=512, ttl=600.0):
+        self._cache = LRUTTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self.replays = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_size=int(os.getenv("CLIP_CACHE_SIZE", "512")),
+            ttl=float(os.getenv("CLIP_CACHE_TTL", "600")),
+        )
+
+    @staticmethod
+    def key(audio):
+        pcm = np.ascontiguousarray(audio, dtype=np.float32)
+        return hashlib.blake2b(pcm.tobytes(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _new_entry():
+        return {
+            "status": None,
+            "embedding": None,
+            "clean_audio": None,
+            "anti_spoof": None,
+            "call_id": None,
+            "first_seen": time.time(),
+            "enrolled": set(),
+        }
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def claim(self, key, call_id=None):
+        """
+        Returns (entry, replay). A clip seen for the first time gets an empty
+        entry (status None) owned by call_id; replay holds the details if the
+        clip already belongs to a different call, else None.
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                entry = self._new_entry()
+                self._cache.put(key, entry)
+            return entry, self._check_replay(entry, call_id)
+
+    def put(self, key, status, embedding=None, anti_spoof=None, clean_audio=None, call_id=None):
+        """Stores a clip's analysis, keeping the call and enrollment history of its current entry."""
+        embedding = _read_only(embedding)
+        clean_audio = _read_only(clean_audio)
+        with self._lock:
+            entry = dict(self._cache.peek(key) or self._new_entry())
+            entry.update(status=status, embedding=embedding, anti_spoof=anti_spoof, clean_audio=clean_audio)
+            if entry["call_id"] is None:
+                entry["call_id"] = call_id
+            self._cache.put(key, entry)
+        return entry
+
+    def check_replay(self, entry, call_id):
+        """Returns replay details if entry was first seen under a different call, else None."""
+        with self._lock:
+            return self._check_replay(entry, call_id)
+
+    def _check_replay(self, entry, call_id):
+        if entry is None or call_id is None:
+            return None
+        if entry["call_id"] is None:
+            entry["call_id"] = call_id
+            return None
+        if entry["call_id"] == call_id:
+            return None
+        self.replays += 1
+        return {"first_call_id": entry["call_id"], "first_seen": entry["first_seen"]}
+
+    def claim_enrollment(self, entry, user_id):
+        """Marks the clip as enrolled for user_id; False if it already was (or is in progress)."""
+        with self._lock:
+            if user_id in entry["enrolled"]:
+                return False
+            entry["enrolled"].add(user_id)
+            return True
+
+    def release_enrollment(self, entry, user_id):
+        """Undoes claim_enrollment after a failed enrollment, so a retry is not ignored."""
+        with self._lock:
+            entry["enrolled"].discard(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return dict(self._cache.stats(), replays=self.replays)
@@ -0,0 +1,118 @@
+# embedding_store.py
+"""
+Compact embedding storage for MongoDB.
+
+Embeddings are stored as BSON BinData (user-defined subtype 0x80) holding an
+8-byte header followed by the packed vector:
+
+    version:uint8 | dtype:uint8 | dim:uint16 | scale:float32 | data...
+
+float32 reads are zero-copy via np.frombuffer. decode_embedding() also accepts
+the legacy BSON array of doubles, so both formats can coexist during migration:
+
+    python embedding_store.py --migrate [--dtype float16] [--dry-run]
+"""
+import argparse
+import os
+import struct
+
+import numpy as np
+from bson.binary import Binary
+
+FORMAT_VERSION = 1
+BINARY_SUBTYPE = 0x80
+HEADER = struct.Struct("<BBHf")
+
+DTYPES = {
+    "float32": (1, np.float32),
+    "float16": (2, np.float16),
+    "int8": (3, np.int8),
+    "float64": (4, np.float64),
+}
+DTYPE_BY_CODE = {code: (name, dtype) for name, (code, dtype) in DTYPES.items()}
+
+DEFAULT_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+
+def encode_embedding(vector, dtype=None):
+    """Packs a 1-D vector into BSON BinData. int8 is symmetric-quantized with a per-vector scale."""
+    dtype = dtype or DEFAULT_DTYPE
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    code, np_dtype = DTYPES[dtype]
+
+    vector = np.asarray(vector, dtype=np.float64).reshape(-1)
+    scale = 1.0
+    if dtype == "int8":
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        packed = np.clip(np.round(vector / scale), -127, 127).astype(np.int8)
+    else:
+        packed = vector.astype(np_dtype)
+
+    header = HEADER.pack(FORMAT_VERSION, code, vector.size, scale)
+    return Binary(header + packed.tobytes(), BINARY_SUBTYPE)
+
+
+def decode_embedding(value):
+    """
+    Returns the stored vector as a float32 NumPy array.
+    Accepts packed BinData or the legacy list-of-doubles format.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        version, code, dim, scale = HEADER.unpack_from(value, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding format version: {version}")
+        name, np_dtype = DTYPE_BY_CODE[code]
+        data = np.frombuffer(value, dtype=np_dtype, count=dim, offset=HEADER.size)
+        if name == "int8":
+            return data.astype(np.float32) * np.float32(scale)
+        # float16 / float64 are widened / narrowed; float32 comes back as-is
+        return data.astype(np.float32, copy=False)
+    return np.asarray(value, dtype=np.float32)
+
+
+def is_packed(value):
+    return isinstance(value, (bytes, bytearray, memoryview))
+
+
+def migrate(collection, dtype=None, batch_size=500, dry_run=False):
+    """Rewrites legacy array embeddings as packed BinData. Returns the number of documents converted."""
+    from pymongo import UpdateOne
+
+    converted = 0
+    ops = []
+    for doc in collection.find({"embedding": {"$type": "array"}}, {"embedding": 1}):
+        ops.append(UpdateOne(
+            {"_id": doc["_id"], "embedding": doc["embedding"]},
+            {"$set": {"embedding": encode_embedding(doc["embedding"], dtype)}},
+        ))
+        if len(ops) >= batch_size:
+            converted += _flush(collection, ops, dry_run)
+            ops = []
+    if ops:
+        converted += _flush(collection, ops, dry_run)
+    return converted
+
+
+def _flush(collection, ops, dry_run):
+    if dry_run:
+        return len(ops)
+    return collection.bulk_write(ops, ordered=False).modified_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding storage tools")
+    parser.add_argument("--migrate", action="store_true", help="Convert array embeddings to packed BinData")
+    parser.add_argument("--dtype", default=DEFAULT_DTYPE, choices=sorted(DTYPES))
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.migrate:
+        import db
+
+        collection = db.get_collection()
+        count = migrate(collection, args.dtype, dry_run=args.dry_run)
+        print(f"[SUCCESS] {'Would convert' if args.dry_run else 'Converted'} {count} embeddings to {args.dtype}")
+    else:
+        parser.print_help()
@@ -0,0 +1,122 @@
+# features.py
+from functools import cached_property
+
+import numpy as np
+
+from lazy_imports import lazy_import
+librosa = lazy_import("librosa")
+
+N_FFT = 2048
+HOP_LENGTH = 512
+
+
+class FeatureContext:
+    """
+    Spectral features of one utterance, computed on first use and shared.
+    The STFT magnitude and frame energies are computed once; silence trimming
+    and every anti-spoof check derive their values from them. Parameters match
+    the librosa defaults so results equal the direct librosa calls.
+    """
+
+    def __init__(self, audio, sr=16000, n_fft=N_FFT, hop_length=HOP_LENGTH):
+        self.audio = audio
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self._intervals = {}
+
+    # -----------------------------
+    # Base transforms
+    # -----------------------------
+    @cached_property
+    def stft_magnitude(self):
+        return np.abs(librosa.stft(self.audio, n_fft=self.n_fft, hop_length=self.hop_length))
+
+    @cached_property
+    def power_spectrum(self):
+        return self.stft_magnitude ** 2
+
+    @cached_property
+    def frame_rms(self):
+        return librosa.feature.rms(
+            y=self.audio, frame_length=self.n_fft, hop_length=self.hop_length
+        )[0]
+
+    @cached_property
+    def frame_db(self):
+        # Frame loudness relative to the loudest frame, as used by librosa.effects.split
+        return librosa.amplitude_to_db(self.frame_rms, ref=np.max, top_db=None)
+
+    # -----------------------------
+    # Speech intervals
+    # -----------------------------
+    def speech_intervals(self, top_db=30, ref=None):
+        """
+        Same result as librosa.effects.split(audio, top_db=top_db).
+        ref is an absolute RMS reference; by default the loudest frame is used.
+        """
+        key = (top_db, ref)
+        if key in self._intervals:
+            return self._intervals[key]
+
+        if ref is None:
+            frame_db = self.frame_db
+        else:
+            frame_db = librosa.amplitude_to_db(self.frame_rms, ref=ref, top_db=None)
+        non_silent = frame_db > -top_db
+        edges = np.flatnonzero(np.diff(non_silent.astype(int)))
+        edges = [edges + 1]
+        if non_silent.size and non_silent[0]:
+            edges.insert(0, [0])
+        if non_silent.size and non_silent[-1]:
+            edges.append([len(non_silent)])
+
+        edges = librosa.frames_to_samples(np.concatenate(edges), hop_length=self.hop_length)
+        edges = np.minimum(edges, len(self.audio))
+        intervals = edges.reshape((-1, 2))
+
+        self._intervals[key] = intervals
+        return intervals
+
+    def speech(self, top_db=30, ref=None):
+        """Audio with the silent regions removed, or an empty array if none is voiced."""
+        intervals = self.speech_intervals(top_db, ref=ref)
+        if len(intervals) == 0:
+            return self.audio[:0]
+        return np.concatenate([self.audio[s:e] for s, e in intervals])
+
+    def voiced_ratio(self, top_db=25):
+        if len(self.audio) == 0:
+            return 0
+        intervals = self.speech_intervals(top_db)
+        voiced_len = sum(end - start for start, end in intervals)
+        return voiced_len / len(self.audio)
+
+    # -----------------------------
+    # Anti-spoof features
+    # -----------------------------
+    @cached_property
+    def energy_std(self):
+        return np.std(np.square(self.audio))
+
+    @cached_property
+    def pitch_values(self):
+        pitches, _ = librosa.piptrack(S=self.stft_magnitude, sr=self.sr)
+        return pitches[pitches > 0]
+
+    @cached_property
+    def rolloff_mean(self):
+        rolloff = librosa.feature.spectral_rolloff(S=self.stft_magnitude, sr=self.sr, roll_percent=0.85)[0]
+        return np.mean(rolloff)
+
+    @cached_property
+    def centroid_var(self):
+        centroid = librosa.feature.spectral_centroid(S=self.stft_magnitude, sr=self.sr)[0]
+        return np.var(centroid)
+
+    @cached_property
+    def mfcc_delta_var(self):
+        mel = librosa.feature.melspectrogram(S=self.power_spectrum, sr=self.sr)
+        mfccs = librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=13)
+        delta_mfcc = librosa.feature.delta(mfccs)
+        return np.mean(np.var(delta_mfcc, axis=1))
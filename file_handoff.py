@@ -0,0 +1,216 @@
+# file_handoff.py
+"""
+Hands completed audio files from a watch folder to a callback.
+
+A file is handed off once, when its writer is done with it:
+  - close-after-write (inotify IN_CLOSE_WRITE, i.e. watchdog's on_closed on Linux)
+  - an atomic rename into the folder (on_moved), as server.py and
+    voice_recorder do with their ".part" temp files
+  - on platforms without close events, no further created/modified events
+    for HANDOFF_QUIET_MS
+
+Repeated events for the same file contents (same name, size and mtime) are
+dropped. Handed-off files are recorded in a ledger in the watch folder, and
+scan() at startup dispatches matching files that arrived while the watcher
+was down. The ledger is compacted on load and every HANDOFF_LEDGER_COMPACT
+appends: entries are kept while their file is still in the folder or was
+modified within HANDOFF_LEDGER_RETAIN_S.
+"""
+import os
+import sys
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+
+AUDIO_EXTENSIONS = (".wav", ".mp3")
+TEMP_SUFFIX = ".part"
+LEDGER_NAME = ".handoff_ledger"
+
+QUIET_SECONDS = float(os.getenv("HANDOFF_QUIET_MS", "500")) / 1000
+LEDGER_RETAIN_SECONDS = float(os.getenv("HANDOFF_LEDGER_RETAIN_S", "86400"))
+LEDGER_COMPACT_EVERY = int(os.getenv("HANDOFF_LEDGER_COMPACT", "10000"))
+# inotify is the only watchdog backend that reports close-after-write
+CLOSE_EVENTS = sys.platform.startswith("linux")
+
+
+def write_atomic(path, data):
+    """Writes data to path via a temp file and rename, so watchers never see a partial file."""
+    tmp_path = path + TEMP_SUFFIX
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class HandoffLedger:
+    """Append-only record of files already handed off, keyed by name, size and mtime."""
+
+    def __init__(self, folder, retain_seconds=LEDGER_RETAIN_SECONDS, compact_every=LEDGER_COMPACT_EVERY):
+        self.folder = folder
+        self.path = os.path.join(folder, LEDGER_NAME)
+        self.retain_seconds = retain_seconds
+        self.compact_every = compact_every
+        self._seen = set()
+        self._appended = 0
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self._seen = {line.rstrip("\n") for line in f if line.strip()}
+            self.compact()
+
+    @staticmethod
+    def identity(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return f"{os.path.basename(path)}\t{st.st_size}\t{st.st_mtime_ns}"
+
+    def __contains__(self, identity):
+        with self._lock:
+            return identity in self._seen
+
+    def add(self, identity):
+        """Returns False if identity was already recorded."""
+        with self._lock:
+            if identity in self._seen:
+                return False
+            self._seen.add(identity)
+            with open(self.path, "a") as f:
+                f.write(identity + "\n")
+            self._appended += 1
+            if self._appended < self.compact_every:
+                return True
+        self.compact()
+        return True
+
+    def compact(self):
+        """
+        Drops entries whose file has left the folder and whose mtime is older
+        than retain_seconds; such a file can no longer be dispatched. Rewrites
+        the ledger atomically. Returns the number of entries dropped.
+        """
+        present = set()
+        for entry in os.scandir(self.folder):
+            if entry.is_file():
+                identity = self.identity(entry.path)
+                if identity is not None:
+                    present.add(identity)
+        cutoff_ns = (time.time() - self.retain_seconds) * 1e9
+
+        with self._lock:
+            keep = set()
+            for identity in self._seen:
+                try:
+                    mtime_ns = int(identity.rsplit("\t", 1)[1])
+                except (IndexError, ValueError):
+                    continue
+                if identity in present or mtime_ns >= cutoff_ns:
+                    keep.add(identity)
+            dropped = len(self._seen) - len(keep)
+            self._appended = 0
+            if dropped:
+                write_atomic(self.path, "".join(line + "\n" for line in sorted(keep)).encode())
+                self._seen = keep
+        if dropped:
+            print(f"[INFO] Handoff ledger compacted: {dropped} old entries dropped, {len(keep)} kept")
+        return dropped
+
+
+class CompletedFileHandler(FileSystemEventHandler):
+    """
+    Calls on_complete(path) once per completed file. Dispatch is serialized,
+    so on_complete may block (e.g. for queue backpressure or a prompt).
+    """
+
+    def __init__(self, folder, on_complete, accept=None):
+        super().__init__()
+        self.folder = os.path.abspath(folder)
+        self.on_complete = on_complete
+        self.accept = accept or (lambda filename: filename.lower().endswith(AUDIO_EXTENSIONS))
+        self.ledger = HandoffLedger(folder)
+        self._timers = {}
+        self._timers_lock = threading.Lock()
+        self._dispatch_lock = threading.Lock()
+
+    # -----------------------------
+    # Startup
+    # -----------------------------
+    def scan(self, max_age=None):
+        """Dispatches files already in the folder that were never handed off. Returns how many."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or not self._wanted(entry.path):
+                continue
+            mtime = entry.stat().st_mtime
+            if max_age and now - mtime > max_age:
+                continue
+            entries.append((mtime, entry.path))
+
+        dispatched = 0
+        for _, path in sorted(entries):
+            dispatched += self._dispatch(path)
+        if dispatched:
+            print(f"[INFO] Startup scan picked up {dispatched} file(s) in {self.folder}")
+        return dispatched
+
+    # -----------------------------
+    # Watchdog events
+    # -----------------------------
+    def on_closed(self, event):
+        if not event.is_directory:
+            self._dispatch(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory and os.path.dirname(os.path.abspath(event.dest_path)) == self.folder:
+            self._dispatch(event.dest_path)
+
+    def on_created(self, event):
+        if not CLOSE_EVENTS and not event.is_directory:
+            self._settle(event.src_path)
+
+    def on_modified(self, event):
+        if not CLOSE_EVENTS and not event.is_directory:
+            self._settle(event.src_path)
+
+    # -----------------------------
+    # Internals
+    # -----------------------------
+    def _wanted(self, path):
+        filename = os.path.basename(path)
+        return not filename.endswith(TEMP_SUFFIX) and filename != LEDGER_NAME and self.accept(filename)
+
+    def _settle(self, path):
+        """Dispatches path after QUIET_SECONDS without another event for it."""
+        if not self._wanted(path):
+            return
+        timer = threading.Timer(QUIET_SECONDS, self._settled, args=(path,))
+        timer.daemon = True
+        with self._timers_lock:
+            previous = self._timers.pop(path, None)
+            if previous is not None:
+                previous.cancel()
+            self._timers[path] = timer
+        timer.start()
+
+    def _settled(self, path):
+        with self._timers_lock:
+            self._timers.pop(path, None)
+        self._dispatch(path)
+
+    def _dispatch(self, path):
+        if not self._wanted(path):
+            return 0
+        with self._dispatch_lock:
+            identity = self.ledger.identity(path)
+            # Gone already (renamed away / deleted), or the same contents were handed off before
+            if identity is None or not self.ledger.add(identity):
+                return 0
+            try:
+                self.on_complete(path)
+            except Exception as e:
+                print(f"[ERROR] Handling {path} failed: {e}")
+        return 1
@@ -0,0 +1,250 @@
+# instrumentation.py
+import atexit
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, ("le", repr(float(bound))))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time."""
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = float(self.fn())
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, fn):
+        metric = Gauge(name, help_text, fn)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# =============================
+# PIPELINE METRICS
+# =============================
+REGISTRY = MetricsRegistry()
+
+VERIFICATIONS = REGISTRY.counter(
+    "voice_verifications_total",
+    "Verification outcomes (verified, rejected, spoof_rejected, unenrolled, no_speech, error).",
+    ["outcome"],
+)
+ENROLLMENTS = REGISTRY.counter(
+    "voice_enrollments_total",
+    "Enrollment outcomes (success, failed).",
+    ["outcome"],
+)
+STAGE_LATENCY = REGISTRY.histogram(
+    "voice_stage_duration_seconds",
+    "Latency of each pipeline stage.",
+    ["pipeline", "stage"],
+)
+SIMILARITY = REGISTRY.histogram(
+    "voice_similarity_score",
+    "Cosine similarity between probe and enrolled voice print.",
+    buckets=[round(0.1 * i, 1) for i in range(-5, 11)],
+)
+
+# verify_detailed status -> outcome label
+VERIFY_OUTCOMES = {
+    "verified": "verified",
+    "failed": "rejected",
+    "spoof": "spoof_rejected",
+    "replay": "replay_rejected",
+    "not_enrolled": "unenrolled",
+    "no_speech": "no_speech",
+    "error": "error",
+}
+
+
+@contextmanager
+def span(pipeline, stage, timings=None):
+    """
+    Times the enclosed block into voice_stage_duration_seconds.
+    If a timings dict is given, the duration in ms is also stored under stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, pipeline=pipeline, stage=stage)
+        if timings is not None:
+            timings[stage] = round(elapsed * 1000, 2)
+
+
+# =============================
+# PROCESS MEMORY
+# =============================
+def process_memory(pid="self"):
+    """
+    Resident memory of a process in bytes from /proc/<pid>/smaps_rollup (Linux 4.14+).
+    pss charges shared pages proportionally, uss is memory only this process holds,
+    shared is what it maps together with others (e.g. copy-on-write model weights).
+    Returns {} where unavailable.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+# =============================
+# STRUCTURED LOGGING
+# =============================
+class BufferedLogger:
+    """
+    JSON-lines logger that keeps records in memory and appends them to the file
+    in one write, when the buffer fills, on flush() or at interpreter exit.
+    """
+
+    def __init__(self, path, buffer_size=200):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def log(self, message, level="INFO", **fields):
+        record = {"ts": time.time(), "level": level, "msg": message}
+        record.update(fields)
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.buffer_size:
+                return
+            lines, self._buffer = self._buffer, []
+        self._write(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if lines:
+            self._write(lines)
+
+    def _write(self, lines):
+        try:
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        except Exception as e:
+            print(f"[WARNING] Failed to write {self.path}: {e}")
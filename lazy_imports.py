@@ -0,0 +1,44 @@
+# lazy_imports.py
+import importlib
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def _load(self):
+        if self._lazy_module is None:
+            self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        if attr.startswith("_lazy_"):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def preload(*modules):
+    """Imports lazy modules on a background thread so the first request does not pay for it."""
+    def _run():
+        for module in modules:
+            try:
+                if isinstance(module, LazyModule):
+                    module._load()
+                else:
+                    importlib.import_module(module)
+            except Exception as e:
+                print(f"[WARNING] Background import failed: {e}")
+
+    thread = threading.Thread(target=_run, name="preload-imports", daemon=True)
+    thread.start()
+    return thread
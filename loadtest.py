@@ -0,0 +1,386 @@
+# loadtest.py
+"""
+End-to-end HTTP load generator for server.py and voice_recorder/main.py.
+
+Requests are issued open-loop at each target rate (latency is measured from
+the scheduled send time, so a saturated server shows up as queueing delay
+rather than a silently lower request rate). Each rate step reports latency
+percentiles, a latency histogram and the error rate per endpoint, and the
+run ends with the highest rate that stayed within the SLO.
+
+    # start server.py on the in-memory store and ramp verify-heavy traffic
+    python loadtest.py --spawn --rates 2 4 8 16 32 --step-seconds 20
+
+    # voice_recorder upload endpoint
+    python loadtest.py --target recorder --spawn --rates 10 50 100 200
+
+    # against an already running server with your own recordings
+    python loadtest.py --base-url http://localhost:5000 --corpus recordings/
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark import synthetic_speech, wav_bytes
+
+TARGETS = {
+    "server": {
+        "url": "http://localhost:5000",
+        "health": "/health",
+        "mix": "verify=6,login=2,upload=1,check_status=1",
+        "command": [sys.executable, "server.py"],
+    },
+    "recorder": {
+        "url": "http://localhost:8000",
+        "health": "/",
+        "mix": "recorder_upload=1",
+        "command": [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", "voice_recorder", "--port", "8000"],
+    },
+}
+
+# Log-spaced latency histogram buckets (ms)
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+# =============================
+# CORPUS
+# =============================
+def load_corpus(directory=None, count=8, duration=5.0, sr=16000):
+    """WAV bytes from directory, else synthetic speech clips (>= 4 s so voice_recorder accepts them)."""
+    if directory:
+        paths = sorted(glob.glob(os.path.join(directory, "**", "*.wav"), recursive=True))
+        if not paths:
+            raise RuntimeError(f"[ERROR] No .wav files under {directory}")
+        clips = []
+        for path in paths:
+            with open(path, "rb") as f:
+                clips.append(f.read())
+        return clips
+    return [wav_bytes(synthetic_speech(duration, sr, seed=i), sr) for i in range(count)]
+
+
+# =============================
+# HTTP
+# =============================
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, data, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def http(method, url, body=None, content_type=None, timeout=60.0):
+    """Returns (status_code, parsed JSON or None). Network errors return status 0."""
+    headers = {"Content-Type": content_type} if content_type else {}
+    request = urllib.request.Request(url, data=body, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, payload = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, payload = e.code, e.read()
+    except Exception:
+        return 0, None
+    try:
+        return status, json.loads(payload)
+    except ValueError:
+        return status, None
+
+
+class Client:
+    """One call per endpoint name; returns True if the response counts as a success."""
+
+    def __init__(self, base_url, corpus, users, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.corpus = corpus
+        self.users = users
+        self.timeout = timeout
+        self._request_ids = []
+        self._sent = 0
+        self.saved_files = []
+        self._lock = threading.Lock()
+
+    def _audio(self):
+        clip = bytearray(random.choice(self.corpus))
+        # Write a counter into the low bytes of the last two 16-bit samples so every
+        # request hashes differently and VoiceVerifier's clip cache doesn't turn the
+        # run into a cache benchmark
+        with self._lock:
+            self._sent += 1
+            n = self._sent
+        clip[-4], clip[-2] = n & 0xFF, (n >> 8) & 0xFF
+        return bytes(clip)
+
+    def _remember(self, request_id):
+        with self._lock:
+            self._request_ids.append(request_id)
+            del self._request_ids[:-500]
+
+    def _post_audio(self, path, fields):
+        body, content_type = multipart(fields, {"audio": ("clip.wav", self._audio(), "audio/wav")})
+        return http("POST", self.base_url + path, body, content_type, self.timeout)
+
+    def login(self):
+        body = json.dumps({"user_id": random.choice(self.users)}).encode()
+        status, _ = http("POST", self.base_url + "/login", body, "application/json", self.timeout)
+        return status == 200
+
+    def enroll(self, user_id=None):
+        status, _ = self._post_audio("/enroll", {"user_id": user_id or random.choice(self.users)})
+        return status == 200
+
+    def verify(self):
+        request_id = uuid.uuid4().hex
+        status, data = self._post_audio("/verify", {"user_id": random.choice(self.users), "request_id": request_id})
+        self._remember(request_id)
+        return status == 200 and bool(data) and data.get("status") != "error"
+
+    def upload(self):
+        request_id = uuid.uuid4().hex
+        status, _ = self._post_audio("/upload", {"user_id": random.choice(self.users), "request_id": request_id})
+        self._remember(request_id)
+        return status == 200
+
+    def check_status(self):
+        with self._lock:
+            request_id = random.choice(self._request_ids) if self._request_ids else uuid.uuid4().hex
+        status, _ = http("GET", f"{self.base_url}/check_status?request_id={request_id}", timeout=self.timeout)
+        return status == 200
+
+    def recorder_upload(self):
+        status, data = self._post_audio("/upload", {})
+        if status == 200 and data and data.get("file"):
+            with self._lock:
+                self.saved_files.append(data["file"])
+        return status == 200
+
+
+# =============================
+# LOAD
+# =============================
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_step(client, mix, rate, seconds, concurrency):
+    """Issues requests open-loop at `rate` per second for `seconds`. Returns per-endpoint samples."""
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+
+    def call(name, scheduled):
+        try:
+            ok = getattr(client, name)()
+        except Exception:
+            ok = False
+        latency_ms = (time.perf_counter() - scheduled) * 1000
+        with lock:
+            samples[name].append((latency_ms, ok))
+
+    total = int(rate * seconds)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            scheduled = started + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(call, random.choices(names, weights)[0], scheduled)
+    elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    summary = {}
+    everything = []
+    for name, values in samples.items():
+        if not values:
+            continue
+        latencies = np.array([v[0] for v in values])
+        errors = sum(1 for v in values if not v[1])
+        everything.extend(values)
+        summary[name] = _stats(latencies, errors, elapsed)
+    if everything:
+        latencies = np.array([v[0] for v in everything])
+        summary["all"] = _stats(latencies, sum(1 for v in everything if not v[1]), elapsed)
+    return summary
+
+
+def _stats(latencies, errors, elapsed):
+    counts, _ = np.histogram(latencies, bins=[0] + BUCKETS_MS + [float("inf")])
+    return {
+        "count": int(len(latencies)),
+        "errors": int(errors),
+        "error_rate": errors / len(latencies),
+        "throughput_per_s": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "histogram": {label: int(c) for label, c in zip(_bucket_labels(), counts)},
+    }
+
+
+def _bucket_labels():
+    edges = [0] + BUCKETS_MS
+    return [f"<{hi}ms" for hi in BUCKETS_MS] + [f">={edges[-1]}ms"]
+
+
+def print_step(rate, summary):
+    print(f"\n[INFO] Offered {rate:g} req/s")
+    print(f"{'endpoint':<16}{'count':>7}{'err %':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, s in summary.items():
+        print(
+            f"{name:<16}{s['count']:>7}{s['error_rate'] * 100:>8.1f}{s['throughput_per_s']:>8.1f}"
+            f"{s['p50_ms']:>9.0f}{s['p95_ms']:>9.0f}{s['p99_ms']:>9.0f}"
+        )
+    overall = summary.get("all")
+    if overall:
+        peak = max(overall["histogram"].values()) or 1
+        for label, count in overall["histogram"].items():
+            if count:
+                print(f"  {label:>9} {'#' * max(1, int(40 * count / peak))} {count}")
+
+
+def within_slo(rate, summary, slo_ms, max_error_rate):
+    overall = summary.get("all")
+    if not overall:
+        return False
+    return (
+        overall["p95_ms"] <= slo_ms
+        and overall["error_rate"] <= max_error_rate
+        # Open-loop: completions falling behind the offered rate means requests are piling up
+        and overall["throughput_per_s"] >= 0.9 * rate
+    )
+
+
+# =============================
+# SERVER LIFECYCLE
+# =============================
+def spawn(target, base_url, startup_timeout):
+    """Starts the target on the in-memory store and waits for its health route."""
+    env = dict(os.environ, MONGO_URI="memory://", EMBEDDING_CACHE_WATCH="0")
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(TARGETS[target]["command"], env=env, cwd=cwd)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"[ERROR] {target} exited during startup (code {process.returncode})")
+        status, _ = http("GET", base_url.rstrip("/") + TARGETS[target]["health"], timeout=2)
+        if status == 200:
+            return process
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"[ERROR] {target} not healthy after {startup_timeout:.0f}s")
+
+
+def cleanup_uploads(prefix, saved_files=()):
+    """Removes server.py uploads for the load-test users and files voice_recorder reported saving."""
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    paths = set(glob.glob(os.path.join(data_dir, f"voice_{prefix}*.wav"))) | set(saved_files)
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load generator")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="server")
+    parser.add_argument("--base-url", help="Defaults to the target's local URL")
+    parser.add_argument("--spawn", action="store_true", help="Start the target with MONGO_URI=memory://")
+    parser.add_argument("--corpus", help="Directory of .wav files (synthetic clips if omitted)")
+    parser.add_argument("--mix", help="Endpoint weights, e.g. verify=6,login=2,upload=1,check_status=1,enroll=0.1")
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 2, 4, 8, 16], help="Offered req/s per step")
+    parser.add_argument("--step-seconds", type=float, default=15)
+    parser.add_argument("--concurrency", type=int, default=64, help="Max in-flight requests")
+    parser.add_argument("--users", type=int, default=20, help="Synthetic users enrolled before the run")
+    parser.add_argument("--slo-ms", type=float, default=2000, help="p95 latency bound for a step to pass")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", help="Write all step results to this JSON file")
+    parser.add_argument("--keep-uploads", action="store_true", help="Leave uploaded files in data/")
+    args = parser.parse_args()
+
+    target = TARGETS[args.target]
+    base_url = args.base_url or target["url"]
+    mix = parse_mix(args.mix or target["mix"])
+    corpus = load_corpus(args.corpus)
+    prefix = f"lt{uuid.uuid4().hex[:6]}"
+    users = [f"{prefix}-user{i}" for i in range(args.users)]
+    client = Client(base_url, corpus, users, args.timeout)
+
+    process = spawn(args.target, base_url, startup_timeout=300) if args.spawn else None
+    try:
+        if args.target == "server":
+            print(f"[INFO] Enrolling {len(users)} load-test users...")
+            failed = sum(not client.enroll(u) for u in users)
+            if failed:
+                print(f"[WARNING] {failed} setup enrollments failed")
+
+        results = []
+        capacity = knee = None
+        for rate in args.rates:
+            samples, elapsed = run_step(client, mix, rate, args.step_seconds, args.concurrency)
+            summary = summarize(samples, elapsed)
+            print_step(rate, summary)
+            ok = within_slo(rate, summary, args.slo_ms, args.max_error_rate)
+            results.append({"rate": rate, "within_slo": ok, "endpoints": summary})
+            if ok:
+                capacity = rate
+            else:
+                knee = rate
+                print(f"[WARNING] Latency/error SLO broken at {rate:g} req/s")
+                break
+
+        if capacity is None:
+            print("\n[WARNING] No step met the SLO; try lower --rates")
+        else:
+            print(f"\n[SUCCESS] Sustained {capacity:g} req/s within p95 <= {args.slo_ms:g} ms and "
+                  f"<= {args.max_error_rate * 100:g}% errors")
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"target": args.target, "mix": mix, "capacity_per_s": capacity, "knee_per_s": knee, "steps": results}, f, indent=2)
+            print(f"[SUCCESS] Results written to {args.json}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if not args.keep_uploads:
+            removed = cleanup_uploads(prefix, client.saved_files)
+            if removed:
+                print(f"[INFO] Removed {removed} load-test uploads from data/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# memory_store.py
+"""
+In-memory stand-ins for the MongoDB collection and GridFS used by VoiceVerifier.
+Only the calls this project makes are supported. Meant for benchmarks and
+local load tests, not as a general MongoDB replacement.
+"""
+import copy
+import io
+import threading
+import time
+from types import SimpleNamespace
+
+from bson import ObjectId
+from gridfs.errors import FileExists
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def _get_field(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _matches(doc, query):
+    for key, expected in (query or {}).items():
+        value, present = _get_field(doc, key)
+        if isinstance(expected, dict) and any(k.startswith("$") for k in expected):
+            for op, arg in expected.items():
+                if op == "$exists":
+                    if bool(arg) != present:
+                        return False
+                elif op == "$in":
+                    if value not in arg:
+                        return False
+                elif op == "$nin":
+                    # Like MongoDB, an array field matches only if none of its elements is listed
+                    values = value if isinstance(value, list) else [value]
+                    if any(v in arg for v in values):
+                        return False
+                elif op == "$type":
+                    kinds = {"array": list, "binData": (bytes, bytearray), "string": str}
+                    if not present or not isinstance(value, kinds[arg]):
+                        return False
+                elif op == "$ne":
+                    if value == arg:
+                        return False
+                else:
+                    raise NotImplementedError(f"Query operator {op} not supported")
+        elif not present or value != expected:
+            return False
+    return True
+
+
+def _eval(expr, doc, variables=None):
+    """Evaluates the aggregation expressions used in pipeline updates."""
+    variables = variables or {}
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, rest = expr[2:].partition(".")
+        value = variables.get(name)
+        return _get_field(value, rest)[0] if rest else value
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get_field(doc, expr[1:])[0]
+    if isinstance(expr, list):
+        return [_eval(e, doc, variables) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith("$"):
+        return {k: _eval(v, doc, variables) for k, v in expr.items()}
+
+    op, arg = next(iter(expr.items()))
+    if op == "$literal":
+        return copy.deepcopy(arg)
+    if op == "$ifNull":
+        for e in arg:
+            value = _eval(e, doc, variables)
+            if value is not None:
+                return value
+        return None
+    if op == "$add":
+        return sum(_eval(e, doc, variables) for e in arg)
+    if op == "$concatArrays":
+        return [item for e in arg for item in _eval(e, doc, variables)]
+    if op == "$arrayElemAt":
+        array, index = (_eval(e, doc, variables) for e in arg)
+        return array[index]
+    if op == "$zip":
+        return [list(t) for t in zip(*(_eval(e, doc, variables) for e in arg["inputs"]))]
+    if op == "$map":
+        name = arg.get("as", "this")
+        return [
+            _eval(arg["in"], doc, dict(variables, **{name: item}))
+            for item in _eval(arg["input"], doc, variables)
+        ]
+    raise NotImplementedError(f"Expression operator {op} not supported")
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {k for k, v in projection.items() if v}
+    if include:
+        out = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k not in projection}
+
+
+class MemoryCollection:
+    def __init__(self):
+        self._docs = []
+        self._unique = set()
+        self._lock = threading.RLock()
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    def find_one(self, query=None, projection=None):
+        with self._lock:
+            for doc in self._docs:
+                if _matches(doc, query):
+                    return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        with self._lock:
+            return [_project(d, projection) for d in self._docs if _matches(d, query)]
+
+    def count_documents(self, query):
+        with self._lock:
+            return sum(1 for d in self._docs if _matches(d, query))
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    def insert_one(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        with self._lock:
+            self._check_unique(doc)
+            self._docs.append(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    def update_one(self, query, update, upsert=False):
+        with self._lock:
+            for doc in self._docs:
+                if _matches(doc, query):
+                    self._apply(doc, update)
+                    return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+
+            if not upsert:
+                return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+            doc = self._upsert(query, update)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False):
+        """return_document: ReturnDocument.AFTER (True) or BEFORE (False)."""
+        with self._lock:
+            for doc in self._docs:
+                if _matches(doc, query):
+                    before = _project(doc, projection)
+                    self._apply(doc, update)
+                    return _project(doc, projection) if return_document else before
+
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+            return _project(doc, projection) if return_document else None
+
+    def _upsert(self, query, update):
+        doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+        doc["_id"] = ObjectId()
+        self._apply(doc, update, inserting=True)
+        self._check_unique(doc)
+        self._docs.append(doc)
+        return doc
+
+    def bulk_write(self, requests, ordered=True):
+        """Applies pymongo UpdateOne/InsertOne request objects; duplicate keys raise BulkWriteError."""
+        matched = modified = upserted = inserted = 0
+        errors = []
+        with self._lock:
+            for index, op in enumerate(requests):
+                try:
+                    if hasattr(op, "_filter"):
+                        r = self.update_one(op._filter, op._doc, upsert=op._upsert)
+                        matched += r.matched_count
+                        modified += r.modified_count
+                        upserted += r.upserted_id is not None
+                    else:
+                        self.insert_one(op._doc)
+                        inserted += 1
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "nMatched": matched, "nModified": modified,
+                "nUpserted": upserted, "nInserted": inserted,
+            })
+        return SimpleNamespace(
+            matched_count=matched, modified_count=modified, upserted_count=upserted, inserted_count=inserted
+        )
+
+    def delete_one(self, query):
+        with self._lock:
+            for i, doc in enumerate(self._docs):
+                if _matches(doc, query):
+                    del self._docs[i]
+                    return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    def create_index(self, keys, unique=False, **kwargs):
+        field = keys if isinstance(keys, str) else keys[0][0]
+        if unique:
+            self._unique.add(field)
+        return f"{field}_1"
+
+    def watch(self, *args, **kwargs):
+        raise NotImplementedError("Change streams are not available in the in-memory store")
+
+    def _apply(self, doc, update, inserting=False):
+        if isinstance(update, list):
+            # Aggregation pipeline update: each $set stage sees the previous stage's output
+            for stage in update:
+                for op, fields in stage.items():
+                    if op not in ("$set", "$addFields"):
+                        raise NotImplementedError(f"Pipeline stage {op} not supported")
+                    values = {k: _eval(v, doc) for k, v in fields.items()}
+                    doc.update(values)
+            return
+        for op, fields in update.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                for k, v in fields.items():
+                    doc[k] = copy.deepcopy(v)
+            elif op == "$inc":
+                for k, v in fields.items():
+                    doc[k] = doc.get(k, 0) + v
+            elif op == "$setOnInsert":
+                continue
+            else:
+                raise NotImplementedError(f"Update operator {op} not supported")
+
+    def _check_unique(self, new_doc):
+        for field in self._unique:
+            value = new_doc.get(field)
+            if any(d is not new_doc and d.get(field) == value for d in self._docs):
+                raise DuplicateKeyError(f"Duplicate key for unique field {field}: {value}")
+
+
+class MemoryGridFS:
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def put(self, data, **kwargs):
+        if hasattr(data, "read"):
+            data = data.read()
+        file_id = kwargs.pop("_id", None) or ObjectId()
+        with self._lock:
+            if file_id in self._files:
+                raise FileExists(f"File with _id {file_id!r} already exists")
+            self._files[file_id] = (bytes(data), dict(kwargs, uploadDate=time.time()))
+        return file_id
+
+    def get(self, file_id):
+        data, meta = self._files[file_id]
+        out = io.BytesIO(data)
+        for k, v in meta.items():
+            setattr(out, k, v)
+        return out
+
+    def exists(self, file_id):
+        return file_id in self._files
+
+    def delete(self, file_id):
+        with self._lock:
+            self._files.pop(file_id, None)
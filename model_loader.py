@@ -0,0 +1,323 @@
+# model_loader.py
+import argparse
+import copy
+import os
+import time
+
+import torch
+
+ECAPA_SOURCE = "speechbrain/spkrec-ecapa-voxceleb"
+ECAPA_SAVEDIR = "pretrained_models/spkrec-ecapa-voxceleb"
+ECAPA_FAST_PATH = os.getenv("ECAPA_FAST_PATH", "pretrained_models/ecapa_fast.pt")
+# fp32 (default) or int8 (dynamic quantization, guarded by QUANT_MIN_COSINE)
+INFERENCE_MODE = os.getenv("ECAPA_INFERENCE_MODE", "fp32")
+QUANT_MIN_COSINE = float(os.getenv("ECAPA_QUANT_MIN_COSINE", "0.99"))
+QUANT_REFERENCE_DIR = os.getenv("ECAPA_QUANT_REFERENCE_DIR")
+
+
+# =============================
+# PATCH: Fix SpeechBrain vs Torchaudio / HF Hub (before importing speechbrain)
+# =============================
+_patched = False
+
+def _patch_speechbrain_compat():
+    global _patched
+    if _patched:
+        return
+
+    import torchaudio
+    if not hasattr(torchaudio, "list_audio_backends"):
+        def _list_audio_backends():
+            return ["soundfile"]
+        torchaudio.list_audio_backends = _list_audio_backends
+
+    import huggingface_hub
+    _original_hf_hub_download = huggingface_hub.hf_hub_download
+    def _hf_hub_download_patch(*args, **kwargs):
+        if 'use_auth_token' in kwargs:
+            token = kwargs.pop('use_auth_token')
+            if token is not False and token is not None:
+                kwargs['token'] = token
+
+        try:
+            return _original_hf_hub_download(*args, **kwargs)
+        except Exception as e:
+            # 404 Client Error: Entry Not Found for custom.py is a known SpeechBrain/HF Hub quirk
+            if "custom.py" in str(e) and ("404" in str(e) or "Entry Not Found" in str(e)):
+                dummy_path = os.path.join(os.getcwd(), "dummy_custom.py")
+                if not os.path.exists(dummy_path):
+                    with open(dummy_path, "w") as f:
+                        f.write("# Dummy custom.py to satisfy SpeechBrain loader\n")
+                return dummy_path
+            raise e
+    huggingface_hub.hf_hub_download = _hf_hub_download_patch
+    _patched = True
+
+
+# =============================
+# ENCODERS
+# =============================
+class EncoderPipeline(torch.nn.Module):
+    """The feature -> normalization -> ECAPA part of EncoderClassifier.encode_batch as one module."""
+
+    def __init__(self, classifier):
+        super().__init__()
+        self.compute_features = classifier.mods.compute_features
+        self.mean_var_norm = classifier.mods.mean_var_norm
+        self.embedding_model = classifier.mods.embedding_model
+
+    def forward(self, wavs, wav_lens):
+        feats = self.compute_features(wavs)
+        feats = self.mean_var_norm(feats, wav_lens)
+        return self.embedding_model(feats, wav_lens)
+
+
+class FastEncoder:
+    """encode_batch() backed by a locally saved EncoderPipeline, no hub or hparams resolution."""
+
+    def __init__(self, path):
+        # Unpickling the pipeline imports speechbrain, which needs the torchaudio shim first
+        _patch_speechbrain_compat()
+        try:
+            self.pipeline = torch.load(path, map_location="cpu", weights_only=False)
+        except TypeError:
+            # torch < 1.13 has no weights_only argument
+            self.pipeline = torch.load(path, map_location="cpu")
+        self.pipeline.eval()
+
+    def encode_batch(self, wavs, wav_lens=None):
+        wavs = wavs.float()
+        if wav_lens is None:
+            wav_lens = torch.ones(wavs.shape[0], device=wavs.device)
+        with torch.no_grad():
+            return self.pipeline(wavs, wav_lens)
+
+
+def load_hub_classifier():
+    _patch_speechbrain_compat()
+    from speechbrain.inference import EncoderClassifier
+    return EncoderClassifier.from_hparams(source=ECAPA_SOURCE, savedir=ECAPA_SAVEDIR)
+
+
+def load_encoder(fast_start=None):
+    """
+    Returns an object with encode_batch(wavs, wav_lens).
+    With ECAPA_FAST_START=1 (default) and an exported artifact on disk the local
+    FastEncoder is used; otherwise the model is resolved through SpeechBrain/HF Hub.
+    """
+    if fast_start is None:
+        fast_start = os.getenv("ECAPA_FAST_START", "1") != "0"
+
+    if fast_start and os.path.exists(ECAPA_FAST_PATH):
+        try:
+            encoder = FastEncoder(ECAPA_FAST_PATH)
+            print(f"[INFO] Loaded local ECAPA artifact: {ECAPA_FAST_PATH}")
+            return encoder
+        except Exception as e:
+            print(f"[WARNING] Could not load {ECAPA_FAST_PATH}: {e}. Falling back to SpeechBrain.")
+
+    return load_hub_classifier()
+
+
+def warm_up(encoder, sr=16000, seconds=1.0):
+    """Runs one dummy inference so lazy allocations happen before the first real request."""
+    signal = 0.01 * torch.randn(1, int(sr * seconds))
+    with torch.no_grad():
+        encoder.encode_batch(signal, torch.ones(1))
+
+
+# =============================
+# CPU INFERENCE MODE
+# =============================
+def configure_threads(intra_op=None, inter_op=None):
+    """
+    Pins torch's thread pools for this process (TORCH_NUM_THREADS / TORCH_INTEROP_THREADS).
+    With several model processes per node, set intra_op to cores / processes to avoid oversubscription.
+    """
+    intra_op = intra_op or int(os.getenv("TORCH_NUM_THREADS", "0"))
+    inter_op = inter_op or int(os.getenv("TORCH_INTEROP_THREADS", "0"))
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            # Only settable before the first parallel op in the process
+            print(f"[WARNING] Could not set inter-op threads: {e}")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+class PointwiseLinear(torch.nn.Module):
+    """A kernel-size-1 Conv1d expressed as nn.Linear over channels, so dynamic quantization applies to it."""
+
+    def __init__(self, conv):
+        super().__init__()
+        self.linear = torch.nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+        with torch.no_grad():
+            self.linear.weight.copy_(conv.weight.squeeze(-1))
+            if conv.bias is not None:
+                self.linear.bias.copy_(conv.bias)
+
+    def forward(self, x):
+        return self.linear(x.transpose(1, 2)).transpose(1, 2)
+
+
+def _pointwise_to_linear(module):
+    """Swaps every 1x1, ungrouped, unstrided Conv1d in module for PointwiseLinear. Returns the count."""
+    swapped = 0
+    for name, child in list(module.named_children()):
+        if (
+            isinstance(child, torch.nn.Conv1d)
+            and child.kernel_size == (1,)
+            and child.stride == (1,)
+            and child.groups == 1
+            and child.padding in ((0,), "valid", "same")
+        ):
+            setattr(module, name, PointwiseLinear(child))
+            swapped += 1
+        else:
+            swapped += _pointwise_to_linear(child)
+    return swapped
+
+
+def quantize_module(model):
+    """int8 dynamic quantization of a copy of model: Linear layers plus 1x1 convs rewritten as Linear."""
+    quantize_dynamic = getattr(torch, "ao", torch).quantization.quantize_dynamic
+    model = copy.deepcopy(model).eval()
+    swapped = _pointwise_to_linear(model)
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8), swapped
+
+
+def _embedding_model_slot(encoder):
+    """(current ECAPA module, setter) for either a FastEncoder or a SpeechBrain EncoderClassifier."""
+    if isinstance(encoder, FastEncoder):
+        return encoder.pipeline.embedding_model, lambda m: setattr(encoder.pipeline, "embedding_model", m)
+    mods = encoder.mods
+    return mods["embedding_model"], lambda m: mods.__setitem__("embedding_model", m)
+
+
+def reference_signals(sr=16000, count=8, seconds=3.0, directory=None):
+    """Reference clips for the quantization check: WAVs from directory, else fixed synthetic voiced signals."""
+    directory = directory or QUANT_REFERENCE_DIR
+    signals = []
+    if directory and os.path.isdir(directory):
+        from audio_io import load_audio
+
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith((".wav", ".flac", ".mp3")) and len(signals) < count:
+                audio, _ = load_audio(os.path.join(directory, name), sr)
+                signals.append(torch.from_numpy(audio).float())
+    if signals:
+        return signals
+
+    print("[WARNING] " + "=" * 60)
+    print(
+        f"[WARNING] int8 accuracy check is using SYNTHETIC signals, not speech "
+        f"(QUANT_REFERENCE_DIR {'has no audio' if directory else 'is not set'}). "
+        "Point QUANT_REFERENCE_DIR at real enrollment clips before trusting int8."
+    )
+    print("[WARNING] " + "=" * 60)
+    generator = torch.Generator().manual_seed(0)
+    t = torch.arange(int(sr * seconds)) / sr
+    for i in range(count):
+        f0 = 90.0 + 25.0 * i
+        voiced = sum(torch.sin(2 * torch.pi * f0 * k * t) / k for k in range(1, 12))
+        envelope = 0.5 * (1 + torch.sin(2 * torch.pi * (2.0 + 0.3 * i) * t))
+        noise = 0.02 * torch.randn(len(t), generator=generator)
+        signals.append(0.1 * voiced * envelope + noise)
+    return signals
+
+
+def _embed_all(encoder, signals):
+    with torch.no_grad():
+        return [encoder.encode_batch(s[None, :], torch.ones(1)).reshape(-1) for s in signals]
+
+
+def apply_inference_mode(encoder, mode=None, min_cosine=None, references=None):
+    """
+    Applies ECAPA_INFERENCE_MODE to encoder. For int8 the quantized model is
+    only kept if every reference embedding stays within min_cosine of fp32.
+    Returns (encoder, effective_mode, report).
+    """
+    mode = mode or INFERENCE_MODE
+    min_cosine = QUANT_MIN_COSINE if min_cosine is None else min_cosine
+    if mode == "fp32":
+        return encoder, "fp32", {}
+    if mode != "int8":
+        raise ValueError(f"Unknown ECAPA_INFERENCE_MODE: {mode}")
+
+    references = references if references is not None else reference_signals()
+    fp32_module, set_module = _embedding_model_slot(encoder)
+
+    started = time.perf_counter()
+    reference = _embed_all(encoder, references)
+    fp32_seconds = time.perf_counter() - started
+
+    try:
+        quantized, swapped = quantize_module(fp32_module)
+    except Exception as e:
+        print(f"[WARNING] int8 quantization unavailable ({e}); staying on fp32")
+        return encoder, "fp32", {"error": str(e)}
+
+    set_module(quantized)
+    try:
+        started = time.perf_counter()
+        candidate = _embed_all(encoder, references)
+        int8_seconds = time.perf_counter() - started
+        cosines = [
+            float(torch.nn.functional.cosine_similarity(a, b, dim=0)) for a, b in zip(reference, candidate)
+        ]
+    except Exception as e:
+        # The quantized model must never be left in place unchecked
+        set_module(fp32_module)
+        print(f"[WARNING] int8 ECAPA failed on the reference set ({e}); staying on fp32")
+        return encoder, "fp32", {"error": str(e)}
+    report = {
+        "min_cosine": min(cosines),
+        "mean_cosine": sum(cosines) / len(cosines),
+        "bound": min_cosine,
+        "pointwise_convs": swapped,
+        "fp32_ms": 1000 * fp32_seconds / len(references),
+        "int8_ms": 1000 * int8_seconds / len(references),
+    }
+    if report["min_cosine"] < min_cosine:
+        set_module(fp32_module)
+        print(
+            f"[WARNING] int8 ECAPA rejected: min cosine {report['min_cosine']:.4f} < {min_cosine}; staying on fp32"
+        )
+        return encoder, "fp32", report
+
+    print(
+        f"[SUCCESS] int8 ECAPA enabled: min cosine {report['min_cosine']:.4f}, "
+        f"{report['fp32_ms']:.1f} -> {report['int8_ms']:.1f} ms/embedding"
+    )
+    return encoder, "int8", report
+
+
+def export_fast_encoder(path=ECAPA_FAST_PATH):
+    classifier = load_hub_classifier()
+    pipeline = EncoderPipeline(classifier).eval()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.save(pipeline, path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ECAPA model artifact tools")
+    parser.add_argument("--export", action="store_true", help="Save the local fast-start artifact")
+    parser.add_argument("--path", default=ECAPA_FAST_PATH)
+    parser.add_argument("--check-int8", action="store_true", help="Compare int8 against fp32 on the reference set")
+    args = parser.parse_args()
+
+    if args.export:
+        started = time.perf_counter()
+        print(f"[SUCCESS] Exported {export_fast_encoder(args.path)} in {time.perf_counter() - started:.1f}s")
+    elif args.check_int8:
+        configure_threads()
+        _, mode, report = apply_inference_mode(load_encoder(), mode="int8")
+        print(f"[INFO] Effective mode: {mode} {report}")
+    else:
+        started = time.perf_counter()
+        encoder = load_encoder()
+        warm_up(encoder)
+        print(f"[INFO] Encoder ready in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,333 @@
+# prefork.py
+"""
+Pre-fork serving mode for server.py (Linux / macOS).
+
+    python prefork.py --workers 8
+
+The parent imports server.py once, which loads ECAPA, torch, speechbrain and
+librosa (and builds the AS-norm cohort with SCORE_NORM=asnorm). It warms the
+audio pipeline, moves the heap to gc's permanent generation (gc.freeze) and
+forks N uvicorn workers that accept on one shared listening socket. The
+workers share those pages copy-on-write instead of each loading its own copy.
+
+The parent supervises and relays results. It restarts workers that exit,
+with a backoff when they crash on startup. Every result a worker publishes
+(POST /results from watcher.py, /verify decisions) goes to the parent over a
+socketpair and is forwarded to every worker's ResultBroker, so /events and
+/check_status work whichever worker the watcher's push landed on. Every
+PREFORK_REPORT_SECONDS it logs each worker's PSS/USS (from
+/proc/<pid>/smaps_rollup), so the per-worker cost is visible. Each worker
+also exports its own figures on /metrics.
+
+Not shared between workers: the clip cache (retry reuse and call_id replay
+detection only see clips that reached the same worker) and the enrolled-print
+cache, which each worker keeps in sync through its own change stream.
+"""
+import argparse
+import gc
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from dotenv import load_dotenv
+
+from instrumentation import process_memory
+
+REPORT_SECONDS = float(os.getenv("PREFORK_REPORT_SECONDS", "60"))
+# A worker exiting sooner than this after start counts as a crash loop
+MIN_UPTIME = 10.0
+MAX_BACKOFF = 30.0
+SHUTDOWN_GRACE = 30.0
+# A worker that does not take a relayed result within this long misses it
+RELAY_SEND_TIMEOUT = 1.0
+
+
+# =============================
+# PARENT: LOAD ONCE
+# =============================
+def load_app():
+    """Imports server.py (model, cohort, routes) and warms everything the workers will touch."""
+    started = time.perf_counter()
+    import server
+    import uvicorn  # noqa: F401  (imported here so workers inherit it)
+    from antispoof import anti_spoof_report
+    from benchmark import synthetic_speech
+    from features import FeatureContext
+
+    verifier = server.verifier
+    # Background imports must finish here: a fork mid-import would leave the child's import lock held
+    verifier.preload_thread.join()
+
+    # One pass through the numpy/librosa/noisereduce paths so their lazy state is inherited, not rebuilt per worker
+    try:
+        import noisereduce as nr
+
+        audio = synthetic_speech(3.0, verifier.SAMPLE_RATE)
+        speech = FeatureContext(audio, verifier.SAMPLE_RATE).speech(top_db=30)
+        nr.reduce_noise(y=speech, sr=verifier.SAMPLE_RATE, prop_decrease=0.7)
+        anti_spoof_report(audio, verifier.SAMPLE_RATE, mode="full")
+    except Exception as e:
+        print(f"[WARNING] Pipeline warm-up failed: {e}")
+
+    print(f"[SUCCESS] Application loaded in {time.perf_counter() - started:.2f}s")
+    return server
+
+
+# =============================
+# WORKER
+# =============================
+def run_worker(server, sock, index, threads, cache_watch, channel):
+    """Child process body; never returns."""
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        os.environ["EMBEDDING_CACHE_WATCH"] = cache_watch
+
+        import torch
+        import uvicorn
+
+        torch.set_num_threads(threads)
+        # New DB client and change stream; model, cohort and caches are inherited
+        server.verifier.after_fork()
+        # Results published here go through the parent to every worker
+        server.broker.relay_through(channel)
+
+        print(f"[INFO] Worker {index} up (pid {os.getpid()}, {threads} torch threads)")
+        config = uvicorn.Config(server.app, log_level=os.getenv("LOG_LEVEL", "info"))
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+# =============================
+# SUPERVISOR
+# =============================
+class Supervisor:
+    def __init__(self, server, sock, workers, threads, cache_watch):
+        self.server = server
+        self.sock = sock
+        self.size = workers
+        self.threads = threads
+        self.cache_watch = cache_watch
+        self.workers = {}  # pid -> (index, started_at)
+        self.channels = {}  # pid -> parent end of the worker's result socketpair
+        self.pending = {}  # pid -> partial line received from the worker
+        self.selector = selectors.DefaultSelector()
+        self.crashes = [0] * workers
+        self.stopping = False
+
+    def spawn(self, index):
+        parent_end, child_end = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            parent_end.close()
+            for channel in self.channels.values():
+                channel.close()
+            run_worker(self.server, self.sock, index, self.threads, self.cache_watch, child_end)
+        child_end.close()
+        parent_end.settimeout(RELAY_SEND_TIMEOUT)
+        self.workers[pid] = (index, time.monotonic())
+        self.channels[pid] = parent_end
+        self.pending[pid] = b""
+        self.selector.register(parent_end, selectors.EVENT_READ, pid)
+        return pid
+
+    # -----------------------------
+    # Result relay
+    # -----------------------------
+    def relay(self, timeout):
+        """Waits up to timeout for results from workers and forwards each to all workers."""
+        for key, _ in self.selector.select(timeout):
+            pid = key.data
+            try:
+                data = key.fileobj.recv(65536)
+            except (OSError, socket.timeout):
+                data = b""
+            if not data:
+                self._close_channel(pid)
+                continue
+            *lines, self.pending[pid] = (self.pending[pid] + data).split(b"\n")
+            for line in lines:
+                if line:
+                    self._broadcast(line + b"\n")
+
+    def _broadcast(self, line):
+        for pid, channel in list(self.channels.items()):
+            try:
+                channel.sendall(line)
+            except (OSError, socket.timeout) as e:
+                index = self.workers.get(pid, ("?",))[0]
+                print(f"[WARNING] Could not relay a result to worker {index} (pid {pid}): {e}")
+
+    def _close_channel(self, pid):
+        channel = self.channels.pop(pid, None)
+        self.pending.pop(pid, None)
+        if channel is not None:
+            self.selector.unregister(channel)
+            channel.close()
+
+    def run(self):
+        for index in range(self.size):
+            self.spawn(index)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        next_report = time.monotonic() + REPORT_SECONDS
+        while not self.stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in self.workers:
+                self._restart(pid, status)
+                continue
+
+            if time.monotonic() >= next_report:
+                self.report()
+                next_report = time.monotonic() + REPORT_SECONDS
+            self.relay(timeout=0.5)
+
+        self.shutdown()
+
+    def _restart(self, pid, status):
+        index, started_at = self.workers.pop(pid)
+        self._close_channel(pid)
+        uptime = time.monotonic() - started_at
+        print(f"[WARNING] Worker {index} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)} after {uptime:.0f}s")
+        if self.stopping:
+            return
+
+        if uptime < MIN_UPTIME:
+            self.crashes[index] += 1
+            delay = min(MAX_BACKOFF, 2 ** (self.crashes[index] - 1))
+            print(f"[WARNING] Worker {index} is crash-looping; restarting in {delay:.0f}s")
+            deadline = time.monotonic() + delay
+            while time.monotonic() < deadline and not self.stopping:
+                # Keep relaying for the healthy workers while this one waits
+                self.relay(timeout=0.2)
+            if self.stopping:
+                return
+        else:
+            self.crashes[index] = 0
+        self.spawn(index)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def shutdown(self):
+        print(f"[INFO] Stopping {len(self.workers)} workers...")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + SHUTDOWN_GRACE
+        while self.workers and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.workers.pop(pid, None)
+            else:
+                time.sleep(0.2)
+
+        for pid in list(self.workers):
+            print(f"[WARNING] Worker pid {pid} did not stop in {SHUTDOWN_GRACE:.0f}s; killing")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.workers.clear()
+        for pid in list(self.channels):
+            self._close_channel(pid)
+        print("[SUCCESS] All workers stopped")
+
+    def report(self):
+        """Logs each process's memory; total PSS is what the node really pays for all of them."""
+        mb = lambda n: n / (1024 * 1024)
+        parent = process_memory()
+        if not parent:
+            return
+        total_pss = parent["pss"]
+        uss = []
+        for pid, (index, _) in sorted(self.workers.items(), key=lambda item: item[1][0]):
+            mem = process_memory(pid)
+            if not mem:
+                continue
+            total_pss += mem["pss"]
+            uss.append(mem["uss"])
+            print(
+                f"[METRIC] worker={index} pid={pid} rss_mb={mb(mem['rss']):.0f} pss_mb={mb(mem['pss']):.0f} "
+                f"uss_mb={mb(mem['uss']):.0f} shared_mb={mb(mem['shared']):.0f}"
+            )
+        if uss:
+            print(
+                f"[METRIC] parent_pss_mb={mb(parent['pss']):.0f} total_pss_mb={mb(total_pss):.0f} "
+                f"mean_worker_uss_mb={mb(sum(uss) / len(uss)):.0f} workers={len(uss)}"
+            )
+
+
+def main():
+    load_dotenv()
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Pre-fork server: load the model once, fork N workers")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("PREFORK_WORKERS", str(cpus))))
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5000")))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("TORCH_NUM_THREADS", "0")),
+                        help="Torch intra-op threads per worker (default: cores / workers)")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        raise SystemExit("[ERROR] prefork.py needs os.fork (Linux/macOS); run server.py instead")
+    threads = args.threads or max(1, cpus // args.workers)
+
+    # The parent runs torch single-threaded so no OpenMP pool exists at fork time;
+    # each worker sizes its own pool after the fork
+    os.environ["TORCH_NUM_THREADS"] = "1"
+    os.environ["TORCH_INTEROP_THREADS"] = "1"
+    # The change-stream thread is started per worker, after the fork
+    cache_watch = os.environ.get("EMBEDDING_CACHE_WATCH", "1")
+    os.environ["EMBEDDING_CACHE_WATCH"] = "0"
+
+    print(f"[START] Pre-fork server: {args.workers} workers x {threads} torch threads")
+    server = load_app()
+
+    import db
+
+    if args.workers > 1:
+        if db.is_memory():
+            print("[WARNING] MONGO_URI=memory:// gives every worker its own store; enrollments are not shared")
+        print("[INFO] Clip cache is per worker: retry reuse and call_id replay detection only see that worker's requests")
+    # The parent no longer needs MongoDB; close it so no pool/monitor threads exist at fork time
+    db.reset_client(close=True)
+
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    sock.set_inheritable(True)
+    print(f"[INFO] Listening on http://{args.host}:{args.port}")
+
+    # Objects loaded so far are never collected; keeping gc from touching them keeps their pages shared
+    gc.collect()
+    gc.freeze()
+    parent = process_memory()
+    if parent:
+        print(f"[METRIC] parent_rss_mb={parent['rss'] / (1024 * 1024):.0f} (loaded model and libraries)")
+
+    Supervisor(server, sock, args.workers, threads, cache_watch).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# profile_store.py
+"""
+Atomic multi-sample voice profiles.
+
+Each profile keeps a running embedding_sum (BSON array of doubles) and a
+sample_count that are updated in one server-side pipeline update, so
+concurrent enrollment samples for the same user never overwrite each other.
+The normalized, packed `embedding` read by verification is derived from the
+sum and written with a compare-and-swap on sample_count; readers fall back to
+normalizing embedding_sum while that write is still in flight.
+
+Requires MongoDB 4.2+ (pipeline updates) and a unique index on user_id.
+"""
+import time
+
+import numpy as np
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from embedding_store import decode_embedding, encode_embedding
+
+
+def ensure_indexes(collection):
+    try:
+        collection.create_index("user_id", unique=True)
+    except Exception as e:
+        # Existing duplicate profiles block the index; enrollment still works, just not race-safe on first insert
+        print(f"[WARNING] Could not create unique user_id index: {e}")
+
+
+def _sum_pipeline(total, count, fields, sample_ids=None):
+    """
+    Pipeline update adding total to embedding_sum and count to sample_count.
+    sample_ids, if given, are appended to the profile's sample_ids.
+    """
+    total = [float(x) for x in total]
+    zeros = [0.0] * len(total)
+    stage = {
+        "embedding_sum": {
+            "$map": {
+                "input": {"$zip": {"inputs": [
+                    {"$ifNull": ["$embedding_sum", {"$literal": zeros}]},
+                    {"$literal": total},
+                ]}},
+                "as": "pair",
+                "in": {"$add": [{"$arrayElemAt": ["$$pair", 0]}, {"$arrayElemAt": ["$$pair", 1]}]},
+            }
+        },
+        "sample_count": {"$add": [{"$ifNull": ["$sample_count", 0]}, count]},
+    }
+    if sample_ids:
+        stage["sample_ids"] = {"$concatArrays": [{"$ifNull": ["$sample_ids", []]}, {"$literal": list(sample_ids)}]}
+    for key, value in fields.items():
+        stage[key] = {"$literal": value}
+    return [{"$set": stage}]
+
+
+def seed_legacy_sum(collection, doc):
+    """
+    Profiles written before running sums have only a normalized `embedding`.
+    Seeds embedding_sum = embedding * sample_count once; losing the race is fine.
+    """
+    if not doc or "embedding_sum" in doc or "embedding" not in doc:
+        return
+    count = doc.get("sample_count", 1)
+    seed = decode_embedding(doc["embedding"]).astype(np.float64) * count
+    collection.update_one(
+        {"_id": doc["_id"], "embedding_sum": {"$exists": False}},
+        {"$set": {"embedding_sum": seed.tolist(), "sample_count": count}},
+    )
+
+
+def publish_embedding(collection, doc):
+    """Writes the normalized packed embedding for the sum/count in doc, unless a newer sample landed."""
+    total = np.asarray(doc["embedding_sum"], dtype=np.float64)
+    embedding = total / np.linalg.norm(total)
+    collection.update_one(
+        {"_id": doc["_id"], "sample_count": doc["sample_count"]},
+        {"$set": {"embedding": encode_embedding(embedding), "embedding_count": doc["sample_count"]}},
+    )
+    return embedding
+
+
+def add_samples(collection, user_id, total, count=1, fields=None):
+    """
+    Atomically adds `count` normalized embeddings (summed into `total`) to user_id's profile.
+    Returns (normalized_embedding, sample_count).
+    """
+    fields = dict(fields or {})
+    fields.setdefault("user_id", user_id)
+    fields.setdefault("status", "enrolled")
+    fields.setdefault("embedding_dim", len(total))
+    fields.setdefault("timestamp", time.time())
+
+    existing = collection.find_one(
+        {"user_id": user_id},
+        {"embedding": 1, "sample_count": 1, "embedding_sum": {"$slice": 1}},
+    )
+    seed_legacy_sum(collection, existing)
+
+    for attempt in range(2):
+        try:
+            doc = collection.find_one_and_update(
+                {"user_id": user_id},
+                _sum_pipeline(total, count, fields),
+                projection={"embedding_sum": 1, "sample_count": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            break
+        except DuplicateKeyError:
+            # Two first-time upserts raced; the unique index let one win, retry as an update
+            if attempt:
+                raise
+
+    return publish_embedding(collection, doc), doc["sample_count"]
+
+
+def applied_sample_ids(collection, user_ids):
+    """{user_id: set of sample_ids already summed into the profile}."""
+    return {
+        doc["user_id"]: set(doc.get("sample_ids") or ())
+        for doc in collection.find({"user_id": {"$in": list(user_ids)}}, {"user_id": 1, "sample_ids": 1})
+    }
+
+
+def add_samples_bulk(collection, samples, sample_ids=None):
+    """
+    samples: {user_id: (total, count, fields)}. One bulk_write for the sums,
+    then one for the published embeddings.
+
+    sample_ids: optional {user_id: [ids]} naming the samples in each total. A
+    user's update only applies if none of its ids is already on the profile,
+    so replaying a write after a crash does not count the samples twice.
+    Only users without a profile are upserted: for existing ones a filter
+    that matches nothing must not insert a second profile, with or without
+    the unique user_id index. Returns the number of users updated.
+    """
+    sample_ids = sample_ids or {}
+    users = list(samples)
+    existing = {doc["user_id"] for doc in collection.find({"user_id": {"$in": users}}, {"user_id": 1})}
+    for doc in collection.find(
+        {"user_id": {"$in": users}, "embedding_sum": {"$exists": False}},
+        {"embedding": 1, "sample_count": 1},
+    ):
+        seed_legacy_sum(collection, doc)
+
+    ops = []
+    for user_id, (total, count, fields) in samples.items():
+        fields = dict(fields or {})
+        fields.setdefault("user_id", user_id)
+        fields.setdefault("status", "enrolled")
+        fields.setdefault("embedding_dim", len(total))
+        fields.setdefault("timestamp", time.time())
+        ids = sample_ids.get(user_id)
+        query = {"user_id": user_id}
+        if ids:
+            query["sample_ids"] = {"$nin": list(ids)}
+        ops.append((query, _sum_pipeline(total, count, fields, ids), user_id not in existing))
+
+    applied = len(ops)
+    if ops:
+        try:
+            result = collection.bulk_write([UpdateOne(q, u, upsert=new) for q, u, new in ops], ordered=False)
+            # Unmatched updates are existing profiles that already held these sample_ids
+            applied = result.matched_count + result.upserted_count
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            # Another writer created the profile after the lookup above. Retrying as a
+            # plain update applies these samples, or matches nothing if it added them.
+            retry = [ops[err["index"]] for err in errors]
+            result = collection.bulk_write([UpdateOne(q, u) for q, u, _ in retry], ordered=False)
+            applied = e.details.get("nMatched", 0) + e.details.get("nUpserted", 0) + result.matched_count
+            if result.matched_count < len(retry):
+                print(f"[INFO] {len(retry) - result.matched_count} user(s) already had these samples; skipped")
+
+    publish = []
+    for doc in collection.find({"user_id": {"$in": users}}, {"embedding_sum": 1, "sample_count": 1}):
+        total = np.asarray(doc["embedding_sum"], dtype=np.float64)
+        publish.append(UpdateOne(
+            {"_id": doc["_id"], "sample_count": doc["sample_count"]},
+            {"$set": {
+                "embedding": encode_embedding(total / np.linalg.norm(total)),
+                "embedding_count": doc["sample_count"],
+            }},
+        ))
+    if publish:
+        collection.bulk_write(publish, ordered=False)
+    return applied
+
+
+def read_embedding(collection, doc):
+    """
+    Normalized enrolled embedding from a profile fetched with
+    {"embedding", "embedding_count", "sample_count"}; None if not enrolled.
+    """
+    if not doc:
+        return None
+    if "embedding" in doc and doc.get("embedding_count", doc.get("sample_count")) == doc.get("sample_count"):
+        return decode_embedding(doc["embedding"])
+
+    # Published embedding lags a just-added sample; normalize the sum instead
+    full = collection.find_one({"_id": doc["_id"]}, {"embedding_sum": 1})
+    if full and "embedding_sum" in full:
+        total = np.asarray(full["embedding_sum"], dtype=np.float64)
+        return (total / np.linalg.norm(total)).astype(np.float32)
+    return decode_embedding(doc["embedding"]) if "embedding" in doc else None
@@ -0,0 +1,183 @@
+# result_broker.py
+"""
+In-process publish/subscribe for verification results.
+
+Results are keyed by request_id. Subscribers waiting on that id (or on all
+results) are woken the moment publish() runs, and the last results are kept
+for `ttl` seconds so a subscriber that connects after the decision still
+receives it. Serialized as Server-Sent Events by server.py; stream() is for
+threaded servers, astream() for asyncio ones.
+
+Under prefork.py each worker has its own broker. relay_through() connects it
+to the parent, which forwards every published result to all workers, so a
+watcher push that lands on one worker reaches subscribers on every worker.
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultBroker:
+    def __init__(self, ttl=60.0, max_results=1000):
+        self.ttl = float(ttl)
+        self.max_results = int(max_results)
+        self._results = OrderedDict()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._relay = None
+        self._relay_lock = threading.Lock()
+
+    def publish(self, result):
+        if self._relay is not None:
+            line = (json.dumps(result, default=str) + "\n").encode()
+            try:
+                with self._relay_lock:
+                    self._relay.sendall(line)
+                # Delivered here too once the parent echoes it back
+                return
+            except OSError as e:
+                print(f"[WARNING] Result relay failed ({e}); publishing to this worker only")
+                self._relay = None
+        self._deliver(result)
+
+    def relay_through(self, channel):
+        """
+        Sends every publish() over channel (a socket to prefork.py's parent) and
+        delivers the results that arrive on it, from any worker, locally.
+        """
+        self._relay = channel
+
+        def receive():
+            try:
+                with channel.makefile("rb") as lines:
+                    for line in lines:
+                        try:
+                            self._deliver(json.loads(line))
+                        except ValueError:
+                            continue
+            except OSError:
+                pass
+            print("[WARNING] Result relay closed; publishing to this worker only")
+            self._relay = None
+
+        threading.Thread(target=receive, name="result-relay", daemon=True).start()
+
+    def _deliver(self, result):
+        request_id = result.get("request_id")
+        now = time.time()
+        with self._lock:
+            if request_id:
+                self._results[request_id] = (result, now)
+                self._results.move_to_end(request_id)
+            self._expire(now)
+            targets = list(self._subscribers.get(request_id, ())) + list(self._subscribers.get(None, ()))
+        for deliver in targets:
+            deliver(result)
+
+    def latest(self, request_id):
+        with self._lock:
+            entry = self._results.get(request_id)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def subscribe(self, request_id=None, deliver=None):
+        """
+        Registers deliver(result) for request_id (all results if None). Without
+        deliver, returns a queue.Queue that receives the results.
+        """
+        q = None
+        if deliver is None:
+            q = queue.Queue()
+            deliver = q.put
+        with self._lock:
+            self._subscribers.setdefault(request_id, set()).add(deliver)
+        return q if q is not None else deliver
+
+    def unsubscribe(self, request_id, deliver):
+        if isinstance(deliver, queue.Queue):
+            deliver = deliver.put
+        with self._lock:
+            subscribers = self._subscribers.get(request_id)
+            if subscribers is not None:
+                subscribers.discard(deliver)
+                if not subscribers:
+                    del self._subscribers[request_id]
+
+    def stream(self, request_id=None, timeout=30.0, keepalive=15.0):
+        """
+        Yields SSE frames. With a request_id the stream ends after that result
+        (or after timeout); without one it forwards every result until the client leaves.
+        """
+        q = self.subscribe(request_id)
+        try:
+            if request_id is not None:
+                done = self.latest(request_id)
+                if done is not None:
+                    yield _frame(done)
+                    return
+
+            deadline = time.monotonic() + timeout if request_id is not None else None
+            while True:
+                wait = keepalive
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        yield _frame({"request_id": request_id, "status": "timeout"}, event="timeout")
+                        return
+                try:
+                    result = q.get(timeout=wait)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield _frame(result)
+                if request_id is not None:
+                    return
+        finally:
+            self.unsubscribe(request_id, q)
+
+    async def astream(self, request_id=None, timeout=30.0, keepalive=15.0):
+        """stream() for asyncio servers: waits on the event loop instead of a thread."""
+        loop = asyncio.get_running_loop()
+        aq = asyncio.Queue()
+        deliver = self.subscribe(request_id, lambda result: loop.call_soon_threadsafe(aq.put_nowait, result))
+        try:
+            if request_id is not None:
+                done = self.latest(request_id)
+                if done is not None:
+                    yield _frame(done)
+                    return
+
+            deadline = loop.time() + timeout if request_id is not None else None
+            while True:
+                wait = keepalive
+                if deadline is not None:
+                    wait = min(wait, deadline - loop.time())
+                    if wait <= 0:
+                        yield _frame({"request_id": request_id, "status": "timeout"}, event="timeout")
+                        return
+                try:
+                    result = await asyncio.wait_for(aq.get(), timeout=wait)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _frame(result)
+                if request_id is not None:
+                    return
+        finally:
+            self.unsubscribe(request_id, deliver)
+
+    def _expire(self, now):
+        while self._results:
+            request_id, (_, published_at) = next(iter(self._results.items()))
+            if now - published_at <= self.ttl and len(self._results) <= self.max_results:
+                break
+            self._results.popitem(last=False)
+
+
+def _frame(result, event="result"):
+    return f"event: {event}\ndata: {json.dumps(result, default=str)}\n\n"
@@ -1,135 +1,317 @@
 import os
-import json
-import time
+import asyncio
+import hmac
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, request, send_from_directory, jsonify
-from flask_cors import CORS
-from pymongo import MongoClient
+
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = Flask(__name__, static_folder='agent_ui')
-CORS(app)
-
 DATA_FOLDER = 'data'
 os.makedirs(DATA_FOLDER, exist_ok=True)
 
-# DB SETUP
-mongo_uri = os.getenv("MONGO_URI")
-client = MongoClient(mongo_uri)
-collection = client["voice_authentication"]["voice_prints"]
+# Request bodies over this size (plus multipart overhead) get 413
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Threads running decode / anti-spoof / embedding; concurrent calls share ECAPA batches
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "4"))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def error(message, status_code, **extra):
+    return JSONResponse({"error": message, **extra}, status_code=status_code)
+
+
+class BodySizeLimit:
+    """
+    ASGI middleware that counts request body bytes as they are received and
+    answers 413 once max_bytes is passed. Unlike a Content-Length check this
+    also covers chunked uploads, and it stops reading before Starlette has
+    buffered or spooled the whole body.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await error("Upload too large", 413)(scope, receive, send)
+
+        received = 0
+        exceeded = False
+        responded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                raise UploadTooLarge()
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal responded
+            if exceeded:
+                # The route turned the aborted read into its own error (e.g. a 400 from form parsing)
+                if message["type"] == "http.response.start" and not responded:
+                    responded = True
+                    await error("Upload too large", 413)(scope, receive, send)
+                return
+            responded = responded or message["type"] == "http.response.start"
+            await send(message)
 
-# INITIALIZE VERIFIER
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not responded:
+            await error("Upload too large", 413)(scope, receive, send)
+
+
+app = FastAPI()
+# Multipart framing adds a little on top of the audio itself
+app.add_middleware(BodySizeLimit, max_bytes=MAX_UPLOAD_BYTES + 64 * 1024)
+# Added last so it is outermost and 413s carry CORS headers too
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+# INITIALIZE VERIFIER (opens the process's pooled DB client, see db.py)
+import db
+from file_handoff import write_atomic
 from voice_verification_system import VoiceVerifier
 verifier = VoiceVerifier()
+inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+from instrumentation import REGISTRY, process_memory
+from result_broker import ResultBroker
+
+# Verification results pushed to dashboards over /events as soon as they exist
+broker = ResultBroker(ttl=float(os.getenv("RESULT_TTL_SECONDS", "60")))
+# Required on POST /results and on the all-results /events stream; without it
+# /results only accepts loopback clients and the all-results stream is off
+RESULT_PUSH_TOKEN = os.getenv("RESULT_PUSH_TOKEN")
+LOOPBACK_HOSTS = {"127.0.0.1", "::1"}
+REGISTRY.gauge("voice_startup_seconds", "Time for VoiceVerifier to become ready.", lambda: verifier.startup_seconds)
+REGISTRY.gauge("voice_embedding_cache_hits", "Enrolled-print cache hits.", lambda: verifier.embedding_cache.stats()["hits"])
+REGISTRY.gauge("voice_embedding_cache_misses", "Enrolled-print cache misses.", lambda: verifier.embedding_cache.stats()["misses"])
+REGISTRY.gauge("voice_embedding_batches", "ECAPA batches run.", lambda: verifier.embedder.stats()["batches"])
+REGISTRY.gauge("voice_embedding_batch_fill", "Mean fill ratio of recent ECAPA batches.", lambda: verifier.embedder.stats()["mean_fill"])
+REGISTRY.gauge("voice_clip_cache_hits", "Clips whose analysis was reused from the PCM-hash cache.", lambda: verifier.clip_cache.stats()["hits"])
+REGISTRY.gauge("voice_replays_detected", "Clips seen earlier under a different call_id.", lambda: verifier.clip_cache.stats()["replays"])
+REGISTRY.gauge("voice_inference_queue", "Inference jobs waiting for a worker thread.", lambda: inference_pool._work_queue.qsize())
+REGISTRY.gauge("voice_process_pss_bytes", "Proportional resident memory of this process (shared pages split).", lambda: process_memory().get("pss", 0))
+REGISTRY.gauge("voice_process_uss_bytes", "Memory held only by this process.", lambda: process_memory().get("uss", 0))
+
+
+async def read_upload(audio):
+    """Reads an upload into memory in chunks, refusing anything over MAX_UPLOAD_BYTES."""
+    buffer = bytearray()
+    while True:
+        chunk = await audio.read(64 * 1024)
+        if not chunk:
+            return bytes(buffer)
+        buffer += chunk
+        if len(buffer) > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge()
+
+
+def has_result_token(request, token=None):
+    """True if the request carries RESULT_PUSH_TOKEN (X-Result-Token header or ?token=)."""
+    supplied = request.headers.get('X-Result-Token') or token
+    return bool(RESULT_PUSH_TOKEN and supplied) and hmac.compare_digest(supplied, RESULT_PUSH_TOKEN)
+
+
+def is_loopback(request):
+    return request.client is not None and request.client.host in LOOPBACK_HOSTS
+
+
+async def run_inference(fn, *args, **kwargs):
+    """Runs a heavy pipeline call off the event loop so light routes stay responsive."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_pool, lambda: fn(*args, **kwargs))
 
 
-@app.route('/')
-def index():
-    return send_from_directory('agent_ui', 'index.html')
+@app.get('/health')
+async def health():
+    return {"status": "ok", "startup_seconds": verifier.startup_seconds}
 
-@app.route('/<path:path>')
-def serve_static(path):
-    return send_from_directory('agent_ui', path)
+@app.get('/metrics')
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type='text/plain; version=0.0.4')
 
-@app.route('/login', methods=['POST'])
-def login():
-    data = request.json
+@app.post('/login')
+async def login(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return error("JSON body with user_id required", 400)
     user_id = data.get('user_id')
-    
+
     if not user_id:
-        return jsonify({"error": "User ID required"}), 400
-        
-    user = collection.find_one({"user_id": user_id})
-    if user:
-        return jsonify({"message": "Login successful"}), 200
+        return error("User ID required", 400)
+
+    if await run_in_threadpool(db.user_exists, user_id):
+        return {"message": "Login successful"}
     else:
-        return jsonify({"error": "User ID not found"}), 401
-
-@app.route('/upload', methods=['POST'])
-def upload_audio():
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
-    
-    audio_file = request.files['audio']
-    user_id = request.form.get('user_id', 'unknown') # Get ID from form
-    
-    if audio_file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return error("User ID not found", 401)
+
+@app.post('/upload')
+async def upload_audio(
+    request: Request,
+    audio: UploadFile = File(None),
+    user_id: str = Form('unknown'),  # Get ID from form
+    request_id: str = Form(None),
+):
+    if audio is None:
+        return error("No audio file provided", 400)
+    if audio.filename == '':
+        return error("No selected file", 400)
+
+    request_id = request.headers.get('X-Request-ID') or request_id or uuid.uuid4().hex
+    request_id = "".join(c for c in request_id if c.isalnum() or c == "-")[:64] or uuid.uuid4().hex
+
+    try:
+        contents = await read_upload(audio)
+    except UploadTooLarge:
+        return error("Upload too large", 413)
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    # Save with USER_ID in filename
-    filename = f"voice_{user_id}_{timestamp}.wav"
+    # Save with USER_ID and REQUEST_ID in filename; watcher.py reports the result under that id
+    filename = f"voice_{user_id}_{timestamp}_{request_id}.wav"
     save_path = os.path.join(DATA_FOLDER, filename)
-    
-    audio_file.save(save_path)
+
+    # Written under a temp name and renamed, so watcher.py only ever sees the complete file
+    await run_in_threadpool(write_atomic, save_path, contents)
     print(f"[SUCCESS] Audio saved for {user_id}: {save_path}")
-    
-    return jsonify({"message": "File uploaded successfully", "filename": filename}), 200
-
-@app.route('/enroll', methods=['POST'])
-def enroll():
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
-    
-    audio_file = request.files['audio']
-    user_id = request.form.get('user_id')
-    
+
+    return {"message": "File uploaded successfully", "filename": filename, "request_id": request_id}
+
+@app.post('/verify')
+async def verify(
+    request: Request,
+    audio: UploadFile = File(None),
+    user_id: str = Form(None),
+    request_id: str = Form(None),
+    call_id: str = Form(None),
+):
+    """Runs verification on the uploaded audio and returns the decision directly."""
+    request_id = request.headers.get('X-Request-ID') or request_id or uuid.uuid4().hex
+    call_id = request.headers.get('X-Call-ID') or call_id
+
+    if audio is None:
+        return error("No audio file provided", 400, request_id=request_id)
+    if not user_id:
+        return error("User ID required", 400, request_id=request_id)
+    if audio.filename == '':
+        return error("No selected file", 400, request_id=request_id)
+
+    try:
+        contents = await read_upload(audio)
+    except UploadTooLarge:
+        return error("Upload too large", 413, request_id=request_id)
+
+    result = await run_inference(verifier.verify_detailed, contents, user_id, request_id=request_id, call_id=call_id)
+    broker.publish(result)
+    status_code = 500 if result["status"] == "error" else 200
+
+    return JSONResponse(result, status_code=status_code, headers={'X-Request-ID': request_id})
+
+@app.post('/enroll')
+async def enroll(audio: UploadFile = File(None), user_id: str = Form(None)):
+    if audio is None:
+        return error("No audio file provided", 400)
     if not user_id:
-        return jsonify({"error": "User ID required"}), 400
-        
-    if audio_file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
-
-    temp_path = os.path.join(DATA_FOLDER, f"enroll_temp_{user_id}.wav")
-    audio_file.save(temp_path)
-    
-    success, message = verifier.enroll_user(temp_path, user_id)
-    
-    # Cleanup temp file (DISABLED FOR DEBUGGING)
-    # if os.path.exists(temp_path):
-    #    os.remove(temp_path)
-        
+        return error("User ID required", 400)
+    if audio.filename == '':
+        return error("No selected file", 400)
+
+    try:
+        contents = await read_upload(audio)
+    except UploadTooLarge:
+        return error("Upload too large", 413)
+
+    # Processed straight from memory, no temp file in data/
+    success, message = await run_inference(verifier.enroll_user, contents, user_id)
+
     if success:
-        return jsonify({"message": message}), 200
+        return {"message": message}
     else:
-        return jsonify({"error": message}), 500
+        return error(message, 500)
 
+@app.post('/results')
+async def publish_result(request: Request):
+    """Verification results from watcher.py workers."""
+    if RESULT_PUSH_TOKEN:
+        if not has_result_token(request):
+            return error("Forbidden", 403)
+    elif not is_loopback(request):
+        # Without a shared secret, only a watcher on this host may publish decisions
+        return error("Forbidden: set RESULT_PUSH_TOKEN to accept results from other hosts", 403)
+    try:
+        result = await request.json()
+    except ValueError:
+        result = None
+    if not result or not result.get('request_id'):
+        return error("request_id required", 400)
+    broker.publish(result)
+    return {"message": "Published"}
 
-import json
-import time
+@app.get('/events')
+async def events(request: Request, request_id: str = None, timeout: float = 30, token: str = None):
+    """
+    Server-Sent Events. ?request_id=... streams that one decision, then closes;
+    without it every result is streamed (e.g. for a supervisor dashboard), which
+    requires RESULT_PUSH_TOKEN as X-Result-Token or ?token=.
+    """
+    if not request_id and not has_result_token(request, token):
+        return error("Forbidden: streaming all results requires RESULT_PUSH_TOKEN", 403)
+    return StreamingResponse(
+        broker.astream(request_id, timeout=timeout),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
-@app.route('/check_status', methods=['GET'])
-def check_status():
-    result_path = os.path.join(DATA_FOLDER, 'result.json')
-    if not os.path.exists(result_path):
-        return jsonify({"status": "waiting"}), 200
-    
-    try:
-        with open(result_path, 'r') as f:
-            data = json.load(f)
-        
-        # Check if result is recent (within last 10 seconds)
-        if time.time() - data.get('timestamp', 0) > 10:
-             return jsonify({"status": "waiting"}), 200
-             
-        return jsonify(data), 200
-    except:
-        return jsonify({"status": "waiting"}), 200
-
-@app.errorhandler(Exception)
-def handle_exception(e):
-    # Pass through HTTP errors
-    if hasattr(e, 'code'):
-        return jsonify({"error": str(e)}), e.code
-    # Handle non-HTTP exceptions only
+@app.get('/check_status')
+async def check_status(request_id: str = None):
+    """Polling fallback for clients without EventSource; reads the in-memory result."""
+    result = broker.latest(request_id) if request_id else None
+    if result is None:
+        return {"status": "waiting"}
+    return result
+
+@app.exception_handler(Exception)
+async def handle_exception(request, e):
     import traceback
     print(f"[ERROR] UNHANDLED SERVER ERROR: {str(e)}")
     print(traceback.format_exc())
-    return jsonify({"error": f"Internal Server Error: {str(e)}"}), 500
+    return error(f"Internal Server Error: {str(e)}", 500)
+
+# Dashboard pages; mounted last so the API routes above take precedence
+app.mount('/', StaticFiles(directory='agent_ui', html=True), name='agent_ui')
 
 if __name__ == '__main__':
+    import uvicorn
+
     print(f"[START] Server running at http://localhost:5000")
     print(f"[INFO] Saving audio to: {os.path.abspath(DATA_FOLDER)}")
-    app.run(port=5000, debug=False)
+    uvicorn.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,185 @@
+# streaming.py
+import time
+
+import numpy as np
+
+from antispoof import anti_spoof_report
+from features import FeatureContext
+
+
+class StreamingVerification:
+    """
+    Verifies a caller while audio is still arriving.
+
+    push() takes raw 16 kHz mono chunks. Speech is gated block by block against
+    the loudest frame heard so far, and once enough new speech has accumulated
+    the embedding and similarity are recomputed. The session ends as soon as
+    the score is clearly above or below the verifier's threshold (by margin),
+    or when max_speech_s of speech has been heard.
+
+    Scores are on the same scale as verify_detailed: AS-norm against
+    ASNORM_THRESHOLD when SCORE_NORM=asnorm and the cohort is ready, raw
+    cosine against THRESHOLD otherwise. margin defaults to 0.1 for cosine and
+    1.0 for AS-norm scores.
+
+    Every evaluation is recorded in decision_points.
+    """
+
+    def __init__(
+        self,
+        verifier,
+        user_id,
+        margin=None,
+        min_speech_s=1.5,
+        interval_s=1.0,
+        max_speech_s=8.0,
+        block_s=0.5,
+        top_db=30,
+    ):
+        self.verifier = verifier
+        self.user_id = user_id
+        self.sr = verifier.SAMPLE_RATE
+        self.asnorm = verifier.score_norm == "asnorm" and verifier.cohort.ready
+        self.threshold = verifier.cohort.threshold if self.asnorm else verifier.THRESHOLD
+        self.margin = margin if margin is not None else (1.0 if self.asnorm else 0.1)
+        self.min_speech = int(min_speech_s * self.sr)
+        self.interval = int(interval_s * self.sr)
+        self.max_speech = int(max_speech_s * self.sr)
+        self.block = int(block_s * self.sr)
+        self.top_db = top_db
+
+        self.started_at = time.time()
+        self.decision_points = []
+        self.decision = None
+        self.result = None
+
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._speech_blocks = []
+        self._speech_len = 0
+        self._audio_len = 0
+        self._peak_rms = 0.0
+        self._last_eval_len = 0
+
+        self._enrolled = verifier._get_enrolled_embedding(user_id)
+        if self._enrolled is None:
+            print("[ERROR] User not enrolled")
+            self._finish("not_enrolled", 0.0)
+
+    @property
+    def decided(self):
+        return self.decision is not None
+
+    def push(self, chunk):
+        """
+        Adds a chunk of audio. Returns the decision point if the similarity was
+        re-evaluated, otherwise None.
+        """
+        if self.decided:
+            return None
+
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+        self._audio_len += len(chunk)
+        self._pending = np.concatenate([self._pending, chunk])
+
+        while len(self._pending) >= self.block:
+            self._accept_block(self._pending[: self.block])
+            self._pending = self._pending[self.block :]
+
+        if self._speech_len < self.min_speech:
+            return None
+        if self._speech_len >= self.max_speech:
+            return self._evaluate(final=True)
+        if self._speech_len - self._last_eval_len >= self.interval:
+            return self._evaluate(final=False)
+        return None
+
+    def finish(self):
+        """Ends the stream and decides on whatever speech was collected."""
+        if self.decided:
+            return self.result
+        if len(self._pending):
+            self._accept_block(self._pending)
+            self._pending = self._pending[:0]
+        if self._speech_len == 0:
+            print("[ERROR] No speech detected")
+            self._finish("no_speech", 0.0)
+            return self.result
+        self._evaluate(final=True)
+        return self.result
+
+    # -----------------------------
+    # Internals
+    # -----------------------------
+    def _accept_block(self, block):
+        ctx = FeatureContext(block, self.sr)
+        # Gate against the loudest frame so far instead of each block's own peak
+        self._peak_rms = max(self._peak_rms, float(np.max(ctx.frame_rms)) if ctx.frame_rms.size else 0.0)
+        if self._peak_rms <= 0:
+            return
+        speech = ctx.speech(top_db=self.top_db, ref=self._peak_rms)
+        if len(speech):
+            self._speech_blocks.append(speech)
+            self._speech_len += len(speech)
+
+    def _evaluate(self, final):
+        self._last_eval_len = self._speech_len
+        speech = np.concatenate(self._speech_blocks)
+        clean_audio = self.verifier._reduce_noise(speech)
+
+        embedding = self.verifier.embedder.embed(clean_audio)
+        similarity = float(np.dot(self._enrolled, embedding))
+        score = similarity
+        if self.asnorm:
+            score = self.verifier.cohort.normalize(self.user_id, self._enrolled, embedding, similarity)
+
+        if score >= self.threshold + self.margin or (final and score >= self.threshold):
+            decision = "accept"
+        elif score <= self.threshold - self.margin or final:
+            decision = "reject"
+        else:
+            decision = "continue"
+
+        spoof_report = None
+        if decision == "accept":
+            spoof_report = anti_spoof_report(clean_audio, self.sr, ctx=FeatureContext(clean_audio, self.sr))
+            if spoof_report["spoofed"]:
+                decision = "spoof"
+
+        point = {
+            "speech_seconds": self._speech_len / self.sr,
+            "audio_seconds": self._audio_len / self.sr,
+            "elapsed": time.time() - self.started_at,
+            "similarity": similarity,
+            "decision": decision,
+        }
+        if self.asnorm:
+            point["normalized_score"] = score
+        self.decision_points.append(point)
+        print(
+            f"[INFO] Stream check at {point['speech_seconds']:.1f}s speech: "
+            f"similarity={similarity:.3f}" + (f" as-norm={score:.3f}" if self.asnorm else "") + f" -> {decision}"
+        )
+
+        if decision == "accept":
+            self._finish("verified", similarity, spoof_report, score)
+        elif decision == "spoof":
+            self._finish("spoof", similarity, spoof_report, score)
+        elif decision == "reject":
+            self._finish("failed", similarity, normalized_score=score)
+        return point
+
+    def _finish(self, status, similarity, spoof_report=None, normalized_score=None):
+        self.decision = status
+        self.result = {
+            "user_id": self.user_id,
+            "status": status,
+            "verified": status == "verified",
+            "similarity": similarity,
+            "threshold": self.threshold,
+            "anti_spoof": spoof_report,
+            "speech_seconds": self._speech_len / self.sr,
+            "decision_points": self.decision_points,
+            "timestamp": time.time(),
+        }
+        if self.asnorm and normalized_score is not None:
+            self.result["normalized_score"] = normalized_score
@@ -1,4 +1,6 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
+from starlette.concurrency import run_in_threadpool
+import io
 import os
 from datetime import datetime
 import soundfile as sf
@@ -10,6 +12,7 @@ DATA_DIR = os.path.join(PROJECT_ROOT, "data")
 os.makedirs(DATA_DIR, exist_ok=True)
 
 MIN_DURATION = 4# seconds
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
 
 @app.get("/")
 def health():
@@ -26,31 +29,38 @@ async def upload_audio(audio: UploadFile = File(...)):
 
     print("Saving to:", file_path)
 
-    contents = await audio.read()
+    contents = await audio.read(MAX_UPLOAD_BYTES + 1)
     print("Bytes received:", len(contents))
 
     if len(contents) == 0:
         raise HTTPException(status_code=400, detail="Empty file received")
+    if len(contents) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Upload too large")
 
-    with open(file_path, "wb") as f:
-        f.write(contents)
-
-    print("✅ File written to disk")
-
+    # Duration comes from the header; nothing touches disk until the upload is accepted
     try:
-        data, sr = sf.read(file_path)
-        duration = len(data) / sr
+        info = sf.info(io.BytesIO(contents))
+        sr = info.samplerate
+        duration = info.frames / sr
         print("Duration:", duration, "Sample rate:", sr)
     except Exception as e:
         print("❌ WAV read failed:", e)
-        os.remove(file_path)
         raise HTTPException(status_code=400, detail="Invalid WAV file")
 
     if duration < MIN_DURATION:
-        print("❌ Audio too short, deleting")
-        os.remove(file_path)
+        print("❌ Audio too short, rejected")
         raise HTTPException(status_code=400, detail="Audio too short")
 
+    def write():
+        # Temp name + rename: a folder watcher never sees a half-written file
+        tmp_path = file_path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(contents)
+        os.replace(tmp_path, file_path)
+
+    await run_in_threadpool(write)
+    print("✅ File written to disk")
+
     print("✅ Upload successful")
 
     return {
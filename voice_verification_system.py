@@ -1,319 +1,464 @@
-# =============================
-# PATCH: Fix SpeechBrain vs Torchaudio (MUST BE FIRST)
-# =============================
 import time
-import torchaudio
-if not hasattr(torchaudio, "list_audio_backends"):
-    def _list_audio_backends():
-        return ["soundfile"]
-    torchaudio.list_audio_backends = _list_audio_backends
-    
-import huggingface_hub
-_original_hf_hub_download = huggingface_hub.hf_hub_download
-def _hf_hub_download_patch(*args, **kwargs):
-    if 'use_auth_token' in kwargs:
-        token = kwargs.pop('use_auth_token')
-        if token is not False and token is not None:
-            kwargs['token'] = token
-    
-    try:
-        return _original_hf_hub_download(*args, **kwargs)
-    except Exception as e:
-        # 404 Client Error: Entry Not Found for custom.py is a known SpeechBrain/HF Hub quirk
-        if "custom.py" in str(e) and ("404" in str(e) or "Entry Not Found" in str(e)):
-            dummy_path = os.path.join(os.getcwd(), "dummy_custom.py")
-            if not os.path.exists(dummy_path):
-                with open(dummy_path, "w") as f:
-                    f.write("# Dummy custom.py to satisfy SpeechBrain loader\n")
-            return dummy_path
-        raise e
-huggingface_hub.hf_hub_download = _hf_hub_download_patch
-
 import argparse
-import librosa
 import soundfile as sf
 import numpy as np
-import torch
 import os
+import io
 import json
-import gridfs
-import noisereduce as nr
-from pymongo import MongoClient
-from speechbrain.inference import EncoderClassifier
+import uuid
 from dotenv import load_dotenv
 
+# Heavy audio libraries are imported on first use (see lazy_imports.py)
+from lazy_imports import lazy_import, preload
+librosa = lazy_import("librosa")
+nr = lazy_import("noisereduce")
+
+from model_loader import apply_inference_mode, configure_threads, load_encoder, warm_up
+from audio_io import load_audio
+from profile_store import add_samples, read_embedding
+import db
+
 # 🔐 NEW: import anti-spoof
-from antispoof import anti_spoof
+from antispoof import anti_spoof_report
+from batch_inference import BatchedEmbedder
+from cohort import CohortScorer
+from embedding_cache import ClipCache, EmbeddingCache
+from features import FeatureContext
+from streaming import StreamingVerification
+from instrumentation import (
+    BufferedLogger, ENROLLMENTS, SIMILARITY, VERIFICATIONS, VERIFY_OUTCOMES, span
+)
 
 class VoiceVerifier:
-    def __init__(self):
+    def __init__(self, collection=None, fs=None):
+        """
+        collection/fs default to MongoDB from MONGO_URI; pass stand-ins
+        (e.g. memory_store) to run without a database.
+        """
         # =============================
         # LOAD ENV VARIABLES
         # =============================
         load_dotenv()
-        self.THRESHOLD = 0.7
-        self.TEMP_WAV = "temp.wav"
-        self.CLEAN_WAV = "clean.wav"
+        started = time.perf_counter()
+        # Raw-cosine accept threshold (see calibrate.py for fitting it to your audio)
+        self.THRESHOLD = float(os.getenv("VERIFY_THRESHOLD", "0.7"))
+        self.SAMPLE_RATE = 16000
+        self.MIN_DURATION = float(os.getenv("MIN_AUDIO_SECONDS", "0.5"))
 
         # =============================
         # 1️⃣ LOAD ECAPA MODEL
         # =============================
-        print("[INFO] Loading ECAPA-TDNN model...")
-        self.classifier = EncoderClassifier.from_hparams(
-            source="speechbrain/spkrec-ecapa-voxceleb",
-            savedir="pretrained_models/spkrec-ecapa-voxceleb"
-        )
+        intra_op, inter_op = configure_threads()
+        print(f"[INFO] Loading ECAPA-TDNN model... (torch threads: {intra_op} intra-op, {inter_op} inter-op)")
+        self.classifier = load_encoder()
         print("[SUCCESS] Model loaded")
 
+        # ECAPA_INFERENCE_MODE=int8 quantizes only if embeddings stay close to fp32
+        self.classifier, self.inference_mode, self.quantization_report = apply_inference_mode(self.classifier)
+
+        # Enrollment debug log, written once per enrollment instead of per line
+        self.enroll_log = BufferedLogger("enroll_debug.log")
+
+        # Concurrent embedding requests share one padded encode_batch call
+        self.embedder = BatchedEmbedder.from_env(self.classifier)
+
         # =============================
         # SETUP DB
         # =============================
-        mongo_uri = os.getenv("MONGO_URI")
-        if not mongo_uri:
-            raise RuntimeError("[ERROR] MONGO_URI missing")
-        
-        self.client = MongoClient(mongo_uri)
-        self.db = self.client["voice_authentication"]
-        self.collection = self.db["voice_prints"]
-        self.fs = gridfs.GridFS(self.db)
-
-    def verify(self, input_audio, user_id="varma"):
-        try:
-            print(f"\n[INFO] Processing file: {input_audio}")
-            
-            # =============================
-            # 2️⃣ LOAD AUDIO
-            # =============================
-            audio, sr = librosa.load(input_audio, sr=16000, mono=True)
-            sf.write(self.TEMP_WAV, audio, 16000)
+        self._shared_db = collection is None
+        if collection is not None:
+            self.client = None
+            self.db = None
+            self.collection = collection
+            self.fs = fs
+        else:
+            # Shared pooled client (db.py); the server reuses the same one
+            self.client = db.get_client()
+            self.db = db.get_db()
+            self.collection = db.get_collection()
+            self.fs = db.get_gridfs()
 
-            # =============================
-            # 3️⃣ REMOVE SILENCE
-            # =============================
-            intervals = librosa.effects.split(audio, top_db=30)
-            if len(intervals) == 0:
-                print("[ERROR] No speech detected")
-                self._save_result(False, 0.0)
-                return False
+        # One profile per user; also makes racing first-time upserts safe
+        db.ensure_indexes(None if collection is None else self.collection)
 
-            speech = np.concatenate([audio[s:e] for s, e in intervals])
-            
-            # =============================
-            # 3.2️⃣ APPLY NOISE REDUCTION
-            # =============================
-            print("[INFO] Applying noise reduction...")
-            try:
-                clean_audio = nr.reduce_noise(
-                    y=speech,
-                    sr=16000,
-                    prop_decrease=0.7
+        # Impostor cohort for AS-norm scoring; opt-in (SCORE_NORM=asnorm) because
+        # ASNORM_THRESHOLD has to be calibrated on your own data first (calibrate.py)
+        self.score_norm = os.getenv("SCORE_NORM", "none")
+        self.cohort = CohortScorer.from_env()
+        if self.score_norm == "asnorm":
+            if os.getenv("ASNORM_THRESHOLD") is None:
+                print(
+                    f"[WARNING] SCORE_NORM=asnorm with the uncalibrated default ASNORM_THRESHOLD={self.cohort.threshold}; "
+                    "run calibrate.py and set it before relying on AS-norm decisions"
                 )
-                print("[SUCCESS] Noise reduction applied")
-            except Exception as nr_err:
-                print(f"[WARNING] Noise reduction failed: {nr_err}. Using speech audio.")
-                clean_audio = speech
+            self.cohort.build(self.collection)
 
-            sf.write(self.CLEAN_WAV, clean_audio, 16000, subtype="PCM_16")
+        # Enrolled prints kept in memory so warm verifications skip MongoDB
+        self.embedding_cache = EmbeddingCache.from_env()
+        if os.getenv("EMBEDDING_CACHE_WATCH", "1") != "0":
+            self.embedding_cache.watch(self.collection)
 
-            # =============================
-            # 🔐 3.5️⃣ ANTI-SPOOFING CHECK
-            # =============================
-            print("[INFO] Running anti-spoofing checks...")
-            spoof_detected = anti_spoof(clean_audio, sr)
+        # Per-clip pipeline results keyed by PCM hash: retries skip the heavy stages
+        self.clip_cache = ClipCache.from_env()
+
+        # =============================
+        # WARM UP
+        # =============================
+        # One dummy inference now so the first real request is not the slow one;
+        # librosa/noisereduce finish importing in the background.
+        warm_up(self.classifier, self.SAMPLE_RATE)
+        self.preload_thread = preload(librosa, nr)
+        self.startup_seconds = time.perf_counter() - started
+        print(f"[SUCCESS] VoiceVerifier ready in {self.startup_seconds:.2f}s")
 
-            if spoof_detected:
-                print("[ERROR] Spoofed / replay / mimic voice detected")
-                self._save_result(False, 0.0)
-                return False
+    def after_fork(self):
+        """
+        Call in a worker forked from the process that built this verifier (prefork.py).
+        The model, cohort and caches are inherited; the DB client and the cache's
+        change-stream thread are not, so they are reopened here.
+        """
+        if self._shared_db:
+            self.client = db.get_client()
+            self.db = db.get_db()
+            self.collection = db.get_collection()
+            self.fs = db.get_gridfs()
+        if os.getenv("EMBEDDING_CACHE_WATCH", "1") != "0":
+            self.embedding_cache.watch(self.collection)
 
-            print("[SUCCESS] Voice passed anti-spoofing")
+    def verify(self, input_audio, user_id="varma", sr=None, call_id=None):
+        """
+        input_audio may be a file path, raw bytes, a file-like object or a NumPy
+        array (pass sr if it is not already 16 kHz). Nothing is written to disk.
+        Returns True if the voice matches user_id.
+        """
+        return self.verify_detailed(input_audio, user_id, sr=sr, call_id=call_id)["verified"]
 
+    def verify_detailed(self, input_audio, user_id="varma", sr=None, request_id=None, call_id=None):
+        """
+        Runs the verification pipeline and returns the full decision:
+        status, similarity score, threshold, anti-spoof details and stage timings.
+        call_id identifies the phone call; the same clip under a different call is a replay.
+        """
+        result = {
+            "request_id": request_id or uuid.uuid4().hex,
+            "user_id": user_id,
+            "status": "failed",
+            "verified": False,
+            "similarity": 0.0,
+            "threshold": self.THRESHOLD,
+            "anti_spoof": None,
+            "timings_ms": {},
+            "timestamp": time.time(),
+        }
+        with span("verify", "total", result["timings_ms"]):
+            self._run_verification(result, input_audio, user_id, sr, call_id)
+
+        VERIFICATIONS.inc(outcome=VERIFY_OUTCOMES.get(result["status"], "error"))
+        if result["status"] in ("verified", "failed"):
+            SIMILARITY.observe(result["similarity"])
+        return result
+
+    def _run_verification(self, result, input_audio, user_id, sr, call_id=None):
+        timings = result["timings_ms"]
+        try:
+            print(f"\n[INFO] Processing input: {self._describe_source(input_audio)}")
+            
+            # =============================
+            # 2️⃣ LOAD AUDIO
             # =============================
-            # 4️⃣ EXTRACT ECAPA EMBEDDING
+            with span("verify", "load", timings):
+                audio, sr = self._load_audio(input_audio, sr)
+
+            # =============================
+            # 2.5️⃣ CLIP CACHE / REPLAY CHECK
             # =============================
-            signal = torch.tensor(clean_audio).unsqueeze(0)
-            with torch.no_grad():
-                embedding = self.classifier.encode_batch(signal)
+            clip_key = ClipCache.key(audio)
+            clip, replay = self.clip_cache.claim(clip_key, call_id)
+            if replay:
+                print(f"[ERROR] Replay detected: clip already used in call {replay['first_call_id']}")
+                result["status"] = "replay"
+                result["replay"] = replay
+                return
+
+            if clip["anti_spoof"] is not None or clip["status"] == "no_speech":
+                print("[INFO] Clip seen before, reusing cached analysis")
+                result["cache_hit"] = True
+            else:
+                clip = self._analyze_clip(audio, sr, timings, clip_key, call_id=call_id)
 
-            embedding = embedding.squeeze().cpu().numpy()
-            embedding = embedding / np.linalg.norm(embedding)
-            print("[SUCCESS] Embedding extracted:", embedding.shape)
+            result["anti_spoof"] = clip["anti_spoof"]
+            if clip["status"] != "ok":
+                result["status"] = clip["status"]
+                return
+            embedding = clip["embedding"]
 
             # =============================
             # 5️⃣ FETCH STORED EMBEDDING
             # =============================
-            doc = self.collection.find_one({"user_id": user_id})
-            if not doc:
+            with span("verify", "lookup", timings):
+                stored_embedding = self._get_enrolled_embedding(user_id)
+            if stored_embedding is None:
                 print("[ERROR] User not enrolled")
-                self._save_result(False, 0.0)
-                return False
-
-            stored_embedding = np.array(doc["embedding"])
-            stored_embedding = stored_embedding / np.linalg.norm(stored_embedding)
+                result["status"] = "not_enrolled"
+                return
 
             # =============================
             # 6️⃣ SIMILARITY CHECK
             # =============================
-            similarity = np.dot(stored_embedding, embedding)
-            similarity_score = float(similarity)
+            similarity_score = float(np.dot(stored_embedding, embedding))
             print("[INFO] Similarity score:", round(similarity_score, 3))
+            result["similarity"] = similarity_score
 
-            is_verified = similarity >= self.THRESHOLD
+            if self.score_norm == "asnorm" and self.cohort.ready:
+                with span("verify", "score_norm", timings):
+                    normalized = self.cohort.normalize(user_id, stored_embedding, embedding, similarity_score)
+                print("[INFO] AS-norm score:", round(normalized, 3))
+                result["normalized_score"] = normalized
+                result["threshold"] = self.cohort.threshold
+                is_verified = normalized >= self.cohort.threshold
+                self.cohort.refresh_if_stale(self.collection)
+            else:
+                is_verified = similarity_score >= self.THRESHOLD
             print("[SUCCESS] VERIFIED" if is_verified else "[ERROR] NOT VERIFIED")
-            
-            self._save_result(is_verified, similarity_score)
-            return is_verified
+
+            result["verified"] = is_verified
+            result["status"] = "verified" if is_verified else "failed"
 
         except Exception as e:
             print(f"[ERROR] Error during verification: {e}")
-            self._save_result(False, 0.0)
-            return False
-
-    def enroll_user(self, input_audio, user_id):
-        log_file = "enroll_debug.log"
-        with open(log_file, "a") as f:
-            f.write(f"\n--- Enrollment started for {user_id} at {time.ctime()} ---\n")
-            f.write(f"File: {input_audio}\n")
+            result["status"] = "error"
+            result["error"] = str(e)
+
+    def _analyze_clip(self, audio, sr, timings, clip_key, call_id=None):
+        """Silence removal, denoise, anti-spoof and embedding for one clip; cached by clip_key."""
+        # =============================
+        # 3️⃣ REMOVE SILENCE
+        # =============================
+        with span("verify", "split", timings):
+            speech = FeatureContext(audio, 16000).speech(top_db=30)
+        if len(speech) == 0:
+            print("[ERROR] No speech detected")
+            return self.clip_cache.put(clip_key, "no_speech", call_id=call_id)
+        
+        # =============================
+        # 3.2️⃣ APPLY NOISE REDUCTION
+        # =============================
+        print("[INFO] Applying noise reduction...")
+        with span("verify", "reduce_noise", timings):
+            clean_audio = self._reduce_noise(speech)
+
+        # =============================
+        # 🔐 3.5️⃣ ANTI-SPOOFING CHECK
+        # =============================
+        print("[INFO] Running anti-spoofing checks...")
+        with span("verify", "anti_spoof", timings):
+            spoof_report = anti_spoof_report(clean_audio, sr, ctx=FeatureContext(clean_audio, sr))
+        if spoof_report["spoofed"]:
+            print("[ERROR] Spoofed / replay / mimic voice detected")
+            return self.clip_cache.put(clip_key, "spoof", anti_spoof=spoof_report, call_id=call_id)
+
+        print("[SUCCESS] Voice passed anti-spoofing")
+
+        # =============================
+        # 4️⃣ EXTRACT ECAPA EMBEDDING
+        # =============================
+        with span("verify", "embed", timings):
+            embedding = self.embedder.embed(clean_audio)
+        print("[SUCCESS] Embedding extracted:", embedding.shape)
+
+        return self.clip_cache.put(
+            clip_key, "ok", embedding=embedding, anti_spoof=spoof_report, clean_audio=clean_audio, call_id=call_id
+        )
+
+    def enroll_user(self, input_audio, user_id, sr=None):
+        """Accepts the same audio inputs as verify(). Returns (success, message)."""
+        with span("enroll", "total"):
+            success, message = self._run_enrollment(input_audio, user_id, sr)
+        ENROLLMENTS.inc(outcome="success" if success else "failed")
+        self.enroll_log.flush()
+        return success, message
+
+    def _run_enrollment(self, input_audio, user_id, sr):
+        log = lambda msg, level="INFO", **fields: self.enroll_log.log(msg, level=level, user_id=user_id, **fields)
+        source = self._describe_source(input_audio)
+        log("Enrollment started", input=source)
             
         try:
             # 1. LOAD AUDIO
-            with open(log_file, "a") as f: f.write(f"Loading audio from {input_audio}...\n")
-            if not os.path.exists(input_audio):
-                with open(log_file, "a") as f: f.write(f"[ERROR] File not found: {input_audio}\n")
-                return False, f"File not found: {input_audio}"
-                
-            file_size = os.path.getsize(input_audio)
-            with open(log_file, "a") as f: f.write(f"File size: {file_size} bytes\n")
-            
-            if file_size == 0:
+            if isinstance(input_audio, (str, os.PathLike)):
+                if not os.path.exists(input_audio):
+                    log("File not found", level="ERROR", path=str(input_audio))
+                    return False, f"File not found: {input_audio}"
+                file_size = os.path.getsize(input_audio)
+                log("Input file", file_size=file_size)
+                if file_size == 0:
+                    return False, "Empty audio file received"
+            elif isinstance(input_audio, (bytes, bytearray, memoryview)) and len(input_audio) == 0:
                 return False, "Empty audio file received"
 
             try:
-                # Try loading with librosa
-                audio, sr = librosa.load(input_audio, sr=16000, mono=True)
+                with span("enroll", "load"):
+                    audio, sr = self._load_audio(input_audio, sr)
             except Exception as load_err:
-                with open(log_file, "a") as f: f.write(f"[ERROR] Librosa load failed: {str(load_err)}\n")
+                log("Audio decode failed", level="ERROR", error=str(load_err))
                 return False, f"Could not load audio file. Please ensure it's a valid audio format. Error: {str(load_err)}"
                 
-            with open(log_file, "a") as f: f.write(f"Audio loaded. Samples: {len(audio)}, Duration: {len(audio)/16000:.2f}s\n")
-            
-            # 2. REMOVE SILENCE
-            with open(log_file, "a") as f: f.write("Removing silence...\n")
-            intervals = librosa.effects.split(audio, top_db=30)
-            with open(log_file, "a") as f: f.write(f"Intervals found: {len(intervals)}\n")
-            
-            if len(intervals) == 0:
-                with open(log_file, "a") as f: f.write("[ERROR] No speech detected\n")
-                return False, "No speech detected"
+            log("Audio loaded", samples=len(audio), duration_s=round(len(audio) / 16000, 2))
 
-            speech = np.concatenate([audio[s:e] for s, e in intervals])
-            with open(log_file, "a") as f: f.write(f"Speech audio length: {len(speech)}\n")
-            
-            # 2.5 APPLY NOISE REDUCTION (from enroll.py)
-            with open(log_file, "a") as f: f.write("Applying noise reduction...\n")
-            try:
-                clean_audio = nr.reduce_noise(
-                    y=speech,
-                    sr=16000,
-                    prop_decrease=0.7
-                )
-                with open(log_file, "a") as f: f.write("[SUCCESS] Noise reduction applied\n")
-            except Exception as nr_err:
-                with open(log_file, "a") as f: f.write(f"[WARNING] Noise reduction failed: {nr_err}. Using speech audio.\n")
-                clean_audio = speech
-
-            # 3. EXTRACT ECAPA EMBEDDING
-            with open(log_file, "a") as f: f.write("Extracting embedding...\n")
-            signal = torch.tensor(clean_audio).unsqueeze(0)
-            with open(log_file, "a") as f: f.write(f"Signal tensor shape: {signal.shape}\n")
-            
-            with torch.no_grad():
-                embedding = self.classifier.encode_batch(signal)
+            # 1.5 CLIP CACHE: a retried upload must not count as a second sample
+            clip_key = ClipCache.key(audio)
+            clip, _ = self.clip_cache.claim(clip_key)
+            if clip["status"] == "no_speech":
+                log("No speech detected", level="ERROR", cached=True)
+                return False, "No speech detected"
+            # Claimed before any work, so a concurrent upload of the same clip is ignored too
+            if not self.clip_cache.claim_enrollment(clip, user_id):
+                log("Duplicate sample ignored", clip=clip_key)
+                return True, "Sample already enrolled"
 
-            embedding = embedding.squeeze().cpu().numpy()
-            embedding = embedding / np.linalg.norm(embedding)
-            with open(log_file, "a") as f: f.write(f"Embedding extracted. Shape: {embedding.shape}\n")
-            
-            # 3.5 STORE CLEANED VOICE IN GRIDFS (from enroll.py)
-            with open(log_file, "a") as f: f.write("Saving cleaned audio to GridFS...\n")
-            # Create a temporary file to save cleaned audio before putting in GridFS
-            temp_clean_path = "temp_clean_enroll.wav"
-            sf.write(temp_clean_path, clean_audio, 16000, subtype="PCM_16")
-            
+            success = False
             try:
-                with open(temp_clean_path, "rb") as f_clean:
-                    voice_file_id = self.fs.put(
-                        f_clean,
-                        filename=f"{user_id}_enrollment.wav",
-                        contentType="audio/wav",
-                        metadata={
-                            "user_id": user_id,
-                            "type": "enrollment_voice",
-                            "timestamp": time.time()
-                        }
-                    )
-                with open(log_file, "a") as f: f.write(f"[SUCCESS] Cleaned audio saved to GridFS (ID: {voice_file_id})\n")
-            except Exception as fs_err:
-                with open(log_file, "a") as f: f.write(f"[WARNING] GridFS save failed: {fs_err}\n")
-                voice_file_id = None
+                success, message = self._enroll_clip(audio, clip, clip_key, user_id, log)
+                return success, message
             finally:
-                if os.path.exists(temp_clean_path):
-                    os.remove(temp_clean_path)
+                if not success:
+                    self.clip_cache.release_enrollment(clip, user_id)
 
-            # 4. STORE IN DB (Multi-sample logic)
-            existing_user = self.collection.find_one({"user_id": user_id})
-            
-            if existing_user and "embedding" in existing_user:
-                with open(log_file, "a") as f: f.write("Merging with existing voice profile...\n")
-                old_emb = np.array(existing_user["embedding"])
-                count = existing_user.get("sample_count", 1)
-                
-                # Moving average update
-                new_count = count + 1
-                embedding = (old_emb * count + embedding) / new_count
-                # Re-normalize
-                embedding = embedding / np.linalg.norm(embedding)
-            else:
-                new_count = 1
+        except Exception as e:
+            import traceback
+            log("Error during enrollment", level="ERROR", error=str(e), traceback=traceback.format_exc())
+            return False, str(e)
 
-            with open(log_file, "a") as f: f.write(f"Saving metadata to MongoDB (Samples: {new_count})...\n")
-            self.collection.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {
+    def _enroll_clip(self, audio, clip, clip_key, user_id, log):
+        """Enrollment after load and clip claim: trim, denoise, embed, archive and store."""
+        if clip["embedding"] is not None and clip["clean_audio"] is not None:
+            # Trimmed, denoised and embedded by an earlier verify/enroll of the same clip
+            log("Reusing cached embedding", clip=clip_key)
+            clean_audio, embedding = clip["clean_audio"], clip["embedding"]
+        else:
+            # 2. REMOVE SILENCE
+            with span("enroll", "split"):
+                audio_ctx = FeatureContext(audio, 16000)
+                intervals = audio_ctx.speech_intervals(top_db=30)
+
+            if len(intervals) == 0:
+                log("No speech detected", level="ERROR")
+                return False, "No speech detected"
+
+            speech = audio_ctx.speech(top_db=30)
+            log("Silence removed", intervals=len(intervals), speech_samples=len(speech))
+
+            clean_audio, embedding = self._enrollment_embedding(speech, log)
+            self.clip_cache.put(clip_key, "ok", embedding=embedding, clean_audio=clean_audio)
+
+        # 3.5 STORE CLEANED VOICE IN GRIDFS (from enroll.py)
+        try:
+            with span("enroll", "gridfs"):
+                voice_file_id = self.fs.put(
+                    self._encode_wav(clean_audio),
+                    filename=f"{user_id}_enrollment.wav",
+                    contentType="audio/wav",
+                    metadata={
                         "user_id": user_id,
-                        "embedding": embedding.tolist(),
-                        "embedding_dim": len(embedding),
-                        "voice_file_id": voice_file_id,
-                        "status": "enrolled",
-                        "sample_count": new_count,
+                        "type": "enrollment_voice",
                         "timestamp": time.time()
                     }
-                },
-                upsert=True
+                )
+            log("Cleaned audio saved to GridFS", voice_file_id=voice_file_id)
+        except Exception as fs_err:
+            log("GridFS save failed", level="WARNING", error=str(fs_err))
+            voice_file_id = None
+
+        # 4. STORE IN DB (Multi-sample logic)
+        # Running sum + count updated atomically server-side, so concurrent
+        # samples for the same user are never lost to a read-modify-write race
+        with span("enroll", "db_write"):
+            embedding, new_count = add_samples(
+                self.collection, user_id, embedding,
+                fields={"voice_file_id": voice_file_id},
             )
-            
-            with open(log_file, "a") as f: f.write("[SUCCESS] Enrollment successful\n")
-            return True, "Enrollment successful"
+        # The sample is committed from here on: invalidate first, and never report failure
+        self.embedding_cache.invalidate(user_id)
+        db.forget_user(user_id)
+        if self.score_norm == "asnorm":
+            try:
+                self.cohort.update(user_id, embedding)
+            except Exception as e:
+                # The next refresh_if_stale rebuild picks the print up
+                log("Cohort update failed", level="WARNING", error=str(e))
 
-        except Exception as e:
-            with open(log_file, "a") as f: f.write(f"[ERROR] Error during enrollment: {str(e)}\n")
-            import traceback
-            with open(log_file, "a") as f: f.write(traceback.format_exc() + "\n")
-            return False, str(e)
+        log("Enrollment successful", sample_count=new_count)
+        return True, "Enrollment successful"
 
-    def _save_result(self, is_verified, similarity):
-        # 7️⃣ WRITE RESULT TO FILE FOR FRONTEND
-        result_data = {
-            "status": "verified" if is_verified else "failed",
-            "similarity": similarity,
-            "timestamp": time.time()
-        }
+    def _enrollment_embedding(self, speech, log):
+        """Denoises trimmed speech and embeds it. Returns (clean_audio, embedding)."""
+        # 2.5 APPLY NOISE REDUCTION (from enroll.py)
+        with span("enroll", "reduce_noise"):
+            clean_audio = self._reduce_noise(speech, log)
+
+        # 3. EXTRACT ECAPA EMBEDDING
+        with span("enroll", "embed"):
+            embedding = self.embedder.embed(clean_audio)
+        log("Embedding extracted", signal_samples=len(clean_audio), shape=list(embedding.shape))
+        return clean_audio, embedding
+
+    def start_stream(self, user_id, **options):
+        """Opens a StreamingVerification session; see streaming.py for the options."""
+        return StreamingVerification(self, user_id, **options)
+
+    def _reduce_noise(self, speech, log=None):
+        """Denoised speech, or speech unchanged if noise reduction fails. log: enrollment logger (else print)."""
         try:
-            with open("data/result.json", "w") as f:
-                json.dump(result_data, f)
-        except Exception as e:
-            print(f"[WARNING] Failed to write result.json: {e}")
+            clean_audio = nr.reduce_noise(
+                y=speech,
+                sr=self.SAMPLE_RATE,
+                prop_decrease=0.7
+            )
+            if log is not None:
+                log("Noise reduction applied")
+            else:
+                print("[SUCCESS] Noise reduction applied")
+            return clean_audio
+        except Exception as nr_err:
+            if log is not None:
+                log("Noise reduction failed, using speech audio", level="WARNING", error=str(nr_err))
+            else:
+                print(f"[WARNING] Noise reduction failed: {nr_err}. Using speech audio.")
+            return speech
+
+    def _load_audio(self, source, sr=None):
+        """Decodes a path, bytes, file-like object or array to mono float32 at 16 kHz."""
+        return load_audio(source, self.SAMPLE_RATE, sr=sr, min_duration=self.MIN_DURATION)
+
+    def _encode_wav(self, audio):
+        """Encodes audio as 16-bit PCM WAV into an in-memory buffer ready for GridFS."""
+        buffer = io.BytesIO()
+        sf.write(buffer, audio, self.SAMPLE_RATE, subtype="PCM_16", format="WAV")
+        buffer.seek(0)
+        return buffer
+
+    @staticmethod
+    def _describe_source(source):
+        if isinstance(source, (str, os.PathLike)):
+            return str(source)
+        if isinstance(source, np.ndarray):
+            return f"array{source.shape}"
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return f"{len(source)} bytes"
+        return getattr(source, "name", type(source).__name__)
+
+    def _get_enrolled_embedding(self, user_id):
+        """Returns the normalized float32 voice print for user_id, or None if not enrolled."""
+        embedding = self.embedding_cache.get(user_id)
+        if embedding is not None:
+            return embedding
+
+        generation = self.embedding_cache.generation(user_id)
+        doc = db.find_profile(user_id, self.collection)
+        embedding = read_embedding(self.collection, doc)
+        if embedding is None:
+            return None
+        return self.embedding_cache.put(user_id, embedding, doc_id=doc.get("_id"), generation=generation)
 
 # Maintain backward compatibility for direct calls if needed
 if __name__ == "__main__":
@@ -323,4 +468,4 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     verifier = VoiceVerifier()
-    verifier.verify(args.audio, args.user_id)
+    print(json.dumps(verifier.verify_detailed(args.audio, args.user_id), indent=2, default=str))
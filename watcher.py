@@ -1,53 +1,230 @@
 import time
 import os
+import json
+import multiprocessing
+import threading
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from voice_verification_system import VoiceVerifier
+
+import db
+from file_handoff import CompletedFileHandler
 
 WATCH_FOLDER = "data"
+NUM_WORKERS = int(os.getenv("WATCHER_WORKERS", str(os.cpu_count() or 1)))
+MAX_PENDING = int(os.getenv("WATCHER_QUEUE_SIZE", "32"))
+DEDUP_WINDOW = 30  # seconds a finished file is still treated as a duplicate
+# Startup scan skips recordings older than this; their callers are long gone
+SCAN_MAX_AGE = float(os.getenv("WATCHER_SCAN_MAX_AGE", "3600"))
+RESULT_PUSH_URL = os.getenv("RESULT_PUSH_URL", "http://localhost:5000/results")
+RESULT_PUSH_TOKEN = os.getenv("RESULT_PUSH_TOKEN")
+WARMUP_TIMEOUT = 600  # seconds to wait for every worker to load its model
+
+# =============================
+# WORKER PROCESS
+# =============================
+_worker_verifier = None
+_ready_barrier = None
+
+def _init_worker(ready_barrier=None):
+    # Each worker loads its own model ONCE and keeps it in memory
+    global _worker_verifier, _ready_barrier
+    _ready_barrier = ready_barrier
+    # A forked worker must not reuse the parent's MongoClient sockets
+    db.reset_client()
+    # Split the cores between workers instead of every worker using all of them
+    os.environ.setdefault("TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // NUM_WORKERS)))
+    os.environ.setdefault("TORCH_INTEROP_THREADS", "1")
+    from voice_verification_system import VoiceVerifier
+    _worker_verifier = VoiceVerifier()
+
+def _worker_ready(_=None):
+    """
+    Warm-up task. Blocks until NUM_WORKERS of these run at once, which is only
+    possible on NUM_WORKERS different (loaded) workers, then returns the pid.
+    """
+    if _ready_barrier is not None:
+        try:
+            _ready_barrier.wait(timeout=WARMUP_TIMEOUT)
+        except threading.BrokenBarrierError:
+            pass
+    return os.getpid()
+
+def _push_result(result):
+    """Hands the decision to server.py, which pushes it to the dashboard over SSE."""
+    if not RESULT_PUSH_URL:
+        return
+    headers = {"Content-Type": "application/json"}
+    if RESULT_PUSH_TOKEN:
+        headers["X-Result-Token"] = RESULT_PUSH_TOKEN
+    req = urllib.request.Request(
+        RESULT_PUSH_URL, data=json.dumps(result, default=str).encode(), headers=headers, method="POST"
+    )
+    try:
+        urllib.request.urlopen(req, timeout=5).close()
+    except Exception as e:
+        print(f"[WARNING] Could not push result {result.get('request_id')}: {e}")
+
+def _verify_job(path, user_id, enqueued_at, request_id=None):
+    started_at = time.time()
+    result = _worker_verifier.verify_detailed(path, user_id=user_id, request_id=request_id)
+    _push_result(result)
+    return {
+        "path": path,
+        "user_id": user_id,
+        "request_id": result["request_id"],
+        "verified": bool(result["verified"]),
+        "wait_time": started_at - enqueued_at,
+        "processing_time": time.time() - started_at,
+    }
+
+# =============================
+# JOB QUEUE
+# =============================
+class VerificationQueue:
+    """
+    Bounded, de-duplicating queue in front of the worker pool.
+    submit() blocks when MAX_PENDING jobs are already queued or running, which
+    holds back the observer thread instead of building an unbounded backlog.
+    """
 
-print("⏳ Initializing Verification System (Loading Models)...")
-# Initialize verifier ONCE to keep model in memory
-voice_verifier = VoiceVerifier()
-print("✅ System Ready. Waiting for calls...")
+    def __init__(self, executor, max_pending):
+        self.executor = executor
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._recent = {}
+        self.completed = 0
+        self.failed = 0
 
-class AudioHandler(FileSystemEventHandler):
-    def on_created(self, event):
-        if event.is_directory:
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def submit(self, path, user_id, request_id=None):
+        key = os.path.abspath(path)
+        now = time.time()
+        with self._lock:
+            if key in self._pending or now - self._recent.get(key, 0) < DEDUP_WINDOW:
+                print(f"[INFO] Duplicate event ignored: {path}")
+                return False
+            self._pending.add(key)
+
+        if not self._slots.acquire(blocking=False):
+            print(f"[WARNING] Queue full ({self.depth - 1} pending), waiting for a free worker...")
+            self._slots.acquire()
+
+        future = self.executor.submit(_verify_job, path, user_id, now, request_id)
+        future.add_done_callback(lambda f: self._on_done(key, f))
+        print(f"[METRIC] queued={os.path.basename(path)} queue_depth={self.depth}")
+        return True
+
+    def _on_done(self, key, future):
+        with self._lock:
+            self._pending.discard(key)
+            self._recent[key] = time.time()
+            # Forget entries outside the dedup window
+            cutoff = time.time() - DEDUP_WINDOW
+            self._recent = {k: t for k, t in self._recent.items() if t >= cutoff}
+        self._slots.release()
+
+        try:
+            job = future.result()
+        except Exception as e:
+            self.failed += 1
+            print(f"[ERROR] Verification job failed for {key}: {e}")
             return
 
-        if event.src_path.lower().endswith((".wav", ".mp3")):
-            print(f"\n🎤 New audio detected: {event.src_path}")
-            
-            # PARSE USER_ID from filename: voice_{userid}_{timestamp}.wav
-            filename = os.path.basename(event.src_path)
-            try:
-                parts = filename.split('_')
-                if len(parts) >= 3:
-                     # parts[0] = voice
-                     # parts[1] = userid
-                     # parts[2...] = timestamp
-                     target_user_id = parts[1]
-                else:
-                    target_user_id = "varma"
-            except:
-                target_user_id = "varma"
-            
-            print(f"👤 Verifying for user: {target_user_id}")
-
-            # Call verify directly in this process (fast!)
-            voice_verifier.verify(event.src_path, user_id=target_user_id)
-
-observer = Observer()
-observer.schedule(AudioHandler(), WATCH_FOLDER, recursive=False)
-observer.start()
-
-print(f"👂 Watching folder: {WATCH_FOLDER}/")
-
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    observer.stop()
-
-observer.join()
+        self.completed += 1
+        print(
+            f"[METRIC] done={os.path.basename(job['path'])} user={job['user_id']} "
+            f"verified={job['verified']} wait_ms={job['wait_time'] * 1000:.0f} "
+            f"processing_ms={job['processing_time'] * 1000:.0f} queue_depth={self.depth}"
+        )
+
+def parse_user_id(filename):
+    # PARSE USER_ID from filename: voice_{userid}_{timestamp}.wav
+    try:
+        parts = filename.split('_')
+        if len(parts) >= 3:
+            # parts[0] = voice
+            # parts[1] = userid
+            # parts[2...] = timestamp
+            return parts[1]
+    except Exception:
+        pass
+    return "varma"
+
+def parse_request_id(filename):
+    # voice_{userid}_{date}_{time}_{request_id}.wav from server.py /upload; older names have none
+    parts = os.path.splitext(filename)[0].split('_')
+    return parts[4] if len(parts) >= 5 else None
+
+class AudioHandler(CompletedFileHandler):
+    """Reacts once per fully written recording (see file_handoff.py), never to a partial file."""
+
+    def __init__(self, jobs):
+        super().__init__(WATCH_FOLDER, self.handle)
+        self.jobs = jobs
+
+    def handle(self, path):
+        print(f"\n🎤 New audio detected: {path}")
+
+        filename = os.path.basename(path)
+        target_user_id = parse_user_id(filename)
+        request_id = parse_request_id(filename)
+
+        # Unknown users are answered from the cached existence check without using a worker
+        try:
+            enrolled = db.user_exists(target_user_id)
+        except Exception as e:
+            print(f"[WARNING] User lookup failed, verifying anyway: {e}")
+            enrolled = True
+        if not enrolled:
+            print(f"[ERROR] User not enrolled: {target_user_id}")
+            if request_id:
+                _push_result({
+                    "request_id": request_id,
+                    "user_id": target_user_id,
+                    "status": "not_enrolled",
+                    "verified": False,
+                    "similarity": 0.0,
+                    "timestamp": time.time(),
+                })
+            return
+
+        print(f"👤 Verifying for user: {target_user_id}")
+        self.jobs.submit(path, target_user_id, request_id)
+
+if __name__ == "__main__":
+    print(f"⏳ Initializing Verification System ({NUM_WORKERS} workers loading models)...")
+    # Shared with the workers at start-up; locks cannot travel in task arguments
+    ready_barrier = multiprocessing.Barrier(NUM_WORKERS)
+    executor = ProcessPoolExecutor(max_workers=NUM_WORKERS, initializer=_init_worker, initargs=(ready_barrier,))
+    # Start every worker now so model loading does not delay the first calls
+    worker_pids = set(executor.map(_worker_ready, range(NUM_WORKERS)))
+    if len(worker_pids) < NUM_WORKERS:
+        print(f"[WARNING] Only {len(worker_pids)} of {NUM_WORKERS} workers finished loading within {WARMUP_TIMEOUT}s")
+    print(f"[INFO] Workers up: {len(worker_pids)}")
+    jobs = VerificationQueue(executor, MAX_PENDING)
+    print("✅ System Ready. Waiting for calls...")
+
+    os.makedirs(WATCH_FOLDER, exist_ok=True)
+    handler = AudioHandler(jobs)
+    observer = Observer()
+    observer.schedule(handler, WATCH_FOLDER, recursive=False)
+    observer.start()
+
+    # Recordings that landed while the watcher was down (after start(), so none slip between)
+    handler.scan(max_age=SCAN_MAX_AGE)
+
+    print(f"👂 Watching folder: {WATCH_FOLDER}/")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        observer.stop()
+
+    observer.join()
+    executor.shutdown(wait=True)